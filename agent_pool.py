@@ -0,0 +1,88 @@
+import os
+import threading
+import time
+from agents import TravelAgents, build_llm, with_listeners
+from tasks import TravelTasks
+from tools.record_replay import build_search_tool, get_recorder
+
+
+def _ms(started):
+    return round((time.perf_counter() - started) * 1000, 2)
+
+
+class AgentPool:
+    """
+    Clients every crew in this process can share, built once instead of per request.
+
+    The expensive parts, the OpenAI client (HTTP connection pool / TLS sessions) and the
+    Serper tool, live here. Each checkout gets its own shallow copy of the LLM config:
+    the copy shares the underlying client but not the listeners or stop words, which are
+    set per run. Agent, Task and Crew objects hold per-run executor state and
+    are still created per request from these pooled parts.
+    """
+
+    def __init__(self):
+        started = time.perf_counter()
+        self.llm = build_llm()
+        self.serper_tool = build_search_tool()
+        self.tasks = TravelTasks()
+        self.startup_ms = _ms(started)
+        self.created_at = time.time()
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.build_count = 0
+        self.build_ms_total = 0.0
+        self.build_ms_max = 0.0
+
+    def travel_agents(self, listeners=None):
+        llm = with_listeners(self.llm, listeners)
+        with self._lock:
+            self.checkouts += 1
+        return TravelAgents(llm=llm, serper_tool=self.serper_tool)
+
+    def record_build(self, build_ms):
+        with self._lock:
+            self.build_count += 1
+            self.build_ms_total += build_ms
+            self.build_ms_max = max(self.build_ms_max, build_ms)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "startup_ms": self.startup_ms,
+                "created_at": self.created_at,
+                "checkouts": self.checkouts,
+                "crew_builds": self.build_count,
+                "avg_build_ms": round(self.build_ms_total / self.build_count, 2) if self.build_count else 0.0,
+                "max_build_ms": round(self.build_ms_max, 2),
+                "recording": get_recorder().stats(),
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_pid = None
+
+
+def get_agent_pool():
+    """Per-process pool, or None when AGENT_POOL=0 (every crew then builds its own clients)."""
+    global _pool, _pool_pid
+    if os.getenv("AGENT_POOL", "1") == "0":
+        return None
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                _pool = AgentPool()
+                _pool_pid = pid
+                print(f"Agent pool ready in {_pool.startup_ms} ms (pid {pid})")
+    return _pool
+
+
+def warm_agent_pool():
+    """Worker-process initializer: build the pool before the first job arrives."""
+    try:
+        get_agent_pool()
+    except Exception as e:
+        print(f"Agent pool warm-up failed: {e}")
@@ -1,28 +1,81 @@
+from typing import Any
+import httpx
 from crewai import Agent
-from langchain_openai import ChatOpenAI
+from crewai.llms.providers.openai.completion import OpenAICompletion
+from openai import AsyncOpenAI, OpenAI
+from pydantic import Field
 from tools.map_tools import MapTools
-from crewai_tools import SerperDevTool
+from tools.record_replay import build_search_tool, get_llm_transport, get_recorder
+import tools.llm_events  # registers the event bus handlers that feed LLM listeners
 import os
 
-class TravelAgents:
-    def __init__(self):
-        api_key = os.getenv("DEEPSEEK_API_KEY")
-        base_url = os.getenv("DEEPSEEK_API_BASE")
-        model = os.getenv("LLM_MODEL") or "deepseek-chat"
+
+class TravelLLM(OpenAICompletion):
+    """
+    DeepSeek (OpenAI-compatible) chat model on CrewAI's native client, which Agent uses as is;
+    any other llm object would be rebuilt from its model and key alone. Calls made through
+    the instance are reported to its `listeners` (tools/llm_events.py). With RECORD_MODE set,
+    the HTTP clients send through the recorder's transport.
+    """
+
+    listeners: list[Any] = Field(default_factory=list, exclude=True)
+
+    def _build_sync_client(self):
+        params = self._get_client_params()
+        transport = get_llm_transport()
+        if transport is not None:
+            params["http_client"] = httpx.Client(transport=transport)
+        return OpenAI(**params)
+
+    def _build_async_client(self):
+        params = self._get_client_params()
+        transport = get_llm_transport()
+        if transport is not None:
+            params["http_client"] = httpx.AsyncClient(transport=transport)
+        return AsyncOpenAI(**params)
+
+
+def build_llm(listeners=None):
+    """DeepSeek chat client configured from the environment."""
+    api_key = os.getenv("DEEPSEEK_API_KEY")
+    base_url = os.getenv("DEEPSEEK_API_BASE")
+    model = os.getenv("LLM_MODEL") or "deepseek-chat"
+    
+    if not base_url and api_key:
+        base_url = "https://api.deepseek.com/v1"
+    if base_url and not base_url.endswith("/v1"):
+        base_url = f"{base_url}/v1"
+    replay = get_recorder().mode == "replay"
+    if not api_key and replay:
+        # Offline replay never reaches the API, but the client still wants a key
+        api_key = "replay"
         
-        if not base_url and api_key:
-            base_url = "https://api.deepseek.com/v1"
-        if base_url and not base_url.endswith("/v1"):
-            base_url = f"{base_url}/v1"
-            
-        self.llm = ChatOpenAI(
-            model=model,
-            temperature=0.7,
-            api_key=api_key,
-            base_url=base_url
-        )
-        # Initialize SerperDevTool
-        self.serper_tool = SerperDevTool()
+    return TravelLLM(
+        model=model,
+        temperature=0.7,
+        api_key=api_key,
+        base_url=base_url,
+        # Chat completions on any OpenAI-compatible server
+        custom_openai=bool(base_url),
+        # Always streamed: stream listeners (e.g. the itinerary stream) get chunk events and
+        # recordings are the same whichever endpoint made them; usage is still reported
+        stream=True,
+        # A replay miss is final, retrying it only repeats the error
+        max_retries=0 if replay else 2,
+        listeners=list(listeners or []),
+    )
+
+
+def with_listeners(llm, listeners):
+    """Copy of llm reporting to listeners; the copy shares the HTTP client (connection pool)."""
+    return llm.model_copy(update={"listeners": list(listeners or [])})
+
+class TravelAgents:
+    def __init__(self, listeners=None, llm=None, serper_tool=None):
+        # Pre-built clients can be passed in (see agent_pool.py); otherwise build fresh ones
+        self.llm = llm or build_llm(listeners)
+        # Initialize SerperDevTool (recorded when RECORD_MODE is set)
+        self.serper_tool = serper_tool or build_search_tool()
 
     def destination_researcher(self):
         return Agent(
@@ -40,7 +93,7 @@ class TravelAgents:
             role='逻辑严密的行程架构师',
             goal='将调研员提供的景点串联成一条逻辑合理、不走回头路的每日行程',
             backstory='你是空间规划专家，擅长平衡交通时间、游览时长和用户体力。',
-            tools=[MapTools.calculate_travel_time, MapTools.optimize_route, MapTools.search_places],
+            tools=[MapTools.plan_multi_day_route, MapTools.calculate_travel_legs, MapTools.calculate_travel_time, MapTools.optimize_route, MapTools.search_places],
             verbose=True,
             llm=self.llm,
             allow_delegation=False
@@ -0,0 +1,59 @@
+"""
+Crew construction cost: fresh clients per request (previous behaviour) vs the per-process agent pool.
+
+    python benchmarks/agent_pool_bench.py [runs]
+
+Only construction is timed; no LLM or Serper request is made.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from agent_pool import AgentPool
+from agents import TravelAgents
+from tasks import TravelTasks
+from crewai import Crew, Process
+
+
+def build(agents, tasks):
+    researcher = agents.destination_researcher()
+    planner = agents.itinerary_planner()
+    research_task = tasks.research_task(researcher)
+    planning_task = tasks.planning_task(planner, [research_task])
+    return Crew(agents=[researcher, planner], tasks=[research_task, planning_task], process=Process.sequential)
+
+
+def timed(fn, runs):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2], samples[-1]
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    os.environ.setdefault("DEEPSEEK_API_KEY", "bench")
+    os.environ.setdefault("SERPER_API_KEY", "bench")
+
+    fresh_median, fresh_max = timed(lambda: build(TravelAgents(), TravelTasks()), runs)
+
+    started = time.perf_counter()
+    pool = AgentPool()
+    startup_ms = (time.perf_counter() - started) * 1000
+    pooled_median, pooled_max = timed(lambda: build(pool.travel_agents(), pool.tasks), runs)
+
+    print(f"runs: {runs}")
+    print(f"fresh clients per request: median {fresh_median:.2f} ms, max {fresh_max:.2f} ms")
+    print(f"agent pool startup:        {startup_ms:.2f} ms (once per worker process)")
+    print(f"pooled per request:        median {pooled_median:.2f} ms, max {pooled_max:.2f} ms")
+    if pooled_median:
+        print(f"speedup: {fresh_median / pooled_median:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Micro-benchmark: per-POI substring checks (the original build_trip_location logic)
+vs. PoiClassifier.classify_batch. Verifies identical output before timing.
+
+    python benchmarks/poi_classifier_bench.py [repeat]
+"""
+import csv
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from tools.poi_classifier import PoiClassifier
+
+DATA_FILE = os.path.join(os.path.dirname(__file__), "..", "data_pipeline", "data", "raw_pois.csv")
+
+# Hand-written cases for the entrance/gate branches the sample data rarely hits.
+EXTRA_POIS = [
+    {"name": "颐和园(东门)", "type": "风景名胜;公园广场;公园"},
+    {"name": "天坛公园-北门 ", "type": "通行设施;临街院门;临街院门"},
+    {"name": "景山公园停车场入口", "type": "交通设施服务;停车场"},
+    {"name": "（北海）公园大门内", "type": "风景名胜;公园"},
+    {"name": "门头沟(永定河)入口", "type": "地名地址信息;出入口"},
+    {"name": "南山寺海滨浴场岛", "type": "风景名胜;海滨浴场"},
+    {"name": "", "type": ""},
+]
+
+
+def legacy_classify(poi, tag_counts):
+    """Tag/entrance logic exactly as build_trip_location implemented it per POI."""
+    name = poi.get("name", "")
+    poi_type = poi.get("type", "")
+    lower_name = name.strip()
+    entrance_markers = ["入口", "出入口", "正门", "侧门", "大门", "东门", "西门", "南门", "北门", "停车场入口", "景区入口"]
+    is_entrance_name = any(marker in lower_name for marker in entrance_markers)
+    ends_with_gate = lower_name.endswith(("入口", "出入口", "正门", "侧门", "大门", "东门", "西门", "南门", "北门"))
+    bracket_gate = bool(re.search(r"[（(].*(入口|出入口|正门|侧门|大门|[东南西北]门).*[)）]", lower_name))
+    type_has_gate = "出入口" in poi_type or "门" in poi_type
+
+    derived_tags = []
+    is_nature = "公园" in poi_type or "植物园" in poi_type or "山" in name
+    is_history = "博物馆" in poi_type or "古迹" in poi_type or "寺" in name
+    is_city = "步行街" in poi_type or "广场" in poi_type or "商场" in poi_type or "商业" in poi_type
+    is_coastal = "海滨" in poi_type or "浴场" in poi_type or "岛" in name
+    is_sightseeing = "风景" in poi_type or "景点" in poi_type
+
+    if is_nature:
+        derived_tags.append("Nature")
+        tag_counts["Nature"] += 1
+    if is_history:
+        derived_tags.append("Historical")
+        tag_counts["Historical"] += 1
+    if is_city:
+        derived_tags.append("City Break")
+        tag_counts["City Break"] += 1
+    if is_coastal:
+        derived_tags.append("Coastal")
+        tag_counts["Coastal"] += 1
+    if is_sightseeing:
+        derived_tags.append("Sightseeing")
+        tag_counts["Sightseeing"] += 1
+    if not derived_tags:
+        derived_tags = ["General"]
+    return {
+        "tags": derived_tags,
+        "is_entrance_name": is_entrance_name,
+        "ends_with_gate": ends_with_gate,
+        "bracket_gate": bracket_gate,
+        "type_has_gate": type_has_gate,
+    }
+
+
+def legacy_batch(pois):
+    tag_counts = {"Nature": 0, "Historical": 0, "City Break": 0, "Coastal": 0, "Sightseeing": 0}
+    results = [legacy_classify(poi, tag_counts) for poi in pois]
+    return {"results": results, "tag_counts": tag_counts}
+
+
+def load_pois():
+    with open(DATA_FILE, "r", encoding="utf-8-sig", newline="") as f:
+        pois = [{"name": row["name"], "type": row["type"]} for row in csv.DictReader(f)]
+    return pois + EXTRA_POIS
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    pois = load_pois()
+    classifier = PoiClassifier.from_file()
+
+    expected = legacy_batch(pois)
+    actual = classifier.classify_batch(pois)
+    assert actual == expected, "classifier output differs from the legacy checks"
+    print(f"Output identical for {len(pois)} POIs.")
+
+    legacy_time = min(timeit.repeat(lambda: legacy_batch(pois), number=repeat, repeat=3))
+    batch_time = min(timeit.repeat(lambda: classifier.classify_batch(pois), number=repeat, repeat=3))
+    per_poi = 1e6 / (repeat * len(pois))
+    print(f"legacy per-POI checks: {legacy_time * per_poi:.2f} us/POI")
+    print(f"classify_batch:        {batch_time * per_poi:.2f} us/POI")
+    print(f"speedup:               {legacy_time / batch_time:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,12 @@
 import os
+import sys
 from dotenv import load_dotenv
 
+# Make the repo root importable so pipeline scripts share tools/ (AMap client, rate limiter)
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if REPO_ROOT not in sys.path:
+    sys.path.append(REPO_ROOT)
+
 # Load .env from parent directory
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "..", ".env"))
 
@@ -23,3 +29,12 @@ os.makedirs(DATA_DIR, exist_ok=True)
 # 050000: Food/Restaurant
 POI_TYPES = "110000|110100|140000|050000"  # Pipe separated
 CITY = "Beijing" # Default city
+
+# Cities harvested by fetch_pois.py, comma separated (e.g. "北京,上海,西安")
+CITIES = [c.strip() for c in os.getenv("POI_CITIES", CITY).split(",") if c.strip()]
+
+# Concurrent page requests; the shared AMap rate limiter still caps the overall request rate
+HARVEST_CONCURRENCY = int(os.getenv("POI_HARVEST_CONCURRENCY", "8"))
+
+# Per (city, type) CSV shards and the resume checkpoint
+HARVEST_DIR = os.path.join(DATA_DIR, "harvest")
@@ -0,0 +1,64 @@
+import pandas as pd
+import os
+from config import AMAP_KEY, DATA_DIR
+from tools.amap_client import amap_get_json
+
+DIVISION_LEVELS = ("province", "city", "district")
+
+def fetch_divisions(output_name="admin_divisions.csv"):
+    """
+    Fetch the administrative division tree (province -> city -> district) from AMap
+    and flatten it into admin_divisions.csv for the suggestion index.
+    """
+    if not AMAP_KEY:
+        print("Error: AMAP_KEY not found.")
+        return
+
+    url = "https://restapi.amap.com/v3/config/district"
+    params = {
+        "key": AMAP_KEY,
+        "keywords": "中国",
+        "subdistrict": 3,
+        "extensions": "base"
+    }
+
+    print("Fetching administrative divisions...")
+    try:
+        data = amap_get_json(url, params, timeout=(3, 30), use_cache=False, priority="batch")
+    except Exception as e:
+        print(f"Request failed: {e}")
+        return
+
+    if data.get("status") != "1" or not data.get("districts"):
+        print(f"Error: {data.get('info')}")
+        return
+
+    rows = []
+
+    def walk(nodes, province="", city=""):
+        for node in nodes:
+            level = node.get("level")
+            name = node.get("name", "")
+            if level in DIVISION_LEVELS:
+                rows.append({
+                    "adcode": node.get("adcode", ""),
+                    "name": name,
+                    "level": level,
+                    "province": province,
+                    "city": city,
+                })
+            walk(
+                node.get("districts") or [],
+                province=name if level == "province" else province,
+                city=name if level == "city" else city,
+            )
+
+    walk(data["districts"][0].get("districts") or [])
+
+    df = pd.DataFrame(rows, columns=["adcode", "name", "level", "province", "city"])
+    output_file = os.path.join(DATA_DIR, output_name)
+    df.to_csv(output_file, index=False, encoding="utf-8-sig")
+    print(f"Saved {len(df)} divisions to {output_file}")
+
+if __name__ == "__main__":
+    fetch_divisions()
@@ -1,70 +1,268 @@
-import requests
-import pandas as pd
-import time
+import csv
+import math
 import os
-from config import AMAP_KEY, DATA_DIR, POI_TYPES, CITY
+import re
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from config import AMAP_KEY, CITIES, DATA_DIR, HARVEST_CONCURRENCY, HARVEST_DIR, POI_TYPES
+from tools.amap_client import amap_get_json
+
+URL = "https://restapi.amap.com/v3/place/text"
+PAGE_SIZE = 20
 
-def fetch_pois(city=CITY, keywords="景点", types=POI_TYPES, max_pages=20):
+# Columns kept from AMap POIs (shards and raw_pois.csv)
+COLUMNS = ["id", "name", "type", "typecode", "address", "location", "tel", "pname", "cityname", "adname", "business_area", "photos", "gridcode", "biz_ext"]
+
+
+class Checkpoint:
     """
-    Fetch POI data from Amap API.
+    Harvest progress per run and (city, type, keywords, page) in SQLite: a page is marked done
+    only after its POIs were appended to the run's shard, so an interrupted crawl resumes where
+    it stopped. A crash between the two may append a page twice; merge_shards drops the
+    duplicate ids. A run is complete once every page was fetched; the next harvest then starts a
+    new run (crawl over in its own shard directory), as does fetch_pois --fresh.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(pages)")}
+        if columns and "run" not in columns:
+            # Progress recorded before runs existed cannot be matched to a run's shards
+            conn.execute("DROP TABLE pages")
+            conn.execute("DROP TABLE IF EXISTS totals")
+        conn.execute("CREATE TABLE IF NOT EXISTS runs (id TEXT PRIMARY KEY, started_at REAL, completed_at REAL)")
+        if "completed_at" not in {row[1] for row in conn.execute("PRAGMA table_info(runs)")}:
+            conn.execute("ALTER TABLE runs ADD COLUMN completed_at REAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages (run TEXT, city TEXT, types TEXT, keywords TEXT, page INTEGER, "
+            "status TEXT, pois INTEGER, updated_at REAL, PRIMARY KEY (run, city, types, keywords, page))"
+        )
+        # Total result count AMap reported on page 1, which fixes the number of pages
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS totals (run TEXT, city TEXT, types TEXT, keywords TEXT, total INTEGER, "
+            "PRIMARY KEY (run, city, types, keywords))"
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def latest_run(self, unfinished=False):
+        """Most recently started run (only among runs with pages still missing when `unfinished`)."""
+        where = "WHERE completed_at IS NULL " if unfinished else ""
+        row = self._conn().execute(f"SELECT id FROM runs {where}ORDER BY started_at DESC LIMIT 1").fetchone()
+        return row[0] if row else None
+
+    def complete(self, run):
+        self._conn().execute("UPDATE runs SET completed_at = ? WHERE id = ?", (time.time(), run))
+
+    def new_run(self):
+        run = time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:6]
+        self._conn().execute("INSERT INTO runs (id, started_at) VALUES (?, ?)", (run, time.time()))
+        return run
+
+    def done_pages(self, run, city, types, keywords):
+        rows = self._conn().execute(
+            "SELECT page FROM pages WHERE run = ? AND city = ? AND types = ? AND keywords = ? AND status = 'done'",
+            (run, city, types, keywords),
+        ).fetchall()
+        return {row[0] for row in rows}
+
+    def total(self, run, city, types, keywords):
+        row = self._conn().execute(
+            "SELECT total FROM totals WHERE run = ? AND city = ? AND types = ? AND keywords = ?",
+            (run, city, types, keywords),
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_total(self, run, city, types, keywords, total):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO totals (run, city, types, keywords, total) VALUES (?, ?, ?, ?, ?)",
+            (run, city, types, keywords, total),
+        )
+
+    def mark(self, run, city, types, keywords, page, status, pois=0):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO pages (run, city, types, keywords, page, status, pois, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (run, city, types, keywords, page, status, pois, time.time()),
+        )
+
+    def summary(self, run):
+        rows = self._conn().execute(
+            "SELECT status, COUNT(*), COALESCE(SUM(pois), 0) FROM pages WHERE run = ? GROUP BY status", (run,)
+        ).fetchall()
+        return {status: {"pages": pages, "pois": pois} for status, pages, pois in rows}
+
+
+class ShardWriter:
+    """Appends POI rows to one CSV shard per (city, type, keywords); each shard has its own lock."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._shard_locks = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, city, types, keywords):
+        # Keywords may hold "|" separators; keep only word characters in the file name
+        keywords = re.sub(r"\W+", "-", keywords)
+        return os.path.join(self.directory, f"pois_{city}_{types}_{keywords}.csv")
+
+    def append(self, city, types, keywords, pois):
+        with self._lock:
+            lock = self._shard_locks.setdefault((city, types, keywords), threading.Lock())
+        path = self.path(city, types, keywords)
+        with lock:
+            new = not os.path.exists(path)
+            with open(path, "a", encoding="utf-8", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=COLUMNS, extrasaction="ignore")
+                if new:
+                    writer.writeheader()
+                # Nested values are written as Python reprs, like the DataFrame export clean_data expects
+                writer.writerows({k: v if isinstance(v, str) else str(v) for k, v in poi.items()} for poi in pois)
+                f.flush()
+                os.fsync(f.fileno())
+
+
+def _fetch_page(city, types, keywords, page):
+    """One page of POIs: (pois, total result count); raises on request or API errors."""
+    params = {
+        "key": AMAP_KEY,
+        "keywords": keywords,
+        "types": types,
+        "city": city,
+        "citylimit": "true",
+        "offset": PAGE_SIZE,
+        "page": page,
+        "extensions": "all"
+    }
+    # Batch priority: the shared rate limiter serves live traffic first
+    data = amap_get_json(URL, params, use_cache=False, priority="batch")
+    if data.get("status") != "1":
+        raise RuntimeError(data.get("info"))
+    return data.get("pois") or [], int(data.get("count") or 0)
+
+
+def _checkpoint():
+    os.makedirs(HARVEST_DIR, exist_ok=True)
+    return Checkpoint(os.path.join(HARVEST_DIR, "checkpoint.sqlite3"))
+
+
+def harvest_pois(cities=CITIES, types=POI_TYPES, keywords="景点", max_pages=20, concurrency=None, fresh=False):
+    """
+    Fetch POIs for every (city, type code) concurrently under the shared AMap rate limit.
+    Page 1 of every pair comes first (its result count gives the number of pages), then all
+    remaining pages at once. An unfinished run (failed or missing pages) is resumed: pages it
+    already checkpointed for these keywords are skipped, so re-running after a failure only
+    fills the gaps. Otherwise, or with `fresh`, a new run fetches everything again.
+    Returns (run id, summary).
     """
     if not AMAP_KEY:
         print("Error: AMAP_KEY not found.")
-        return
-
-    url = "https://restapi.amap.com/v3/place/text"
-    all_pois = []
-    
-    print(f"Fetching POIs for city: {city}, keywords: {keywords}...")
-
-    for page in range(1, max_pages + 1):
-        params = {
-            "key": AMAP_KEY,
-            "keywords": keywords,
-            "types": types,
-            "city": city,
-            "citylimit": "true",
-            "offset": 20,
-            "page": page,
-            "extensions": "all"
-        }
-        
+        return None, None
+
+    checkpoint = _checkpoint()
+    run = None if fresh else checkpoint.latest_run(unfinished=True)
+    if run is None:
+        run = checkpoint.new_run()
+    shards = ShardWriter(os.path.join(HARVEST_DIR, run))
+    pairs = [(city, code) for city in cities for code in types.split("|") if code]
+    concurrency = concurrency or HARVEST_CONCURRENCY
+    print(f"Harvesting POIs for {len(pairs)} (city, type) pairs, keywords: {keywords}, run: {run}...")
+
+    def run_page(task):
+        city, code, page = task
         try:
-            response = requests.get(url, params=params)
-            response.raise_for_status()
-            data = response.json()
-            
-            if data["status"] == "1":
-                pois = data["pois"]
-                if not pois:
-                    print(f"No more POIs found at page {page}.")
-                    break
-                
-                print(f"Page {page}: Fetched {len(pois)} POIs.")
-                all_pois.extend(pois)
-                
-                # Sleep to avoid rate limiting
-                time.sleep(0.5)
-            else:
-                print(f"Error: {data.get('info')}")
-                break
-                
+            pois, total = _fetch_page(city, code, keywords, page)
         except Exception as e:
-            print(f"Request failed: {e}")
-            break
-
-    if all_pois:
-        df = pd.DataFrame(all_pois)
-        # Select relevant columns
-        columns = ["id", "name", "type", "typecode", "address", "location", "tel", "pname", "cityname", "adname", "business_area", "photos", "gridcode", "biz_ext"]
-        # Filter columns that exist
-        df = df[[c for c in columns if c in df.columns]]
-        
-        output_file = os.path.join(DATA_DIR, "raw_pois.csv")
-        df.to_csv(output_file, index=False, encoding="utf-8-sig")
-        print(f"Saved {len(df)} POIs to {output_file}")
-    else:
+            print(f"Request failed for {city} {code} page {page}: {e}")
+            checkpoint.mark(run, city, code, keywords, page, "failed")
+            return
+        if page == 1:
+            checkpoint.set_total(run, city, code, keywords, total)
+        if pois:
+            shards.append(city, code, keywords, pois)
+        checkpoint.mark(run, city, code, keywords, page, "done", len(pois))
+        print(f"{city} {code} page {page}: fetched {len(pois)} POIs.")
+
+    def pending(first_page):
+        tasks = []
+        for city, code in pairs:
+            done = checkpoint.done_pages(run, city, code, keywords)
+            if first_page:
+                pages = [1]
+            else:
+                total = checkpoint.total(run, city, code, keywords)
+                if total is None:
+                    # Page 1 failed; retried on the next run
+                    continue
+                pages = range(2, min(max_pages, math.ceil(total / PAGE_SIZE)) + 1)
+            tasks.extend((city, code, page) for page in pages if page not in done)
+        return tasks
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for first_page in (True, False):
+            list(pool.map(run_page, pending(first_page)))
+    if not pending(True) and not pending(False):
+        checkpoint.complete(run)
+
+    summary = checkpoint.summary(run)
+    print(f"Harvest progress: {summary}")
+    return run, summary
+
+
+def merge_shards(output_name="raw_pois.csv", run=None):
+    """Combine the shards of a run (default: the latest) into raw_pois.csv (first row per POI id wins) for clean_data."""
+    run = run or (_checkpoint().latest_run() if os.path.isdir(HARVEST_DIR) else None)
+    shard_dir = os.path.join(HARVEST_DIR, run) if run else None
+    if not shard_dir or not os.path.isdir(shard_dir):
+        print("No harvested shards found.")
+        return 0
+    seen = set()
+    output_file = os.path.join(DATA_DIR, output_name)
+    tmp_file = output_file + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8-sig", newline="") as out:
+        writer = csv.DictWriter(out, fieldnames=COLUMNS)
+        writer.writeheader()
+        for name in sorted(os.listdir(shard_dir)):
+            if not (name.startswith("pois_") and name.endswith(".csv")):
+                continue
+            with open(os.path.join(shard_dir, name), encoding="utf-8", newline="") as f:
+                for row in csv.DictReader(f):
+                    if row.get("id") in seen:
+                        continue
+                    seen.add(row.get("id"))
+                    writer.writerow({c: row.get(c, "") for c in COLUMNS})
+    if not seen:
+        os.remove(tmp_file)
         print("No POIs fetched.")
+        return 0
+    os.replace(tmp_file, output_file)
+    print(f"Saved {len(seen)} POIs to {output_file}")
+    return len(seen)
+
+
+def fetch_pois(cities=CITIES, keywords="景点", types=POI_TYPES, max_pages=20, fresh=False):
+    """
+    Fetch POI data from Amap API: harvest (resuming an unfinished run unless `fresh`) and
+    merge the run's shards into raw_pois.csv.
+    """
+    run, _ = harvest_pois(cities, types, keywords, max_pages, fresh=fresh)
+    return merge_shards(run=run) if run else 0
 
 if __name__ == "__main__":
-    fetch_pois()
+    # python fetch_pois.py [--fresh] [city ...]
+    args = sys.argv[1:]
+    fresh = "--fresh" in args
+    fetch_pois([a for a in args if a != "--fresh"] or CITIES, fresh=fresh)
@@ -1,15 +1,22 @@
 import os
 import sys
 from fetch_pois import fetch_pois
+from fetch_divisions import fetch_divisions
 from clean_data import clean_data
 from vectorize_data import vectorize_data
 
-def run_pipeline():
+def run_pipeline(fresh=False):
     print("Starting data pipeline...")
+
+    # Step 0: Admin divisions for the suggestion index (a failed fetch keeps the existing table)
+    try:
+        fetch_divisions()
+    except Exception as e:
+        print(f"Error in fetching divisions: {e}")
     
     # Step 1: Fetch POIs
     try:
-        fetch_pois()
+        fetch_pois(fresh=fresh)
     except Exception as e:
         print(f"Error in fetching POIs: {e}")
         return
@@ -31,4 +38,5 @@ def run_pipeline():
     print("Pipeline completed successfully.")
 
 if __name__ == "__main__":
-    run_pipeline()
+    # python pipeline.py [--fresh]: --fresh re-harvests POIs even when the last harvest is unfinished
+    run_pipeline(fresh="--fresh" in sys.argv[1:])
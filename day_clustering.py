@@ -0,0 +1,126 @@
+import math
+import os
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def haversine_km(a, b):
+    lat1, lng1, lat2, lng2 = map(math.radians, (a["lat"], a["lng"], b["lat"], b["lng"]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(h))
+
+
+def travel_minutes_matrix(records, speed_kmh=None, road_factor=None):
+    """
+    Estimated city travel minutes between pre-planned locations: straight-line distance
+    stretched by a road factor at an average door-to-door speed. Good enough to group
+    locations into days; exact legs are still fetched by the planner's tools.
+    """
+    speed_kmh = speed_kmh or _env_float("CLUSTER_SPEED_KMH", 20.0)
+    road_factor = road_factor or _env_float("CLUSTER_ROAD_FACTOR", 1.4)
+    n = len(records)
+    matrix = [[0.0] * n for _ in range(n)]
+    for i in range(n):
+        for j in range(i + 1, n):
+            minutes = haversine_km(records[i], records[j]) * road_factor / speed_kmh * 60
+            matrix[i][j] = matrix[j][i] = minutes
+    return matrix
+
+
+def _medoid(members, matrix):
+    return min(members, key=lambda i: sum(matrix[i][j] for j in members))
+
+
+def _initial_medoids(k, matrix):
+    """Most central point first, then repeatedly the point farthest from the chosen medoids."""
+    n = len(matrix)
+    medoids = [_medoid(range(n), matrix)]
+    while len(medoids) < k:
+        medoids.append(max(
+            (i for i in range(n) if i not in medoids),
+            key=lambda i: min(matrix[i][m] for m in medoids),
+        ))
+    return medoids
+
+
+def _assign(medoids, matrix, hours, capacity):
+    """
+    Capacity-aware assignment: points with the most to lose by not getting their nearest
+    medoid (largest regret) pick first; a full day is skipped unless every day is full.
+    """
+    k = len(medoids)
+    load = [0.0] * k
+    clusters = [[] for _ in range(k)]
+    for c, m in enumerate(medoids):
+        clusters[c].append(m)
+        load[c] += hours[m]
+
+    def regret(i):
+        costs = sorted(matrix[i][m] for m in medoids)
+        return costs[1] - costs[0] if len(costs) > 1 else 0.0
+
+    for i in sorted((i for i in range(len(matrix)) if i not in medoids), key=regret, reverse=True):
+        ranked = sorted(range(k), key=lambda c: matrix[i][medoids[c]])
+        choice = next((c for c in ranked if load[c] + hours[i] <= capacity), None)
+        if choice is None:
+            choice = min(range(k), key=lambda c: load[c])
+        clusters[choice].append(i)
+        load[choice] += hours[i]
+    return clusters
+
+
+def _order_days(clusters, medoids, matrix):
+    """Visit the day clusters in a nearest-neighbour chain over their medoids, starting with the busiest."""
+    remaining = list(range(len(clusters)))
+    current = max(remaining, key=lambda c: len(clusters[c]))
+    order = [current]
+    remaining.remove(current)
+    while remaining:
+        current = min(remaining, key=lambda c: matrix[medoids[order[-1]]][medoids[c]])
+        order.append(current)
+        remaining.remove(current)
+    return order
+
+
+def cluster_days(records, days, slack=None, max_iterations=20):
+    """
+    Split pre-planned location records (with lat / lng / durationHours) into `days` groups by
+    capacity-constrained k-medoids over the travel-time matrix: each group stays geographically
+    tight while visit hours are spread evenly (a day holds at most the mean load times `slack`,
+    or the longest single visit). Returns one list of records per day; days beyond the number
+    of locations are empty.
+    """
+    days = max(1, int(days))
+    if not records:
+        return [[] for _ in range(days)]
+    slack = slack or _env_float("CLUSTER_SLACK", 1.25)
+    matrix = travel_minutes_matrix(records)
+    hours = [float(r.get("durationHours") or 2.0) for r in records]
+    k = min(days, len(records))
+    capacity = max(sum(hours) / days * slack, max(hours))
+
+    medoids = _initial_medoids(k, matrix)
+    clusters = _assign(medoids, matrix, hours, capacity)
+    for _ in range(max_iterations):
+        updated = [_medoid(members, matrix) for members in clusters]
+        if updated == medoids:
+            break
+        medoids = updated
+        clusters = _assign(medoids, matrix, hours, capacity)
+
+    groups = [[records[i] for i in clusters[c]] for c in _order_days(clusters, medoids, matrix)]
+    return groups + [[] for _ in range(days - k)]
+
+
+def cluster_stats(groups):
+    return [
+        {"locations": len(group), "hours": round(sum(float(r.get("durationHours") or 2.0) for r in group), 1)}
+        for group in groups
+    ]
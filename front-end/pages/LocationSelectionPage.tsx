@@ -141,6 +141,14 @@ const LocationSelectionPage: React.FC<LocationSelectionPageProps> = ({
 
     // Fetch recommendations when search query or filter changes
     React.useEffect(() => {
+        const controller = new AbortController();
+
+        const showLocations = (locations: TripLocation[]) => {
+            const preparedLocations = prepareRecommendations(locations);
+            setRecommendations(preparedLocations);
+            setTagCounts(buildTagCounts(preparedLocations));
+        };
+
         const fetchRecommendations = async () => {
             setIsLoading(true);
             try {
@@ -153,17 +161,50 @@ const LocationSelectionPage: React.FC<LocationSelectionPageProps> = ({
                     targetCity = initialLocation.adcode;
                 }
 
-                const response = await fetch(`http://localhost:8000/api/recommend-locations?city=${encodeURIComponent(targetCity)}&tags=${encodeURIComponent(tags)}`);
-                if (response.ok) {
-                    const data = await response.json();
-                    const preparedLocations = prepareRecommendations(data.locations || []);
-                    setRecommendations(preparedLocations);
-                    setTagCounts(buildTagCounts(preparedLocations));
+                // Streamed NDJSON: cards render as soon as the first result page passes the filters.
+                const response = await fetch(
+                    `http://localhost:8000/api/recommend-locations/stream?city=${encodeURIComponent(targetCity)}&tags=${encodeURIComponent(tags)}`,
+                    { signal: controller.signal }
+                );
+                if (!response.ok || !response.body) {
+                    return;
+                }
+
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                const received: TripLocation[] = [];
+                let buffer = '';
+                setRecommendations([]);
+
+                while (true) {
+                    const { done, value } = await reader.read();
+                    if (done) break;
+                    buffer += decoder.decode(value, { stream: true });
+                    const lines = buffer.split('\n');
+                    buffer = lines.pop() || '';
+                    let changed = false;
+                    for (const line of lines) {
+                        if (!line.trim()) continue;
+                        const event = JSON.parse(line);
+                        if (event.type === 'location') {
+                            received.push(event.location);
+                            changed = true;
+                        }
+                    }
+                    if (changed) {
+                        showLocations(received);
+                        setIsLoading(false);
+                    }
                 }
+                showLocations(received);
             } catch (error) {
-                console.error("Failed to fetch locations", error);
+                if ((error as Error).name !== 'AbortError') {
+                    console.error("Failed to fetch locations", error);
+                }
             } finally {
-                setIsLoading(false);
+                if (!controller.signal.aborted) {
+                    setIsLoading(false);
+                }
             }
         };
 
@@ -172,7 +213,10 @@ const LocationSelectionPage: React.FC<LocationSelectionPageProps> = ({
             fetchRecommendations();
         }, 500);
 
-        return () => clearTimeout(timer);
+        return () => {
+            clearTimeout(timer);
+            controller.abort();
+        };
     }, [searchQuery, activeFilter, initialLocation]);
 
 
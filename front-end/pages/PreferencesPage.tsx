@@ -383,22 +383,42 @@ const PreferencesPage: React.FC<PreferencesPageProps> = ({ onBack, onNext, onHom
 
         setLoading(true);
         try {
-            // Show loading state here ideally
+            // Queue the crew run, then poll the job until it finishes
             console.log("Generating with payload:", payload);
-            const response = await fetch('http://localhost:8000/api/generate-itinerary', {
+            const response = await fetch('http://localhost:8000/api/itinerary-jobs', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify(payload)
             });
 
-            if (response.ok) {
-                const data = await response.json();
-                console.log("Generated Itinerary:", data);
-                localStorage.setItem('generatedItinerary', JSON.stringify(data));
-                onNext();
-            } else {
+            if (!response.ok) {
                 console.error("API Error");
                 alert("Failed to generate itinerary. Please try again.");
+                return;
+            }
+
+            const { job_id } = await response.json();
+            while (true) {
+                await new Promise(resolve => setTimeout(resolve, 2000));
+                const jobResponse = await fetch(`http://localhost:8000/api/itinerary-jobs/${job_id}`);
+                if (!jobResponse.ok) {
+                    console.error("API Error");
+                    alert("Failed to generate itinerary. Please try again.");
+                    return;
+                }
+                const job = await jobResponse.json();
+                if (job.status === 'succeeded') {
+                    console.log("Generated Itinerary:", job.result);
+                    localStorage.setItem('generatedItinerary', JSON.stringify(job.result));
+                    onNext();
+                    return;
+                }
+                if (job.status === 'failed') {
+                    console.error("Itinerary job failed:", job.error);
+                    alert("Failed to generate itinerary. Please try again.");
+                    return;
+                }
+                console.log("Itinerary job progress:", job.progress);
             }
         } catch (e) {
             console.error(e);
@@ -0,0 +1,357 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from crewai import Crew, Process
+from agents import TravelAgents, build_llm, with_listeners
+from tasks import TravelTasks
+from agent_pool import get_agent_pool
+from preplanning import format_preplan, preplan_locations
+from tools.instrumentation import CrewInstrumentation, activate
+from itinerary_parser import ItineraryParseError, ParseOutcome, parse_day, parse_itinerary, total_cost
+from itinerary_cache import parse_date, retarget
+from day_clustering import cluster_days, cluster_stats
+
+# Every stage an itinerary run can go through, in order; used for per-task progress reporting.
+# "preplanning" runs in Python; "research" only runs for locations it could not resolve;
+# "clustering" (Python) only runs when the days are planned concurrently, one crew per day.
+TASK_NAMES = ("preplanning", "research", "clustering", "planning")
+
+FREE_DAY_LOCATIONS = "无（自由活动日：可推荐新增景点或活动，并标注 isExtra 为 true）"
+
+
+def build_inputs(prefs, preplan):
+    """Prompt inputs for the crew from a TripPreferences dict and the pre-planning result."""
+    # Convert selected locations to string for prompt
+    loc_str = ", ".join([l["name"] for l in prefs["selected_locations"]])
+    budget = prefs["budget"]
+    return {
+        'city': prefs["city"],
+        'days': prefs["days"],
+        'start_date': prefs.get("start_date") or "",
+        'end_date': prefs.get("end_date") or "",
+        'budget': f"{budget[0]}-{budget[1]} CNY",
+        'interests': ", ".join(prefs.get("interests") or []),
+        'transport': prefs.get("transport") or "",
+        'dining_prefs': ", ".join(prefs.get("dining_prefs") or []),
+        'accommodation_prefs': ", ".join(prefs.get("accommodation_prefs") or []),
+        'selected_locations': loc_str,
+        'research_locations': ", ".join([l["name"] for l in preplan["unresolved"]]),
+        'location_details': format_preplan(preplan)
+    }
+
+
+def _agents_and_tasks(llm_listeners=None):
+    pool = get_agent_pool()
+    if pool is not None:
+        return pool.travel_agents(llm_listeners), pool.tasks
+    return TravelAgents(listeners=llm_listeners), TravelTasks()
+
+
+def build_crew(research=True, task_callback=None, step_callback=None, llm_listeners=None):
+    """Planning crew, with the research agent/task in front of it only when research=True."""
+    agents, tasks = _agents_and_tasks(llm_listeners)
+    planner = agents.itinerary_planner()
+    if research:
+        researcher = agents.destination_researcher()
+        research_task = tasks.research_task(researcher)
+        crew_agents = [researcher, planner]
+        crew_tasks = [research_task, tasks.planning_task(planner, [research_task])]
+    else:
+        crew_agents = [planner]
+        crew_tasks = [tasks.planning_task(planner, [])]
+
+    return Crew(
+        agents=crew_agents,
+        tasks=crew_tasks,
+        process=Process.sequential,
+        verbose=True,
+        task_callback=task_callback,
+        step_callback=step_callback,
+    )
+
+
+def build_day_crew(step_callback=None, llm_listeners=None):
+    """Single-task crew planning one day of pre-clustered locations."""
+    agents, tasks = _agents_and_tasks(llm_listeners)
+    planner = agents.itinerary_planner()
+    return Crew(
+        agents=[planner],
+        tasks=[tasks.day_planning_task(planner)],
+        process=Process.sequential,
+        verbose=True,
+        step_callback=step_callback,
+    )
+
+
+def preplan(prefs):
+    """Deterministic pre-planning stage; with PREPLAN=0 every location goes to the researcher."""
+    if os.getenv("PREPLAN", "1") == "0":
+        return {"locations": [], "unresolved": list(prefs["selected_locations"]), "stats": {}}
+    return preplan_locations(prefs["selected_locations"], prefs.get("city"))
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def new_parse_report():
+    """Per-run parse metrics; run_job folds them into the job store counters."""
+    return {"status": None, "json_repairs": [], "days_broken": 0, "day_repair_calls": 0, "days_repaired": 0}
+
+
+def _days_summary(days, skip):
+    lines = []
+    for index, day in enumerate(days):
+        if index != skip and day:
+            names = ", ".join(pin.get("name", "") for pin in day.get("mapPins", []))
+            lines.append(f"Day {index + 1}: {names}")
+    return "\n".join(lines)
+
+
+def repair_days(outcome, inputs, report, attempts=None, llm_listeners=None):
+    """
+    Re-request only the broken days from the planner LLM (one plain completion per day, no
+    crew, tools or research), keeping every valid day as it is.
+    """
+    attempts = attempts or _env_int("ITINERARY_DAY_REPAIR_ATTEMPTS", 2)
+    pool = get_agent_pool()
+    llm = with_listeners(pool.llm if pool is not None else build_llm(), llm_listeners)
+    tasks = pool.tasks if pool is not None else TravelTasks()
+    days = outcome.itinerary["days"]
+    for index in list(outcome.broken_days):
+        first_seq = 1 + sum(len(day.get("mapPins", [])) for day in days[:index])
+        prompt = tasks.day_repair_prompt(inputs, index, _days_summary(days, index), first_seq)
+        for _ in range(attempts):
+            report["day_repair_calls"] += 1
+            try:
+                response = llm.call(prompt)
+            except Exception as e:
+                print(f"Day Repair Error (day {index + 1}): {e}")
+                continue
+            day = parse_day(response)
+            if day is not None:
+                outcome.set_day(index, day)
+                report["days_repaired"] += 1
+                break
+    if outcome.broken_days:
+        missing = ", ".join(str(i + 1) for i in outcome.broken_days)
+        raise ItineraryParseError(f"AI failed to generate valid itinerary days: {missing}.")
+
+
+def parse_itinerary_output(raw_output, prefs, inputs, report=None, llm_listeners=None):
+    """
+    Validate the planner output against the planning_task schema, repairing JSON defects in
+    place and re-requesting only the days that are missing or invalid.
+    """
+    report = report if report is not None else new_parse_report()
+    try:
+        outcome = parse_itinerary(raw_output, prefs["budget"], expected_days=prefs.get("days"))
+        report["json_repairs"] = list(outcome.repairs)
+        report["days_broken"] = len(outcome.broken_days)
+        if outcome.broken_days:
+            repair_days(outcome, inputs, report, llm_listeners=llm_listeners)
+    except ItineraryParseError as e:
+        print(f"JSON Parse Error: {e}")
+        report["status"] = "failed"
+        raise
+    itinerary = outcome.finalize()
+    report["json_repairs"] = list(outcome.repairs)
+    report["status"] = "repaired" if outcome.repairs or report["days_broken"] else "clean"
+    return itinerary
+
+
+def split_days(prefs, plan):
+    """
+    Day groups for concurrent per-day planning, or None to plan the whole trip in one crew.
+    Splitting needs coordinates for every location, so trips with unresolved locations (which
+    go through the researcher) and short trips (DAY_SPLIT_MIN_DAYS) keep the single crew.
+    """
+    if os.getenv("DAY_SPLIT", "1") == "0":
+        return None
+    if plan["unresolved"] or not plan["locations"] or int(prefs["days"]) < _env_int("DAY_SPLIT_MIN_DAYS", 2):
+        return None
+    return cluster_days(plan["locations"], prefs["days"])
+
+
+def build_day_inputs(inputs, prefs, groups, index):
+    start = parse_date(prefs.get("start_date"))
+    group = groups[index]
+    return dict(
+        inputs,
+        day_number=index + 1,
+        day_date=(start + timedelta(days=index)).isoformat() if start else f"Day {index + 1}",
+        day_locations=format_preplan({"locations": group}) if group else FREE_DAY_LOCATIONS,
+        first_seq=1 + sum(len(g) for g in groups[:index]),
+    )
+
+
+def plan_days(prefs, inputs, groups, step_callback=None, llm_listeners=None, day_callback=None, timings=None):
+    """
+    Plan every day group concurrently (DAY_PLANNING_CONCURRENCY crews at a time), so wall time
+    follows the slowest day rather than the sum of all days. Returns one validated day dict per
+    group, None where the crew failed or its output could not be used.
+    """
+    concurrency = max(1, _env_int("DAY_PLANNING_CONCURRENCY", 4))
+    day_ms = [None] * len(groups)
+    pool = get_agent_pool()
+
+    def plan(index):
+        started = time.perf_counter()
+        crew = build_day_crew(step_callback=step_callback, llm_listeners=llm_listeners)
+        if pool is not None:
+            pool.record_build(round((time.perf_counter() - started) * 1000, 2))
+        try:
+            output = crew.kickoff(inputs=build_day_inputs(inputs, prefs, groups, index))
+            day = parse_day(output)
+        except Exception as e:
+            print(f"Day Planning Error (day {index + 1}): {e}")
+            day = None
+        day_ms[index] = round((time.perf_counter() - started) * 1000, 2)
+        if day is not None and day_callback:
+            day_callback(index, day)
+        return day
+
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(groups))) as executor:
+        days = list(executor.map(plan, range(len(groups))))
+    if timings is not None:
+        timings["day_plans"] = [dict(stats, ms=ms) for stats, ms in zip(cluster_stats(groups), day_ms)]
+    return days
+
+
+def itinerary_header(prefs):
+    """Header fields of a per-day plan (tripTitle, dateDisplay, budgetRange); they follow from the preferences alone."""
+    budget = prefs["budget"]
+    skeleton = {
+        "tripTitle": f"{prefs['days']} Days in {prefs['city']}",
+        "dateDisplay": "",
+        "budgetRange": {"min": budget[0], "max": budget[1], "currency": "¥"},
+        "days": [{} for _ in range(int(prefs["days"]))],
+    }
+    # Fills dateDisplay from the requested dates
+    header = retarget(skeleton, prefs)
+    header.pop("days")
+    return header
+
+
+def merge_days(days, prefs, inputs, report=None, llm_listeners=None):
+    """
+    Assemble per-day plans into the planning_task schema: header fields from the preferences
+    (itinerary_header), failed days re-requested on their own, `seq` renumbered continuously
+    across days.
+    """
+    report = report if report is not None else new_parse_report()
+    itinerary = dict(itinerary_header(prefs), days=[day or {} for day in days])
+    outcome = ParseOutcome(itinerary, [i for i, day in enumerate(days) if day is None], [])
+    report["days_broken"] = len(outcome.broken_days)
+    try:
+        if outcome.broken_days:
+            repair_days(outcome, inputs, report, llm_listeners=llm_listeners)
+    except ItineraryParseError as e:
+        print(f"JSON Parse Error: {e}")
+        report["status"] = "failed"
+        raise
+    itinerary["totalEstimatedCost"] = total_cost(itinerary["days"])
+    outcome.finalize()
+    report["json_repairs"] = list(outcome.repairs)
+    report["status"] = "repaired" if outcome.repairs or report["days_broken"] else "clean"
+    # Fills each day's dateShort from the requested dates
+    return retarget(itinerary, prefs)
+
+
+def run_itinerary(prefs, task_callback=None, step_callback=None, llm_listeners=None, preplan_callback=None, timings=None, parse_report=None, day_callback=None, header_callback=None):
+    """
+    Pre-plan the selected locations, run the crew for a TripPreferences dict and return the
+    parsed itinerary. preplan_callback(preplan, crew_task_names) is called before the crew starts;
+    stage timings (ms) and the per-stage LLM / tool breakdown are written into the `timings`
+    dict and parse metrics into the `parse_report` dict when given.
+
+    Multi-day trips whose locations all resolved are clustered into days and planned by one
+    crew per day concurrently; llm_listeners (which expect a single completion stream) are then
+    not attached. Instead header_callback(key, {key: value}) reports tripTitle, dateDisplay and
+    budgetRange before any day is planned (totalEstimatedCost once all are merged), and
+    day_callback(index, day) reports each day as soon as it is planned.
+    """
+    timings = timings if timings is not None else {}
+    instrumentation = CrewInstrumentation()
+    try:
+        with activate(instrumentation):
+            return _run_itinerary(prefs, instrumentation, task_callback, step_callback, llm_listeners, preplan_callback, timings, parse_report, day_callback, header_callback)
+    finally:
+        timings["breakdown"] = instrumentation.summary()
+        instrumentation.flush()
+
+
+def _emit_header(header_callback, fields):
+    for key, value in fields.items():
+        try:
+            header_callback(key, {key: value})
+        except Exception as e:
+            print(f"Itinerary header emit failed: {e}")
+
+
+def _run_itinerary(prefs, instrumentation, task_callback, step_callback, llm_listeners, preplan_callback, timings, parse_report, day_callback, header_callback):
+    started = time.perf_counter()
+    with instrumentation.stage("preplanning"):
+        plan = preplan(prefs)
+    timings["preplan_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    inputs = build_inputs(prefs, plan)
+
+    with instrumentation.stage("clustering"):
+        groups = split_days(prefs, plan)
+    if groups is not None:
+        if preplan_callback:
+            preplan_callback(plan, ["clustering", "planning"])
+        if task_callback:
+            task_callback(json.dumps(cluster_stats(groups)))
+        if header_callback:
+            # Same header events the single-crew path streams, ahead of the first day
+            _emit_header(header_callback, itinerary_header(prefs))
+        with instrumentation.stage("planning", "planner"):
+            days = plan_days(
+                prefs, inputs, groups,
+                step_callback=step_callback,
+                llm_listeners=[instrumentation.llm_listener],
+                day_callback=day_callback,
+                timings=timings,
+            )
+        if task_callback:
+            task_callback(f"{sum(day is not None for day in days)}/{len(days)} days planned")
+        started = time.perf_counter()
+        try:
+            with instrumentation.stage("parse", "planner"):
+                itinerary = merge_days(days, prefs, inputs, parse_report, llm_listeners=[instrumentation.llm_listener])
+            if header_callback:
+                _emit_header(header_callback, {"totalEstimatedCost": itinerary["totalEstimatedCost"]})
+            return itinerary
+        finally:
+            timings["parse_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    research = bool(plan["unresolved"])
+    stages = [("research", "researcher"), ("planning", "planner")] if research else [("planning", "planner")]
+    started = time.perf_counter()
+    crew = build_crew(
+        research,
+        task_callback=instrumentation.crew_stages(stages, task_callback),
+        step_callback=step_callback,
+        llm_listeners=list(llm_listeners or []) + [instrumentation.llm_listener],
+    )
+    timings["crew_build_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    pool = get_agent_pool()
+    if pool is not None:
+        pool.record_build(timings["crew_build_ms"])
+        timings["agent_pool"] = pool.stats()
+    if preplan_callback:
+        preplan_callback(plan, [name for name, _ in stages])
+    instrumentation.begin(*stages[0])
+    result = crew.kickoff(inputs=inputs)
+    started = time.perf_counter()
+    try:
+        with instrumentation.stage("parse", "planner"):
+            return parse_itinerary_output(result, prefs, inputs, parse_report, llm_listeners=[instrumentation.llm_listener])
+    finally:
+        timings["parse_ms"] = round((time.perf_counter() - started) * 1000, 2)
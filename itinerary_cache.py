@@ -0,0 +1,269 @@
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+DAY = 24 * 3600
+
+# The planning prompt falls back to transit when no transport mode is given.
+DEFAULT_TRANSPORT = "transit"
+TRANSPORT_ALIASES = {
+    "public": "transit", "public transport": "transit", "subway": "transit", "metro": "transit", "bus": "transit",
+    "公共交通": "transit", "地铁": "transit", "公交": "transit",
+    "car": "driving", "drive": "driving", "taxi": "driving", "自驾": "driving", "打车": "driving",
+    "walk": "walking", "步行": "walking",
+    "bike": "bicycling", "cycling": "bicycling", "骑行": "bicycling",
+}
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class CachePolicy:
+    """
+    How loosely two requests may differ and still share a cached itinerary.
+
+    budget_bucket: budgets are compared in buckets of this many CNY (0 = exact).
+    dates: "exact" keys on the dates; "season" on the start month and start weekday (seasonal
+        and weekend pricing); "ignore" drops them. Cached plans are re-dated on a hit.
+    interests / dining / accommodation: whether these preference lists are part of the key.
+    """
+
+    def __init__(self, name, budget_bucket, dates, interests=True, dining=True, accommodation=True):
+        self.name = name
+        self.budget_bucket = budget_bucket
+        self.dates = dates
+        self.interests = interests
+        self.dining = dining
+        self.accommodation = accommodation
+
+
+POLICIES = {
+    "exact": CachePolicy("exact", budget_bucket=0, dates="exact"),
+    "similar": CachePolicy("similar", budget_bucket=500, dates="season"),
+    "loose": CachePolicy("loose", budget_bucket=2000, dates="ignore", interests=False, accommodation=False),
+}
+
+
+def get_policy(name=None):
+    # Only identical requests share a plan unless the deployment opts into a looser policy
+    name = name or os.getenv("ITINERARY_CACHE_POLICY", "exact")
+    if name not in POLICIES:
+        raise ValueError(f"Unknown itinerary cache policy '{name}'")
+    policy = POLICIES[name]
+    bucket = os.getenv("ITINERARY_CACHE_BUDGET_BUCKET")
+    if bucket:
+        policy = copy.copy(policy)
+        policy.budget_bucket = _env_int("ITINERARY_CACHE_BUDGET_BUCKET", policy.budget_bucket)
+    return policy
+
+
+def parse_date(value):
+    """Date part of an ISO string from the front-end ("2024-10-12T00:00:00.000Z"), or None."""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value).strip().replace("Z", "+00:00")).date()
+    except ValueError:
+        return None
+
+
+def _date_key(value):
+    parsed = parse_date(value)
+    return str(parsed) if parsed else (value or "")
+
+
+def _normalize_list(values):
+    return sorted({" ".join(str(v).lower().split()) for v in values or [] if str(v).strip()})
+
+
+def normalize_transport(value):
+    value = " ".join(str(value or "").lower().split())
+    if not value:
+        return DEFAULT_TRANSPORT
+    return TRANSPORT_ALIASES.get(value, value)
+
+
+def canonicalize(prefs, policy):
+    """Canonical form of a TripPreferences dict under a policy; equal forms share a cache entry."""
+    budget = prefs["budget"]
+    if policy.budget_bucket:
+        budget = [int(budget[0]) // policy.budget_bucket, int(budget[1]) // policy.budget_bucket]
+    canonical = {
+        "policy": policy.name,
+        "city": " ".join(str(prefs["city"]).lower().split()),
+        "days": int(prefs["days"]),
+        "locations": sorted({str(l["id"]) for l in prefs["selected_locations"]}),
+        "budget": list(budget),
+        "transport": normalize_transport(prefs.get("transport")),
+    }
+    start = parse_date(prefs.get("start_date"))
+    if policy.dates == "exact":
+        canonical["dates"] = [_date_key(prefs.get("start_date")), _date_key(prefs.get("end_date"))]
+    elif policy.dates == "season" and start is not None:
+        canonical["season"] = [start.month, start.weekday()]
+    if policy.interests:
+        canonical["interests"] = _normalize_list(prefs.get("interests"))
+    if policy.dining:
+        canonical["dining"] = _normalize_list(prefs.get("dining_prefs"))
+    if policy.accommodation:
+        canonical["accommodation"] = _normalize_list(prefs.get("accommodation_prefs"))
+    return canonical
+
+
+def itinerary_key(prefs, policy):
+    raw = json.dumps(canonicalize(prefs, policy), ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _short_date(day):
+    return day.strftime("%b %d").upper()
+
+
+def retarget(itinerary, prefs):
+    """Copy of a cached itinerary adjusted to this request's budget and dates."""
+    itinerary = copy.deepcopy(itinerary)
+    if not isinstance(itinerary, dict):
+        return itinerary
+    budget = prefs["budget"]
+    itinerary["budgetRange"] = {"min": budget[0], "max": budget[1], "currency": "¥"}
+    start = parse_date(prefs.get("start_date"))
+    days = itinerary.get("days")
+    if start is None or not isinstance(days, list) or not days:
+        return itinerary
+    end = start + timedelta(days=len(days) - 1)
+    itinerary["dateDisplay"] = f"{start.strftime('%b %d')} - {end.strftime('%b %d')}"
+    for offset, day in enumerate(days):
+        if isinstance(day, dict) and "dateShort" in day:
+            day["dateShort"] = _short_date(start + timedelta(days=offset))
+    return itinerary
+
+
+class ItineraryCache:
+    """
+    Generated itineraries in a SQLite file shared by the server and crew workers,
+    keyed by the canonicalized preferences (see canonicalize / CachePolicy).
+    """
+
+    def __init__(self, path=None, ttl=None, policy=None):
+        self.path = path or os.getenv(
+            "ITINERARY_CACHE_PATH", os.path.join("/tmp", "travelai_cache", "itinerary_cache.sqlite3")
+        )
+        self.ttl = ttl if ttl is not None else _env_float("ITINERARY_CACHE_TTL", 3 * DAY)
+        self.policy = policy or get_policy()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self._init_db()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS itineraries (key TEXT PRIMARY KEY, canonical TEXT, value TEXT, "
+            "hits INTEGER DEFAULT 0, expires_at REAL, created_at REAL)"
+        )
+
+    def get(self, prefs):
+        """Cached itinerary re-targeted to prefs, or None."""
+        key = itinerary_key(prefs, self.policy)
+        try:
+            row = self._conn().execute(
+                "SELECT value FROM itineraries WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+            if row is not None:
+                self._conn().execute("UPDATE itineraries SET hits = hits + 1 WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            print(f"Itinerary cache read failed: {e}")
+            row = None
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return retarget(json.loads(row[0]), prefs) if row is not None else None
+
+    def set(self, prefs, itinerary):
+        canonical = canonicalize(prefs, self.policy)
+        now = time.time()
+        try:
+            self._conn().execute(
+                "INSERT OR REPLACE INTO itineraries (key, canonical, value, hits, expires_at, created_at) "
+                "VALUES (?, ?, ?, 0, ?, ?)",
+                (
+                    itinerary_key(prefs, self.policy),
+                    json.dumps(canonical, ensure_ascii=False, sort_keys=True),
+                    json.dumps(itinerary, ensure_ascii=False),
+                    now + self.ttl,
+                    now,
+                ),
+            )
+            self._conn().execute("DELETE FROM itineraries WHERE expires_at <= ?", (now,))
+        except sqlite3.Error as e:
+            print(f"Itinerary cache write failed: {e}")
+            return
+        with self._lock:
+            self.stores += 1
+
+    def stats(self):
+        try:
+            entries = self._conn().execute(
+                "SELECT COUNT(*) FROM itineraries WHERE expires_at > ?", (time.time(),)
+            ).fetchone()[0]
+        except sqlite3.Error:
+            entries = None
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "policy": self.policy.name,
+                "budget_bucket": self.policy.budget_bucket,
+                "ttl": self.ttl,
+                "entries": entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+_cache_pid = None
+
+
+def get_itinerary_cache():
+    """Process-wide itinerary cache, or None if ITINERARY_CACHE=0."""
+    global _cache, _cache_pid
+    if os.getenv("ITINERARY_CACHE", "1") == "0":
+        return None
+    pid = os.getpid()
+    if _cache is None or _cache_pid != pid:
+        with _cache_lock:
+            if _cache is None or _cache_pid != pid:
+                _cache = ItineraryCache()
+                _cache_pid = pid
+    return _cache
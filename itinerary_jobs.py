@@ -0,0 +1,557 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dotenv import load_dotenv
+from itinerary import TASK_NAMES, new_parse_report, run_itinerary
+from itinerary_cache import get_itinerary_cache
+from agent_pool import warm_agent_pool
+from itinerary_stream import ItineraryStreamHandler
+
+JOB_STATUSES = ("queued", "running", "succeeded", "failed")
+FINISHED_STATUSES = {"succeeded", "failed"}
+
+# Step callbacks fire for every agent thought/tool call; progress rows are written at most this often.
+PROGRESS_WRITE_INTERVAL = 1.0
+OUTPUT_PREVIEW_CHARS = 500
+
+# Event tailing for streaming clients.
+TERMINAL_EVENTS = {"result", "error"}
+STREAM_POLL_INTERVAL = 0.25
+STREAM_HEARTBEAT = 15.0
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _process_identity(pid):
+    """
+    "<boot id>:<start time>" of a process, which unlike the pid is never reused: a later
+    process with the same pid (or the same pid after a reboot) gets a different identity.
+    None where /proc is not available.
+    """
+    try:
+        with open("/proc/sys/kernel/random/boot_id") as f:
+            boot_id = f.read().strip()
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read()
+        # Fields after the parenthesised command name; the start time is field 22 of stat
+        start_time = stat[stat.rindex(")") + 2:].split()[19]
+    except (OSError, ValueError, IndexError):
+        return None
+    return f"{boot_id}:{start_time}"
+
+
+def _worker_alive(pid, identity):
+    """Whether the worker that claimed a job still runs; a live pid with another identity was reused."""
+    if not _pid_alive(pid):
+        return False
+    if identity is None:
+        return True
+    return _process_identity(pid) == identity
+
+
+class JobStore:
+    """
+    Itinerary jobs persisted in SQLite so they survive a server restart.
+    The server process and the crew worker processes share the file; each process
+    keeps its own connection per thread.
+    """
+
+    def __init__(self, path=None, ttl=None):
+        self.path = path or os.getenv(
+            "ITINERARY_JOBS_PATH", os.path.join("/tmp", "travelai_cache", "itinerary_jobs.sqlite3")
+        )
+        self.ttl = ttl if ttl is not None else _env_float("ITINERARY_JOB_TTL", 7 * 24 * 3600)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._local = threading.local()
+        self._init_db()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT, prefs TEXT, progress TEXT, result TEXT, error TEXT, "
+            "worker_pid INTEGER, worker_identity TEXT, attempts INTEGER DEFAULT 0, "
+            "created_at REAL, started_at REAL, finished_at REAL, updated_at REAL)"
+        )
+        columns = {row["name"] for row in self._conn().execute("PRAGMA table_info(jobs)")}
+        if "worker_identity" not in columns:
+            # Job files created before worker identities were recorded
+            self._conn().execute("ALTER TABLE jobs ADD COLUMN worker_identity TEXT")
+        self._conn().execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS job_events (seq INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT, event TEXT, data TEXT, created_at REAL)"
+        )
+        self._conn().execute("CREATE INDEX IF NOT EXISTS job_events_job ON job_events (job_id, seq)")
+        self._conn().execute("CREATE TABLE IF NOT EXISTS job_metrics (name TEXT PRIMARY KEY, value REAL)")
+
+    def create(self, prefs, result=None):
+        """Insert a queued job, or an already succeeded one when the result is known (cache hit)."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        if result is None:
+            self._conn().execute(
+                "INSERT INTO jobs (id, status, prefs, progress, created_at, updated_at) VALUES (?, 'queued', ?, ?, ?, ?)",
+                (job_id, json.dumps(prefs, ensure_ascii=False), json.dumps(new_progress()), now, now),
+            )
+            return job_id
+        self._conn().execute(
+            "INSERT INTO jobs (id, status, prefs, result, created_at, finished_at, updated_at) "
+            "VALUES (?, 'succeeded', ?, ?, ?, ?, ?)",
+            (job_id, json.dumps(prefs, ensure_ascii=False), json.dumps(result, ensure_ascii=False), now, now, now),
+        )
+        self.add_event(job_id, "result", result)
+        return job_id
+
+    def claim(self, job_id):
+        """Move a queued job to running for this process; False if another worker already has it."""
+        now = time.time()
+        cursor = self._conn().execute(
+            "UPDATE jobs SET status = 'running', worker_pid = ?, worker_identity = ?, attempts = attempts + 1, "
+            "started_at = ?, updated_at = ? WHERE id = ? AND status = 'queued'",
+            (os.getpid(), _process_identity(os.getpid()), now, now, job_id),
+        )
+        return cursor.rowcount == 1
+
+    def prefs(self, job_id):
+        row = self._conn().execute("SELECT prefs FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row["prefs"]) if row else None
+
+    def set_progress(self, job_id, progress):
+        self._conn().execute(
+            "UPDATE jobs SET progress = ?, updated_at = ? WHERE id = ?",
+            (json.dumps(progress, ensure_ascii=False), time.time(), job_id),
+        )
+
+    def succeed(self, job_id, result, progress=None):
+        now = time.time()
+        self._conn().execute(
+            "UPDATE jobs SET status = 'succeeded', result = ?, progress = COALESCE(?, progress), "
+            "finished_at = ?, updated_at = ? WHERE id = ?",
+            (
+                json.dumps(result, ensure_ascii=False),
+                json.dumps(progress, ensure_ascii=False) if progress is not None else None,
+                now, now, job_id,
+            ),
+        )
+
+    def fail(self, job_id, error, progress=None):
+        now = time.time()
+        self._conn().execute(
+            "UPDATE jobs SET status = 'failed', error = ?, progress = COALESCE(?, progress), "
+            "finished_at = ?, updated_at = ? WHERE id = ? AND status NOT IN ('succeeded', 'failed')",
+            (
+                str(error),
+                json.dumps(progress, ensure_ascii=False) if progress is not None else None,
+                now, now, job_id,
+            ),
+        )
+
+    def add_event(self, job_id, event, data):
+        self._conn().execute(
+            "INSERT INTO job_events (job_id, event, data, created_at) VALUES (?, ?, ?, ?)",
+            (job_id, event, json.dumps(data, ensure_ascii=False), time.time()),
+        )
+
+    def events(self, job_id, after=0):
+        """[(seq, event, data JSON string)] emitted by the job after sequence number `after`."""
+        return self._conn().execute(
+            "SELECT seq, event, data FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq",
+            (job_id, after),
+        ).fetchall()
+
+    def get(self, job_id):
+        row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "job_id": row["id"],
+            "status": row["status"],
+            "progress": json.loads(row["progress"]) if row["progress"] else None,
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "attempts": row["attempts"],
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"],
+        }
+
+    def recover(self):
+        """
+        Requeue jobs whose worker process is gone (server restart or crash) and return
+        the ids of every queued job. Workers are matched by pid and process identity, so a
+        pid since reused by an unrelated process does not keep a crashed job running.
+        """
+        conn = self._conn()
+        rows = conn.execute("SELECT id, worker_pid, worker_identity FROM jobs WHERE status = 'running'").fetchall()
+        for row in rows:
+            if not _worker_alive(row["worker_pid"], row["worker_identity"]):
+                conn.execute(
+                    "UPDATE jobs SET status = 'queued', worker_pid = NULL, worker_identity = NULL, progress = ?, updated_at = ? "
+                    "WHERE id = ? AND status = 'running'",
+                    (json.dumps(new_progress()), time.time(), row["id"]),
+                )
+                self.add_event(row["id"], "requeued", {"job_id": row["id"]})
+        return [row["id"] for row in conn.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at")]
+
+    def prune(self):
+        cutoff = time.time() - self.ttl
+        self._conn().execute(
+            "DELETE FROM jobs WHERE status IN ('succeeded', 'failed') AND finished_at < ?", (cutoff,)
+        )
+        self._conn().execute("DELETE FROM job_events WHERE job_id NOT IN (SELECT id FROM jobs)")
+
+    def incr_metrics(self, values):
+        """Add to cumulative counters shared by all worker processes."""
+        self._conn().executemany(
+            "INSERT INTO job_metrics (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            [(name, value) for name, value in values.items() if value],
+        )
+
+    def metrics(self):
+        rows = self._conn().execute("SELECT name, value FROM job_metrics ORDER BY name").fetchall()
+        return {row["name"]: int(row["value"]) if float(row["value"]).is_integer() else row["value"] for row in rows}
+
+    def counts(self):
+        rows = self._conn().execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        counts = {status: 0 for status in JOB_STATUSES}
+        counts.update({row["status"]: row["n"] for row in rows})
+        return counts
+
+
+def new_progress():
+    return {
+        "current_task": None,
+        "tasks": [{"name": name, "status": "pending", "steps": 0, "output": None} for name in TASK_NAMES],
+    }
+
+
+class _ProgressRecorder:
+    """CrewAI step/task callbacks that keep the job's progress row up to date."""
+
+    def __init__(self, store, job_id):
+        self.store = store
+        self.job_id = job_id
+        self.progress = new_progress()
+        self.index = 0
+        self._last_write = 0.0
+        self._start(0)
+
+    def _start(self, index):
+        self.index = index
+        # Stages the run decided not to execute were marked "skipped"
+        while index < len(self.progress["tasks"]) and self.progress["tasks"][index]["status"] == "skipped":
+            index = self.index = index + 1
+        if index < len(self.progress["tasks"]):
+            self.progress["tasks"][index]["status"] = "running"
+            self.progress["current_task"] = self.progress["tasks"][index]["name"]
+        else:
+            self.progress["current_task"] = None
+        self._write(force=True)
+        self.emit("progress", self.progress)
+
+    def emit(self, event, data):
+        try:
+            self.store.add_event(self.job_id, event, data)
+        except sqlite3.Error as e:
+            print(f"Job event write failed: {e}")
+
+    def _write(self, force=False):
+        now = time.monotonic()
+        if force or now - self._last_write >= PROGRESS_WRITE_INTERVAL:
+            self._last_write = now
+            try:
+                self.store.set_progress(self.job_id, self.progress)
+            except sqlite3.Error as e:
+                print(f"Job progress write failed: {e}")
+
+    def on_step(self, step_output):
+        if self.index < len(self.progress["tasks"]):
+            self.progress["tasks"][self.index]["steps"] += 1
+            self._write()
+
+    def on_preplan(self, preplan, crew_tasks):
+        task = self.progress["tasks"][self.index]
+        task["status"] = "done"
+        task["output"] = json.dumps(preplan["stats"], ensure_ascii=False)
+        for other in self.progress["tasks"][self.index + 1:]:
+            if other["name"] not in crew_tasks:
+                other["status"] = "skipped"
+        self._start(self.index + 1)
+
+    def on_day(self, index, day):
+        # Days planned concurrently (one crew per day) are reported as they finish.
+        self.emit("day", {"index": index, "day": day})
+
+    def on_task(self, task_output):
+        if self.index < len(self.progress["tasks"]):
+            task = self.progress["tasks"][self.index]
+            task["status"] = "done"
+            task["output"] = str(getattr(task_output, "raw", task_output))[:OUTPUT_PREVIEW_CHARS]
+        self._start(self.index + 1)
+
+
+def _parse_counters(report):
+    """job_metrics increments for one run's parse report (see itinerary.new_parse_report)."""
+    if not report.get("status"):
+        return {}
+    counters = {
+        "parse_runs": 1,
+        f"parse_{report['status']}": 1,
+        "parse_days_broken": report["days_broken"],
+        "parse_day_repair_calls": report["day_repair_calls"],
+        "parse_days_repaired": report["days_repaired"],
+    }
+    for repair in report["json_repairs"]:
+        counters[f"parse_fix_{repair}"] = 1
+    return counters
+
+
+def _record_parse(store, report):
+    try:
+        store.incr_metrics(_parse_counters(report))
+    except sqlite3.Error as e:
+        print(f"Job metrics write failed: {e}")
+
+
+def run_job(job_id, store_path=None):
+    """Worker-process entry point: claim the job, run the crew and store the outcome."""
+    load_dotenv()
+    store = JobStore(store_path)
+    if not store.claim(job_id):
+        return None
+    recorder = _ProgressRecorder(store, job_id)
+    parse_report = recorder.progress.setdefault("parse", new_parse_report())
+    try:
+        result = run_itinerary(
+            store.prefs(job_id),
+            task_callback=recorder.on_task,
+            step_callback=recorder.on_step,
+            llm_listeners=[ItineraryStreamHandler(recorder.emit)],
+            preplan_callback=recorder.on_preplan,
+            timings=recorder.progress.setdefault("timings", {}),
+            parse_report=parse_report,
+            day_callback=recorder.on_day,
+            header_callback=recorder.emit,
+        )
+    except Exception as e:
+        print(f"Crew Execution Error: {e}")
+        _record_parse(store, parse_report)
+        recorder.emit("error", {"detail": str(e)})
+        store.fail(job_id, e, recorder.progress)
+        return "failed"
+    _record_parse(store, parse_report)
+    recorder.emit("result", result)
+    store.succeed(job_id, result, recorder.progress)
+    cache = get_itinerary_cache()
+    if cache is not None:
+        cache.set(store.prefs(job_id), result)
+    return "succeeded"
+
+
+def _noop():
+    return None
+
+
+class ItineraryJobQueue:
+    """
+    Bounded pool of crew worker processes fed from the JobStore.
+    Workers are spawned (not forked) so every crew runs in a fresh interpreter and
+    never shares LLM clients, tool state or CrewAI globals with the server or other crews.
+    """
+
+    def __init__(self, store=None, workers=None, max_queued=None):
+        self.store = store or JobStore()
+        self.workers = workers or _env_int("ITINERARY_WORKERS", 2)
+        self.max_queued = max_queued or _env_int("ITINERARY_MAX_QUEUED", 50)
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=warm_agent_pool,
+            )
+        return self._executor
+
+    def warm(self):
+        """Start the worker processes now so their agent pools are built before the first job."""
+        executor = self._get_executor()
+        for _ in range(self.workers):
+            executor.submit(_noop)
+
+    def _dispatch(self, job_id):
+        with self._lock:
+            if job_id in self._futures:
+                return self._futures[job_id]
+            try:
+                future = self._get_executor().submit(run_job, job_id, self.store.path)
+            except BrokenProcessPool:
+                # A worker died hard (OOM, segfault); start a fresh pool.
+                self._executor = None
+                future = self._get_executor().submit(run_job, job_id, self.store.path)
+            self._futures[job_id] = future
+        future.add_done_callback(lambda f, job_id=job_id: self._on_done(job_id, f))
+        return future
+
+    def _on_done(self, job_id, future):
+        with self._lock:
+            self._futures.pop(job_id, None)
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            print(f"Itinerary worker error for job {job_id}: {error!r}")
+            self.store.fail(job_id, f"Worker process failed: {error!r}")
+            self.store.add_event(job_id, "error", {"detail": f"Worker process failed: {error!r}"})
+
+    def submit(self, prefs, use_cache=True):
+        """
+        Persist a new job and hand it to the pool; raises OverflowError when the queue is full.
+        Returns (job_id, cache status): "HIT" jobs are created already succeeded from the
+        itinerary cache, "MISS" / "BYPASS" jobs run a crew.
+        """
+        cache = get_itinerary_cache()
+        if cache is not None and use_cache:
+            cached = cache.get(prefs)
+            if cached is not None:
+                return self.store.create(prefs, result=cached), "HIT"
+        with self._lock:
+            in_flight = len(self._futures)
+        if in_flight >= self.workers + self.max_queued:
+            raise OverflowError("Itinerary queue is full")
+        job_id = self.store.create(prefs)
+        self._dispatch(job_id)
+        return job_id, "MISS" if cache is not None and use_cache else "BYPASS"
+
+    def recover(self):
+        """Resubmit jobs left queued or interrupted by a previous server process."""
+        self.store.prune()
+        job_ids = self.store.recover()
+        for job_id in job_ids:
+            self._dispatch(job_id)
+        if job_ids:
+            print(f"Recovered {len(job_ids)} itinerary jobs")
+        return job_ids
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    async def events(self, job_id, after=0, poll_interval=STREAM_POLL_INTERVAL, heartbeat=STREAM_HEARTBEAT):
+        """
+        Tail a job's events: yields (seq, event, data JSON string) as workers write them and stops
+        after the terminal "result" / "error" event. Yields None after `heartbeat` idle seconds so
+        callers can keep connections alive.
+        """
+        idle = 0.0
+        while True:
+            rows = self.store.events(job_id, after)
+            for seq, event, data in rows:
+                after = seq
+                yield seq, event, data
+                if event in TERMINAL_EVENTS:
+                    return
+            if rows:
+                idle = 0.0
+                continue
+            job = self.store.get(job_id)
+            if job is None or job["status"] in FINISHED_STATUSES:
+                # Drain anything written between the two reads, then stop.
+                if not self.store.events(job_id, after):
+                    return
+                continue
+            await asyncio.sleep(poll_interval)
+            idle += poll_interval
+            if idle >= heartbeat:
+                idle = 0.0
+                yield None
+
+    async def wait(self, job_id, poll_interval=0.5):
+        """Wait for a job to finish without blocking the event loop; returns the final job dict."""
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is not None:
+            await asyncio.wrap_future(future)
+        while True:
+            job = self.store.get(job_id)
+            if job is None or job["status"] in FINISHED_STATUSES:
+                return job
+            await asyncio.sleep(poll_interval)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            # Running crews are abandoned; their jobs are requeued by recover() on next start.
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._futures)
+        cache = get_itinerary_cache()
+        return {
+            "cache": cache.stats() if cache is not None else None,
+            "workers": self.workers,
+            "max_queued": self.max_queued,
+            "in_flight": in_flight,
+            "jobs": self.store.counts(),
+            "metrics": self.store.metrics(),
+        }
+
+
+_queue = None
+_queue_lock = threading.Lock()
+_queue_pid = None
+
+
+def get_job_queue():
+    global _queue, _queue_pid
+    pid = os.getpid()
+    if _queue is None or _queue_pid != pid:
+        with _queue_lock:
+            if _queue is None or _queue_pid != pid:
+                _queue = ItineraryJobQueue()
+                _queue_pid = pid
+    return _queue
@@ -0,0 +1,386 @@
+import json
+import re
+from typing import Annotated, List, Optional, Union
+from pydantic import BaseModel, BeforeValidator, ConfigDict, ValidationError
+
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+class ItineraryParseError(ValueError):
+    """The planner finished but its output is not a valid JSON itinerary."""
+
+
+# --- Lenient coercions for LLM output ---
+
+def _number(value):
+    """50 / "50" / "¥50" / "1,200元" -> number; ranges like "50-80" take the first value."""
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        match = _NUMBER.search(value.replace(",", ""))
+        if match:
+            number = float(match.group())
+            return int(number) if number.is_integer() else number
+    return value
+
+
+def _cost(value):
+    if value is None or value == "" or value == []:
+        return 0
+    return _number(value)
+
+
+def _text(value):
+    if value is None or value == []:
+        return ""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return value
+
+
+def _flag(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "yes", "1", "是")
+    if value is None:
+        return False
+    return value
+
+
+def _optional_int(value):
+    if value is None or value == "":
+        return None
+    number = _number(value)
+    return int(number) if isinstance(number, float) and number.is_integer() else number
+
+
+def _tags(value):
+    """Tags may come back as plain strings; the front-end needs {label, color}."""
+    if not isinstance(value, list):
+        return []
+    return [{"label": tag, "color": "blue"} if isinstance(tag, str) else tag for tag in value]
+
+
+Text = Annotated[str, BeforeValidator(_text)]
+Cost = Annotated[Union[int, float], BeforeValidator(_cost)]
+Coordinate = Annotated[float, BeforeValidator(_number)]
+Flag = Annotated[bool, BeforeValidator(_flag)]
+OptionalInt = Annotated[Optional[int], BeforeValidator(_optional_int)]
+Identifier = Optional[Union[int, str]]
+
+
+class _Model(BaseModel):
+    # Unknown fields (e.g. top/left pin percentages) are passed through to the front-end
+    model_config = ConfigDict(extra="allow")
+
+
+class Tag(_Model):
+    label: Text = ""
+    color: Text = "gray"
+
+
+class TravelDetails(_Model):
+    mode: Text = ""
+    duration: Text = ""
+    distance: Text = ""
+    originId: Identifier = None
+    destinationId: Identifier = None
+
+
+class MapPin(_Model):
+    seq: OptionalInt = None
+    id: Identifier = None
+    name: Text
+    lat: Coordinate
+    lng: Coordinate
+    active: Flag = False
+    isExtra: Flag = False
+    stopNumber: Text = ""
+    title: Text = ""
+    duration: Text = ""
+    description: Text = ""
+    aiStrategy: Text = ""
+    estimatedCost: Cost = 0
+    costDescription: Text = ""
+
+
+class TimelineItem(_Model):
+    time: Text = ""
+    title: Text
+    description: Text = ""
+    isExtra: Flag = False
+    tags: Annotated[List[Tag], BeforeValidator(_tags)] = []
+    estimatedCost: Cost = 0
+    type: Text = "activity"
+    travelDetails: Optional[TravelDetails] = None
+
+
+class Day(_Model):
+    """One element of "days" in the planning_task schema (tasks.py)."""
+    dayHeader: Text = ""
+    daySubHeader: Text = ""
+    dateShort: Text = ""
+    mapPins: List[MapPin]
+    timeline: List[TimelineItem]
+
+
+class BudgetRange(_Model):
+    min: Cost = 0
+    max: Cost = 0
+    currency: Text = "¥"
+
+
+class ItineraryHeader(_Model):
+    """Top-level fields of the planning_task schema; days are validated one by one."""
+    tripTitle: Text = ""
+    dateDisplay: Text = ""
+    budgetRange: Optional[BudgetRange] = None
+    totalEstimatedCost: Optional[Cost] = None
+
+
+def _dump(model):
+    return model.model_dump(mode="json", exclude_none=True)
+
+
+# --- JSON repair ---
+
+def _close(out, stack):
+    """Text of a truncated document with its open containers closed."""
+    text = "".join(out).rstrip()
+    if text.endswith(","):
+        text = text[:-1]
+    elif text.endswith(":"):
+        text += "null"
+    return text + "".join("}" if opener == "{" else "]" for opener in reversed(stack))
+
+
+def repair_json(text):
+    """
+    Best-effort fix of the usual LLM JSON defects; returns (fixed text, [repair names]).
+    Handles prose / markdown fences around the object, comments, trailing commas, Python
+    literals, raw newlines in strings, mismatched closing brackets and truncation (the last
+    incomplete element of the innermost container is dropped).
+    """
+    repairs = []
+    start = text.find("{")
+    if start < 0:
+        return text, repairs
+    if text[:start].strip():
+        repairs.append("leading_text")
+
+    out = []
+    stack = []
+    # out position right after the last "," or opening bracket of every open container
+    element_starts = []
+    in_string = escape = False
+    i = start
+    n = len(text)
+    while i < n:
+        ch = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+            elif ch == "\n":
+                out.append("\\n")
+                repairs.append("newline_in_string")
+                i += 1
+                continue
+            out.append(ch)
+            i += 1
+            continue
+
+        if ch == '"':
+            in_string = True
+        elif text.startswith("//", i) or text.startswith("/*", i):
+            end = text.find("\n" if text[i + 1] == "/" else "*/", i + 2)
+            i = n if end < 0 else end + (1 if text[i + 1] == "/" else 2)
+            repairs.append("comment")
+            continue
+        elif ch in "{[":
+            stack.append(ch)
+            out.append(ch)
+            element_starts.append(len(out))
+            i += 1
+            continue
+        elif ch in "}]":
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+                repairs.append("trailing_comma")
+            expected = "}" if stack[-1] == "{" else "]"
+            if ch != expected:
+                repairs.append("mismatched_bracket")
+            stack.pop()
+            element_starts.pop()
+            out.append(expected)
+            i += 1
+            if not stack:
+                if text[i:].strip():
+                    repairs.append("trailing_text")
+                break
+            continue
+        elif ch == ",":
+            out.append(ch)
+            element_starts[-1] = len(out)
+            i += 1
+            continue
+        elif ch in "TFN" and not (out and (out[-1].isalnum() or out[-1] == "_")):
+            for literal, replacement in _LITERALS.items():
+                if text.startswith(literal, i):
+                    out.append(replacement)
+                    i += len(literal)
+                    repairs.append("python_literal")
+                    break
+            else:
+                out.append(ch)
+                i += 1
+            continue
+        out.append(ch)
+        i += 1
+
+    if in_string:
+        out.append('"')
+    if stack:
+        repairs.append("truncated")
+        candidate = _close(out, stack)
+        # Drop incomplete trailing elements until the document parses.
+        while True:
+            try:
+                json.loads(candidate)
+                break
+            except ValueError:
+                if not element_starts:
+                    break
+                cut = element_starts[-1]
+                if len(out) <= cut:
+                    # Innermost container is empty already; drop it as an element of its parent.
+                    stack.pop()
+                    element_starts.pop()
+                    del out[cut - 1:]
+                    if not stack:
+                        break
+                else:
+                    del out[cut:]
+                candidate = _close(out, stack)
+        return candidate, sorted(set(repairs))
+    return "".join(out), sorted(set(repairs))
+
+
+def load_json_object(raw_output):
+    """The JSON object in raw LLM output: plain json.loads first, repair_json when that fails."""
+    raw_output = str(raw_output)
+    text = raw_output
+    if "```json" in text:
+        text = text.split("```json")[1].split("```")[0]
+    elif "```" in text:
+        text = text.split("```")[1].split("```")[0]
+    try:
+        data = json.loads(text.strip())
+        repairs = []
+    except ValueError:
+        fixed, repairs = repair_json(raw_output)
+        try:
+            data = json.loads(fixed)
+        except ValueError as e:
+            raise ItineraryParseError("AI failed to generate valid JSON itinerary.") from e
+    if not isinstance(data, dict):
+        raise ItineraryParseError("AI failed to generate valid JSON itinerary.")
+    return data, repairs
+
+
+# --- Itinerary validation ---
+
+def validate_day(day):
+    """Validated day dict, or None when the day is unusable (and needs to be re-requested)."""
+    if not isinstance(day, dict):
+        return None
+    try:
+        model = Day.model_validate(day)
+    except ValidationError:
+        return None
+    if not model.mapPins and not model.timeline:
+        return None
+    return _dump(model)
+
+
+def total_cost(days):
+    """Sum of every timeline item's estimatedCost (activities and travel)."""
+    return sum(item.get("estimatedCost") or 0 for day in days for item in day.get("timeline", []))
+
+
+class ParseOutcome:
+    """Validated itinerary plus the indexes of days that still need to be re-requested."""
+
+    def __init__(self, itinerary, broken_days, repairs):
+        self.itinerary = itinerary
+        self.broken_days = broken_days
+        self.repairs = repairs
+
+    def set_day(self, index, day):
+        self.itinerary["days"][index] = day
+        self.broken_days = [i for i in self.broken_days if i != index]
+
+    def finalize(self):
+        """Continuous seq numbering across days and a computed total when the planner left it out."""
+        seq = 0
+        renumbered = False
+        for day in self.itinerary["days"]:
+            for pin in day.get("mapPins", []):
+                seq += 1
+                if pin.get("seq") != seq:
+                    pin["seq"] = seq
+                    renumbered = True
+        if renumbered:
+            self.repairs.append("seq")
+        if self.itinerary.get("totalEstimatedCost") is None:
+            self.itinerary["totalEstimatedCost"] = total_cost(self.itinerary["days"])
+            self.repairs.append("total_cost")
+        return self.itinerary
+
+
+def parse_itinerary(raw_output, budget, expected_days=None):
+    """
+    Parse and validate planner output against the planning_task schema.
+    Raises ItineraryParseError when no itinerary object can be recovered at all; individual
+    days that are missing or invalid are reported in ParseOutcome.broken_days instead.
+    """
+    data, repairs = load_json_object(raw_output)
+    try:
+        header = _dump(ItineraryHeader.model_validate(data))
+    except ValidationError as e:
+        raise ItineraryParseError("AI failed to generate valid JSON itinerary.") from e
+    header.setdefault("budgetRange", {"min": budget[0], "max": budget[1], "currency": "¥"})
+
+    raw_days = data.get("days") if isinstance(data.get("days"), list) else []
+    count = max(int(expected_days or 0), len(raw_days))
+    # The last day of a truncated output may have lost timeline entries and still validate.
+    suspect = len(raw_days) - 1 if "truncated" in repairs else None
+    days = []
+    broken = []
+    for index in range(count):
+        day = validate_day(raw_days[index]) if index < len(raw_days) and index != suspect else None
+        if day is None:
+            broken.append(index)
+            day = {}
+        days.append(day)
+    header["days"] = days
+    return ParseOutcome(header, broken, repairs)
+
+
+def parse_day(raw_output):
+    """A single re-requested day object, validated; None if still unusable."""
+    try:
+        data, _ = load_json_object(raw_output)
+    except ItineraryParseError:
+        return None
+    # Accept {"days": [day]} as well as a bare day object.
+    if isinstance(data.get("days"), list) and data["days"]:
+        data = data["days"][0]
+    return validate_day(data)
@@ -0,0 +1,139 @@
+import json
+from tools.llm_events import LLMListener
+
+# Top-level itinerary fields forwarded as their own event as soon as their value closes.
+HEADER_KEYS = ("tripTitle", "dateDisplay", "budgetRange", "totalEstimatedCost")
+DAYS_KEY = "days"
+
+
+class IncrementalItineraryParser:
+    """
+    Character-level scanner over streamed LLM text that reports itinerary pieces as they close.
+
+    Text before the first "{" (agent thoughts, markdown fences) is skipped. Inside a top-level
+    object the scanner tracks strings, escapes and nesting, so it knows which top-level key a
+    value belongs to and where each element of the "days" array starts and ends. Each closed
+    piece is decoded with json.loads; pieces that do not decode are skipped, the full result is
+    still validated when the crew finishes. When a top-level object closes (e.g. a tool's
+    Action Input) the scanner goes back to looking for the next one.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.text = []
+        self.stack = []
+        self.in_string = False
+        self.escape = False
+        self.string_start = None
+        self.expect_key = False
+        self.key = None
+        self.value_start = None
+        self.day_start = None
+        self.day_index = 0
+
+    def _decode(self, start, end):
+        try:
+            return True, json.loads("".join(self.text[start:end]))
+        except ValueError:
+            return False, None
+
+    def _emit_value(self, events, end):
+        if self.key in HEADER_KEYS and self.value_start is not None:
+            ok, value = self._decode(self.value_start, end)
+            if ok:
+                events.append((self.key, {self.key: value}))
+        self.value_start = None
+
+    def feed(self, chunk):
+        """Consume a piece of text; returns a list of (event, data) for everything that closed in it."""
+        events = []
+        for ch in chunk:
+            if not self.stack:
+                if ch == "{":
+                    self.reset()
+                    self.text.append(ch)
+                    self.stack.append("{")
+                    self.expect_key = True
+                continue
+
+            pos = len(self.text)
+            self.text.append(ch)
+            depth = len(self.stack)
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    if depth == 1 and self.expect_key:
+                        ok, key = self._decode(self.string_start, pos + 1)
+                        self.key = key if ok else None
+                    elif depth == 1:
+                        self._emit_value(events, pos + 1)
+                continue
+
+            if ch == '"':
+                self.in_string = True
+                self.string_start = pos
+                if depth == 1 and not self.expect_key and self.value_start is None:
+                    self.value_start = pos
+            elif ch == ":" and depth == 1:
+                self.expect_key = False
+            elif ch == "," and depth == 1:
+                self._emit_value(events, pos)
+                self.expect_key = True
+                self.key = None
+            elif ch in "{[":
+                if depth == 1 and self.value_start is None:
+                    self.value_start = pos
+                if ch == "{" and depth == 2 and self.stack[1] == "[" and self.key == DAYS_KEY:
+                    self.day_start = pos
+                self.stack.append(ch)
+            elif ch in "}]":
+                self.stack.pop()
+                depth = len(self.stack)
+                if depth == 0:
+                    self._emit_value(events, pos)
+                    self.text = []
+                elif depth == 1 and self.value_start is not None:
+                    self._emit_value(events, pos + 1)
+                elif depth == 2 and ch == "}" and self.day_start is not None and self.key == DAYS_KEY:
+                    ok, day = self._decode(self.day_start, pos + 1)
+                    if ok:
+                        events.append(("day", {"index": self.day_index, "day": day}))
+                    self.day_index += 1
+                    self.day_start = None
+            elif depth == 1 and not self.expect_key and self.value_start is None and not ch.isspace():
+                # number / true / false / null; it ends at the next "," or "}"
+                self.value_start = pos
+        return events
+
+
+class ItineraryStreamHandler(LLMListener):
+    """
+    LLM listener that feeds streamed planner text through the incremental parser and passes
+    each closed piece to emit(event, data). Tool-call argument chunks are skipped.
+    Every new LLM call restarts the parser; a re-generated itinerary re-emits its days with the
+    same indexes, so consumers should treat "day" events as replace-by-index.
+    """
+
+    def __init__(self, emit):
+        self.emit = emit
+        self.parser = IncrementalItineraryParser()
+        self.call_id = None
+
+    def on_stream_chunk(self, event):
+        if event.tool_call is not None:
+            return
+        if event.call_id != self.call_id:
+            self.call_id = event.call_id
+            self.parser.reset()
+        for name, data in self.parser.feed(event.chunk):
+            try:
+                self.emit(name, data)
+            except Exception as e:
+                print(f"Itinerary stream emit failed: {e}")
@@ -0,0 +1,220 @@
+import ast
+import csv
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tools.amap_client import amap_get_json
+
+PLACE_DETAIL_URL = "https://restapi.amap.com/v3/place/detail"
+GEOCODE_URL = "https://restapi.amap.com/v3/geocode/geo"
+
+# Geocode match levels precise enough to stand for the place itself; coarser ones (城市,
+# 区县, 乡镇, 热点商圈 ...) only give an area centroid.
+PRECISE_GEOCODE_LEVELS = {"兴趣点", "门牌号", "单元号", "道路交叉路口", "公交地铁站", "公交站台、地铁站"}
+
+POIS_FILE = os.path.join(os.path.dirname(__file__), "data_pipeline", "data", "cleaned_pois.csv")
+DURATIONS_FILE = os.path.join(os.path.dirname(__file__), "tools", "data", "visit_durations.csv")
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _parse_location(value):
+    """AMap "lon,lat" -> (lat, lng), or None."""
+    try:
+        lng, lat = (float(x) for x in str(value).split(","))
+        return lat, lng
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_biz_ext(value):
+    if isinstance(value, dict):
+        return value
+    if isinstance(value, str) and value.startswith("{"):
+        try:
+            return ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            return {}
+    return {}
+
+
+def _text(value):
+    # AMap uses [] for missing string fields
+    return value.strip() if isinstance(value, str) else ""
+
+
+class VisitDurations:
+    """Default visit hours by AMap typecode (longest prefix wins), then by location tag."""
+
+    def __init__(self, path=DURATIONS_FILE):
+        self.typecodes = {}
+        self.tags = {}
+        self.default = 2.0
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            for row in csv.DictReader(f):
+                hours = float(row["hours"])
+                if row["kind"] == "typecode":
+                    self.typecodes[row["key"].strip()] = hours
+                elif row["kind"] == "tag":
+                    self.tags[row["key"].strip()] = hours
+                elif row["kind"] == "default":
+                    self.default = hours
+        self.prefix_lengths = sorted({len(k) for k in self.typecodes}, reverse=True)
+
+    def hours(self, typecode=None, tags=()):
+        code = (typecode or "").split("|")[0].strip()
+        for length in self.prefix_lengths:
+            if len(code) >= length and code[:length] in self.typecodes:
+                return self.typecodes[code[:length]]
+        tag_hours = [self.tags[t] for t in tags or () if t in self.tags]
+        if tag_hours:
+            return max(tag_hours)
+        return self.default
+
+
+class LocalPoiTable:
+    """Pipeline POIs (cleaned_pois.csv) by AMap id; reloaded when the file changes."""
+
+    def __init__(self, path=POIS_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._rows = {}
+
+    def _load(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return {}
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    with open(self.path, "r", encoding="utf-8-sig", newline="") as f:
+                        self._rows = {row["id"]: row for row in csv.DictReader(f) if row.get("id")}
+                    self._mtime = mtime
+        return self._rows
+
+    def get(self, poi_id):
+        return self._load().get(poi_id)
+
+
+_durations = None
+_local_pois = LocalPoiTable()
+
+
+def get_visit_durations():
+    global _durations
+    if _durations is None:
+        _durations = VisitDurations(os.getenv("VISIT_DURATIONS_FILE", DURATIONS_FILE))
+    return _durations
+
+
+def _from_poi(location, poi, source):
+    """Planner-ready record from an AMap POI dict or a cleaned_pois.csv row."""
+    coords = _parse_location(poi.get("location"))
+    if coords is None:
+        return None
+    biz_ext = _parse_biz_ext(poi.get("biz_ext"))
+    rating = _text(biz_ext.get("rating")) or _text(poi.get("rating"))
+    return {
+        "id": location["id"],
+        "name": location["name"],
+        "lat": coords[0],
+        "lng": coords[1],
+        "address": _text(poi.get("address")),
+        "type": _text(poi.get("type")),
+        "rating": float(rating) if rating.replace(".", "", 1).isdigit() else location.get("rating"),
+        "openTime": _text(biz_ext.get("opentime2")) or _text(biz_ext.get("open_time")),
+        "ticketCost": _text(biz_ext.get("cost")),
+        "durationHours": get_visit_durations().hours(_text(poi.get("typecode")), location.get("tags")),
+        "source": source,
+    }
+
+
+def _fetch_detail(api_key, location):
+    try:
+        data = amap_get_json(PLACE_DETAIL_URL, {"key": api_key, "id": location["id"]}, priority="agent")
+    except Exception as e:
+        print(f"Error fetching POI detail for {location['name']}: {e}")
+        return None
+    if data.get("status") == "1" and data.get("pois"):
+        return _from_poi(location, data["pois"][0], "amap")
+    return None
+
+
+def _geocode(api_key, location, city):
+    address = "".join(p for p in (location.get("city") or city, location.get("district"), location["name"]) if p)
+    try:
+        data = amap_get_json(GEOCODE_URL, {"key": api_key, "address": address}, priority="agent")
+    except Exception as e:
+        print(f"Error geocoding {location['name']}: {e}")
+        return None
+    if data.get("status") == "1" and data.get("geocodes"):
+        geocode = data["geocodes"][0]
+        # An area-level match would pass as resolved with the wrong coordinates; leave it to the researcher
+        if _text(geocode.get("level")) not in PRECISE_GEOCODE_LEVELS:
+            return None
+        return _from_poi(location, {"location": geocode.get("location"), "address": geocode.get("formatted_address")}, "geocode")
+    return None
+
+
+def preplan_locations(locations, city=None, concurrency=None):
+    """
+    Resolve selected TripLocation dicts to coordinates and default visit hours without an LLM:
+    pipeline POI table first, then AMap place detail by id, then geocoding by name, with the
+    AMap lookups fanned out concurrently.
+    Returns {"locations": [record], "unresolved": [TripLocation dict], "stats": {...}}.
+    """
+    started = time.monotonic()
+    concurrency = concurrency or _env_int("PREPLAN_CONCURRENCY", 8)
+    api_key = os.getenv("AMAP_KEY")
+    resolved = {}
+    counts = {"local": 0, "amap": 0, "geocode": 0}
+
+    missing = []
+    for location in locations:
+        row = _local_pois.get(location["id"])
+        record = _from_poi(location, row, "local") if row else None
+        if record:
+            resolved[location["id"]] = record
+        else:
+            missing.append(location)
+
+    if missing and api_key:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            details = list(pool.map(lambda l: _fetch_detail(api_key, l), missing))
+            ungeocoded = [l for l, record in zip(missing, details) if record is None]
+            geocodes = list(pool.map(lambda l: _geocode(api_key, l, city), ungeocoded))
+        for record in details + geocodes:
+            if record:
+                resolved[record["id"]] = record
+
+    records = []
+    unresolved = []
+    for location in locations:
+        record = resolved.get(location["id"])
+        if record:
+            counts[record["source"]] += 1
+            records.append(record)
+        else:
+            unresolved.append(location)
+    counts["unresolved"] = len(unresolved)
+    counts["elapsed_ms"] = round((time.monotonic() - started) * 1000, 1)
+    return {"locations": records, "unresolved": unresolved, "stats": counts}
+
+
+def format_preplan(preplan):
+    """Resolved locations as compact JSON lines for the planning prompt."""
+    if not preplan["locations"]:
+        return "无"
+    return "\n".join(
+        json.dumps({k: v for k, v in record.items() if k != "source" and v not in ("", None)}, ensure_ascii=False)
+        for record in preplan["locations"]
+    )
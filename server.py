@@ -1,11 +1,21 @@
 import os
-import re
+import json
+import asyncio
 from typing import List, Optional
-from fastapi import FastAPI, HTTPException, Response
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, conlist, field_validator
 from dotenv import load_dotenv
-import requests
+from starlette.concurrency import run_in_threadpool
+from tools.amap_client import amap_get, amap_get_json, amap_get_json_async, amap_client_stats, close_async_client
+from tools.static_map_cache import get_static_map_cache
+from tools.suggest_index import get_suggest_index
+from tools.geocoder import GEOCODE_URL, get_geocoder
+from tools.distance_matrix import get_distance_matrix_service
+from tools.distance_estimator import get_distance_estimator
+from tools.travel_times import start_travel_time_warmer, stop_travel_time_warmer, travel_time_stats
+from tools.poi_classifier import get_classifier
 
 # Load environment variables
 load_dotenv()
@@ -68,45 +78,36 @@ TOURISM_TYPES = "110000|110100|140000|060100|190000"
 PLACE_LEVELS = {"country", "province", "city", "district", "township", "street", "street_number", "building", "neighborhood", "village"}
 PLACE_SUFFIXES = ("市", "省", "区", "县", "州", "盟", "旗", "镇", "乡", "村", "街道", "路", "道")
 
-def resolve_adcode(api_key: str, query: str) -> Optional[str]:
-    """
-    Resolve a city name/query to an adcode using AMap InputTips.
-    """
-    url = "https://restapi.amap.com/v3/assistant/inputtips"
-    params = {
+INPUTTIPS_URL = "https://restapi.amap.com/v3/assistant/inputtips"
+PLACE_TEXT_URL = "https://restapi.amap.com/v3/place/text"
+
+def _adcode_params(api_key: str, query: str) -> dict:
+    return {
         "key": api_key,
         "keywords": query,
         "datatype": "all"
     }
-    try:
-        response = requests.get(url, params=params)
-        data = response.json()
-        if data["status"] == "1" and "tips" in data:
-            for tip in data["tips"]:
-                 # Return the first adcode found
-                 if tip.get("adcode"):
-                     return tip.get("adcode")
-    except Exception as e:
-        print(f"Error resolving adcode: {e}")
+
+def _parse_adcode(data: dict) -> Optional[str]:
+    if data["status"] == "1" and "tips" in data:
+        for tip in data["tips"]:
+             # Return the first adcode found
+             if tip.get("adcode"):
+                 return tip.get("adcode")
     return None
 
-def resolve_geocode_level(api_key: str, query: str) -> Optional[str]:
-    url = "https://restapi.amap.com/v3/geocode/geo"
-    params = {
+def _geocode_level_params(api_key: str, query: str) -> dict:
+    return {
         "key": api_key,
         "address": query
     }
-    try:
-        response = requests.get(url, params=params)
-        data = response.json()
-        if data.get("status") == "1" and data.get("geocodes"):
-            return data["geocodes"][0].get("level")
-    except Exception as e:
-        print(f"Error resolving geocode level: {e}")
+
+def _parse_geocode_level(data: dict) -> Optional[str]:
+    if data.get("status") == "1" and data.get("geocodes"):
+        return data["geocodes"][0].get("level")
     return None
 
-def fetch_pois(api_key: str, keywords: str, city: Optional[str] = None, types: Optional[str] = None, citylimit: Optional[str] = None, offset: int = 50, page: int = 1):
-    url = "https://restapi.amap.com/v3/place/text"
+def _poi_params(api_key: str, keywords: str, city: Optional[str] = None, types: Optional[str] = None, citylimit: Optional[str] = None, offset: int = 50, page: int = 1) -> dict:
     params = {
         "key": api_key,
         "keywords": keywords,
@@ -120,30 +121,59 @@ def fetch_pois(api_key: str, keywords: str, city: Optional[str] = None, types: O
         params["types"] = types
     if citylimit is not None:
         params["citylimit"] = citylimit
+    return params
+
+def _parse_pois(data: dict) -> list:
+    if data.get("status") == "1" and "pois" in data:
+        return data["pois"]
+    return []
+
+def resolve_adcode(api_key: str, query: str) -> Optional[str]:
+    """
+    Resolve a city name/query to an adcode using AMap InputTips.
+    """
+    try:
+        return _parse_adcode(amap_get_json(INPUTTIPS_URL, _adcode_params(api_key, query)))
+    except Exception as e:
+        print(f"Error resolving adcode: {e}")
+    return None
+
+def resolve_geocode_level(api_key: str, query: str) -> Optional[str]:
     try:
-        response = requests.get(url, params=params)
-        data = response.json()
-        if data.get("status") == "1" and "pois" in data:
-            return data["pois"]
+        return _parse_geocode_level(amap_get_json(GEOCODE_URL, _geocode_level_params(api_key, query)))
+    except Exception as e:
+        print(f"Error resolving geocode level: {e}")
+    return None
+
+def fetch_pois(api_key: str, keywords: str, city: Optional[str] = None, types: Optional[str] = None, citylimit: Optional[str] = None, offset: int = 50, page: int = 1):
+    try:
+        data = amap_get_json(PLACE_TEXT_URL, _poi_params(api_key, keywords, city, types, citylimit, offset, page))
+        return _parse_pois(data)
     except Exception as e:
         print(f"Error fetching POIs: {e}")
     return []
 
-def build_trip_location(poi: dict, tag_counts: dict) -> Optional[TripLocation]:
-    name = poi.get("name", "")
-    poi_type = poi.get("type", "")
-    raw_image_url = ""
+# Async variants share params/parsing with the sync helpers above but let transport
+# errors propagate, so the async endpoint can fall back to the sync path.
+
+async def resolve_adcode_async(api_key: str, query: str) -> Optional[str]:
+    data = await amap_get_json_async(INPUTTIPS_URL, _adcode_params(api_key, query))
+    return _parse_adcode(data)
+
+async def resolve_geocode_level_async(api_key: str, query: str) -> Optional[str]:
+    data = await amap_get_json_async(GEOCODE_URL, _geocode_level_params(api_key, query))
+    return _parse_geocode_level(data)
+
+async def fetch_pois_async(api_key: str, keywords: str, city: Optional[str] = None, types: Optional[str] = None, citylimit: Optional[str] = None, offset: int = 50, page: int = 1) -> list:
+    data = await amap_get_json_async(PLACE_TEXT_URL, _poi_params(api_key, keywords, city, types, citylimit, offset, page))
+    return _parse_pois(data)
+
+def _poi_image(poi: dict) -> str:
     if poi.get("photos") and len(poi["photos"]) > 0:
-        raw_image_url = poi["photos"][0].get("url", "")
-    lower_name = name.strip()
-    entrance_markers = ["入口", "出入口", "正门", "侧门", "大门", "东门", "西门", "南门", "北门", "停车场入口", "景区入口"]
-    is_entrance_name = any(marker in lower_name for marker in entrance_markers)
-    ends_with_gate = lower_name.endswith(("入口", "出入口", "正门", "侧门", "大门", "东门", "西门", "南门", "北门"))
-    bracket_gate = bool(re.search(r"[（(].*(入口|出入口|正门|侧门|大门|[东南西北]门).*[)）]", lower_name))
-    type_has_gate = "出入口" in poi_type or "门" in poi_type
-    if not raw_image_url:
-        return None
+        return poi["photos"][0].get("url", "")
+    return ""
 
+def _poi_rating(poi: dict) -> float:
     rating = 4.5
     biz_ext = poi.get("biz_ext", {})
     if isinstance(biz_ext, dict):
@@ -153,62 +183,69 @@ def build_trip_location(poi: dict, tag_counts: dict) -> Optional[TripLocation]:
                 rating = float(r_str)
             except:
                 pass
+    return rating
 
-    derived_tags = []
-    is_nature = "公园" in poi_type or "植物园" in poi_type or "山" in name
-    is_history = "博物馆" in poi_type or "古迹" in poi_type or "寺" in name
-    is_city = "步行街" in poi_type or "广场" in poi_type or "商场" in poi_type or "商业" in poi_type
-    is_coastal = "海滨" in poi_type or "浴场" in poi_type or "岛" in name
-    is_sightseeing = "风景" in poi_type or "景点" in poi_type
-
-    if is_nature:
-        derived_tags.append("Nature")
-        tag_counts["Nature"] += 1
-    if is_history:
-        derived_tags.append("Historical")
-        tag_counts["Historical"] += 1
-    if is_city:
-        derived_tags.append("City Break")
-        tag_counts["City Break"] += 1
-    if is_coastal:
-        derived_tags.append("Coastal")
-        tag_counts["Coastal"] += 1
-    if is_sightseeing:
-        derived_tags.append("Sightseeing")
-        tag_counts["Sightseeing"] += 1
-
-    if not derived_tags:
-        derived_tags = ["General"]
-
-    return TripLocation(
-        id=poi.get("id"),
-        name=poi.get("name"),
-        country="China",
-        province=poi.get("pname"),
-        city=poi.get("cityname"),
-        district=poi.get("adname"),
-        image=raw_image_url,
-        rating=rating,
-        tags=derived_tags,
-        daysRecommended=1
-    )
+def build_trip_locations(pois: list, tag_counts: dict) -> List[TripLocation]:
+    """
+    Turn a page of AMap POIs into TripLocations.
+    POIs without a photo are dropped; the rest are classified in one batch
+    (tags + entrance flags, see tools/poi_classifier.py) and their tags added to tag_counts.
+    """
+    displayable = []
+    for poi in pois:
+        image = _poi_image(poi)
+        if image:
+            displayable.append((poi, image))
+
+    batch = get_classifier().classify_batch([poi for poi, _ in displayable])
+    for tag, count in batch["tag_counts"].items():
+        tag_counts[tag] = tag_counts.get(tag, 0) + count
+
+    locations = []
+    for (poi, image), result in zip(displayable, batch["results"]):
+        locations.append(TripLocation(
+            id=poi.get("id"),
+            name=poi.get("name"),
+            country="China",
+            province=poi.get("pname"),
+            city=poi.get("cityname"),
+            district=poi.get("adname"),
+            image=image,
+            rating=_poi_rating(poi),
+            tags=result["tags"],
+            daysRecommended=1
+        ))
+    return locations
 
 # --- API Endpoints ---
 
+@app.on_event("shutdown")
+async def shutdown_clients():
+    await close_async_client()
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to TravelAI API"}
 
+SUGGEST_LIMIT = int(os.getenv("SUGGEST_LIMIT", "10"))
+SUGGEST_MIN_LOCAL_HITS = int(os.getenv("SUGGEST_MIN_LOCAL_HITS", "5"))
+
 @app.get("/api/search-suggestions", response_model=List[SearchSuggestion])
 def search_suggestions(query: str):
     """
-    Get search suggestions using AMap InputTips API.
+    Get search suggestions from the local prefix index (names, pinyin, initials).
+    Falls back to AMap InputTips only when the index has fewer than SUGGEST_MIN_LOCAL_HITS matches.
     """
+    local = [SearchSuggestion(**s) for s in get_suggest_index().search(query, limit=SUGGEST_LIMIT)]
+    if len(local) >= SUGGEST_MIN_LOCAL_HITS:
+        return local
+
     api_key = os.getenv("AMAP_KEY")
     if not api_key:
+        if local:
+            return local
         raise HTTPException(status_code=500, detail="AMAP_KEY not configured")
     
-    url = "https://restapi.amap.com/v3/assistant/inputtips"
     params = {
         "key": api_key,
         "keywords": query,
@@ -217,15 +254,17 @@ def search_suggestions(query: str):
     }
     
     try:
-        response = requests.get(url, params=params)
-        data = response.json()
+        data = amap_get_json(INPUTTIPS_URL, params)
         
-        suggestions = []
+        suggestions = list(local)
+        seen = {(s.name, s.district) for s in local}
         if data["status"] == "1" and "tips" in data:
             for tip in data["tips"]:
                 # Filter out empty names or non-existent locations
                 if not tip.get("id") or not tip.get("location"):
                     continue
+                if (tip.get("name"), tip.get("district", "")) in seen:
+                    continue
                     
                 suggestions.append(SearchSuggestion(
                     name=tip.get("name"),
@@ -234,21 +273,12 @@ def search_suggestions(query: str):
                 ))
         return suggestions
     except Exception as e:
+        if local:
+            return local
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/recommend-locations", response_model=dict)
-def recommend_locations(city: str, tags: Optional[str] = None):
-    """
-    Get recommended locations (POIs) based on city and tags.
-    Calls AMap Place API.
-    Returns { "locations": [...], "tag_counts": { "Nature": 5, ... } }
-    """
-    api_key = os.getenv("AMAP_KEY")
-    if not api_key:
-        raise HTTPException(status_code=500, detail="AMAP_KEY not configured")
-
-    all_locations = []
-    tag_counts = {
+def new_tag_counts() -> dict:
+    return {
         "Nature": 0,
         "Historical": 0,
         "City Break": 0,
@@ -256,6 +286,21 @@ def recommend_locations(city: str, tags: Optional[str] = None):
         "Sightseeing": 0
     }
 
+def filter_locations_by_tags(all_locations: List[TripLocation], tags: Optional[str]) -> List[TripLocation]:
+    if not tags or tags == "All":
+        return all_locations
+    requested_tags = tags.split(",")
+    # Keep locations that have ANY of the requested tags
+    return [loc for loc in all_locations if any(t in requested_tags for t in loc.tags)]
+
+def _recommend_locations_sync(api_key: str, city: str, tags: Optional[str] = None) -> dict:
+    """
+    Sequential resolution path: geocode level -> scenic POIs -> adcode -> tourism POIs.
+    Used as the fallback for the async endpoint.
+    """
+    all_locations = []
+    tag_counts = new_tag_counts()
+
     try:
         input_query = city
         looks_like_place_name = input_query.endswith(PLACE_SUFFIXES)
@@ -269,10 +314,7 @@ def recommend_locations(city: str, tags: Optional[str] = None):
             scenic_pois = fetch_pois(api_key, input_query, types=SCENIC_TYPES, citylimit="false", offset=20, page=1)
 
         if scenic_pois:
-            for poi in scenic_pois:
-                loc = build_trip_location(poi, tag_counts)
-                if loc:
-                    all_locations.append(loc)
+            all_locations = build_trip_locations(scenic_pois, tag_counts)
         else:
             target_city = input_query
             if not target_city.isdigit():
@@ -281,24 +323,10 @@ def recommend_locations(city: str, tags: Optional[str] = None):
                     target_city = resolved_adcode
 
             base_pois = fetch_pois(api_key, "景点", city=target_city, types=TOURISM_TYPES, citylimit="true", offset=50, page=1)
-            for poi in base_pois:
-                loc = build_trip_location(poi, tag_counts)
-                if loc:
-                    all_locations.append(loc)
-
-        # 2. Filter locations based on requested tags
-        filtered_locations = []
-        if tags and tags != "All":
-            requested_tags = tags.split(",")
-            for loc in all_locations:
-                # Check if location has ANY of the requested tags
-                if any(t in requested_tags for t in loc.tags):
-                    filtered_locations.append(loc)
-        else:
-            filtered_locations = all_locations
+            all_locations = build_trip_locations(base_pois, tag_counts)
 
         return {
-            "locations": filtered_locations,
+            "locations": filter_locations_by_tags(all_locations, tags),
             "tag_counts": tag_counts
         }
 
@@ -306,8 +334,177 @@ def recommend_locations(city: str, tags: Optional[str] = None):
         print(f"Error fetching POIs: {e}")
         return {"locations": [], "tag_counts": {}}
 
+async def _resolve_pois_async(api_key: str, input_query: str):
+    """
+    Concurrent version of the sync resolution chain.
+    Geocode level, scenic POI search and adcode lookup are independent, so they start together;
+    whichever branch the geocode level rules out is cancelled as soon as it is known.
+    Returns (page-1 POIs, the fetch_pois_async kwargs that produced them) so callers can paginate.
+    """
+    async def tourism_pois(adcode_task):
+        target_city = await adcode_task if adcode_task else None
+        query = dict(keywords="景点", city=target_city or input_query, types=TOURISM_TYPES, citylimit="true", offset=50)
+        return await fetch_pois_async(api_key, page=1, **query), query
+
+    if input_query.isdigit():
+        return await tourism_pois(None)
+
+    adcode_task = asyncio.create_task(resolve_adcode_async(api_key, input_query))
+    if input_query.endswith(PLACE_SUFFIXES):
+        try:
+            return await tourism_pois(adcode_task)
+        finally:
+            adcode_task.cancel()
+
+    scenic_query = dict(keywords=input_query, types=SCENIC_TYPES, citylimit="false", offset=20)
+    level_task = asyncio.create_task(resolve_geocode_level_async(api_key, input_query))
+    scenic_task = asyncio.create_task(fetch_pois_async(api_key, page=1, **scenic_query))
+    try:
+        geocode_level = await level_task
+        if geocode_level in PLACE_LEVELS:
+            scenic_task.cancel()
+        else:
+            scenic_pois = await scenic_task
+            if scenic_pois:
+                adcode_task.cancel()
+                return scenic_pois, scenic_query
+        return await tourism_pois(adcode_task)
+    finally:
+        for task in (adcode_task, level_task, scenic_task):
+            if not task.done():
+                task.cancel()
+
+@app.get("/api/recommend-locations", response_model=dict)
+async def recommend_locations(city: str, tags: Optional[str] = None):
+    """
+    Get recommended locations (POIs) based on city and tags.
+    Calls AMap Place API, resolving independent lookups concurrently;
+    falls back to the sequential sync path if the async client fails or RECOMMEND_ASYNC=0.
+    Returns { "locations": [...], "tag_counts": { "Nature": 5, ... } }
+    """
+    api_key = os.getenv("AMAP_KEY")
+    if not api_key:
+        raise HTTPException(status_code=500, detail="AMAP_KEY not configured")
+
+    if os.getenv("RECOMMEND_ASYNC", "1") != "0":
+        try:
+            pois, _ = await _resolve_pois_async(api_key, city)
+        except Exception as e:
+            print(f"Async POI resolution failed, falling back to sync path: {e}")
+        else:
+            tag_counts = new_tag_counts()
+            all_locations = build_trip_locations(pois, tag_counts)
+            return {
+                "locations": filter_locations_by_tags(all_locations, tags),
+                "tag_counts": tag_counts
+            }
+
+    return await run_in_threadpool(_recommend_locations_sync, api_key, city, tags)
+
+STREAM_MAX_PAGES = int(os.getenv("RECOMMEND_STREAM_MAX_PAGES", "10"))
+STREAM_PAGE_CONCURRENCY = int(os.getenv("RECOMMEND_STREAM_CONCURRENCY", "4"))
+
+async def _stream_locations(api_key: str, city: str, tags: Optional[str], target: int):
+    """
+    Yield ("location", TripLocation) as soon as each one passes the photo and tag filters,
+    then ("done", summary). Page 1 comes from the concurrent resolver; later pages are
+    fetched STREAM_PAGE_CONCURRENCY at a time until `target` locations were emitted.
+    """
+    tag_counts = new_tag_counts()
+    seen_ids = set()
+    emitted = 0
+    pages = 0
+
+    def accept(pois):
+        accepted = []
+        for loc in filter_locations_by_tags(build_trip_locations(pois, tag_counts), tags):
+            if loc.id in seen_ids:
+                continue
+            seen_ids.add(loc.id)
+            accepted.append(loc)
+        return accepted
+
+    try:
+        first_page, query = await _resolve_pois_async(api_key, city)
+    except Exception as e:
+        print(f"Async POI resolution failed, streaming sync result: {e}")
+        result = await run_in_threadpool(_recommend_locations_sync, api_key, city, tags)
+        for loc in result["locations"][:target]:
+            yield "location", loc
+        yield "done", {"count": min(len(result["locations"]), target), "pages": 1, "tag_counts": result["tag_counts"]}
+        return
+
+    pages = 1
+    for loc in accept(first_page):
+        if emitted >= target:
+            break
+        emitted += 1
+        yield "location", loc
+
+    next_page = 2
+    exhausted = len(first_page) < query["offset"]
+    while emitted < target and not exhausted and next_page <= STREAM_MAX_PAGES:
+        window = range(next_page, min(next_page + STREAM_PAGE_CONCURRENCY, STREAM_MAX_PAGES + 1))
+        next_page = window[-1] + 1
+        tasks = [asyncio.create_task(fetch_pois_async(api_key, page=page, **query)) for page in window]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                try:
+                    pois = await finished
+                except Exception as e:
+                    print(f"Error fetching POI page: {e}")
+                    continue
+                pages += 1
+                if len(pois) < query["offset"]:
+                    exhausted = True
+                for loc in accept(pois):
+                    if emitted >= target:
+                        break
+                    emitted += 1
+                    yield "location", loc
+                if emitted >= target:
+                    break
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    yield "done", {"count": emitted, "pages": pages, "tag_counts": tag_counts}
+
+@app.get("/api/recommend-locations/stream")
+async def recommend_locations_stream(city: str, tags: Optional[str] = None, target: int = 30, format: str = "ndjson"):
+    """
+    Streaming variant of /api/recommend-locations that reads result pages concurrently
+    until `target` displayable locations were found.
+    format=ndjson: one JSON object per line, {"type": "location", "location": {...}} then {"type": "done", ...}
+    format=sse: the same payloads as Server-Sent Events ("location" / "done").
+    """
+    api_key = os.getenv("AMAP_KEY")
+    if not api_key:
+        raise HTTPException(status_code=500, detail="AMAP_KEY not configured")
+    target = max(1, min(target, 200))
+
+    async def body():
+        async for kind, payload in _stream_locations(api_key, city, tags, target):
+            if kind == "location":
+                data = {"type": "location", "location": payload.model_dump()}
+            else:
+                data = {"type": "done", **payload}
+            line = json.dumps(data, ensure_ascii=False)
+            if format == "sse":
+                yield f"event: {kind}\ndata: {line}\n\n"
+            else:
+                yield line + "\n"
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(body(), media_type=media_type, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.get("/api/static-map")
-def static_map(center: str, zoom: int = 11, size: str = "1024*768", markers: Optional[str] = None):
+def static_map(request: Request, center: str, zoom: int = 11, size: str = "1024*768", markers: Optional[str] = None):
+    """
+    Proxy AMap static map images through the on-disk image cache.
+    Repeat views are served from disk and honour If-None-Match / If-Modified-Since.
+    """
     api_key = os.getenv("AMAP_KEY")
     if not api_key:
         raise HTTPException(status_code=500, detail="AMAP_KEY not configured")
@@ -319,21 +516,47 @@ def static_map(center: str, zoom: int = 11, size: str = "1024*768", markers: Opt
     }
     if markers:
         params["markers"] = markers
+    cache = get_static_map_cache()
     try:
-        response = requests.get("https://restapi.amap.com/v3/staticmap", params=params)
-        if response.status_code != 200:
-            raise HTTPException(status_code=response.status_code, detail="AMAP static map error")
-        content_type = response.headers.get("Content-Type", "image/png")
-        return Response(content=response.content, media_type=content_type)
+        entry = cache.lookup(params)
+        if entry is None:
+            response = amap_get("https://restapi.amap.com/v3/staticmap", params)
+            if response.status_code != 200:
+                raise HTTPException(status_code=response.status_code, detail="AMAP static map error")
+            content_type = response.headers.get("Content-Type", "image/png")
+            if not content_type.startswith("image/"):
+                # AMap reports errors (bad key, quota) as JSON with HTTP 200; never cache those.
+                return Response(content=response.content, media_type=content_type)
+            entry = cache.store(params, response.content, content_type)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-from crewai import Crew, Process
-from agents import TravelAgents
-from tasks import TravelTasks
-import json
+    headers = entry.headers()
+    if entry.not_modified(request.headers.get("if-none-match"), request.headers.get("if-modified-since")):
+        return Response(status_code=304, headers=headers)
+    # Served from memory: the file may be evicted by another worker before it could be streamed
+    return Response(content=entry.content, media_type=entry.content_type, headers=headers)
+
+@app.get("/api/metrics/amap")
+def amap_metrics():
+    """
+    AMap client statistics: connection pool occupancy, per-endpoint request/retry/timeout counters,
+    caches, the geocoder, the distance matrix service, the offline distance estimator and the
+    time-of-day travel time store.
+    """
+    stats = amap_client_stats()
+    stats["static_map_cache"] = get_static_map_cache().stats()
+    stats["suggest_index"] = get_suggest_index().stats()
+    stats["geocoder"] = get_geocoder().stats()
+    stats["distance_matrix"] = get_distance_matrix_service().stats()
+    stats["distance_estimator"] = get_distance_estimator().stats()
+    stats["travel_times"] = travel_time_stats()
+    return stats
+
+from itinerary_jobs import get_job_queue
+from tools.instrumentation import get_metrics_store, server_timing
 
 class TripPreferences(BaseModel):
     city: str
@@ -356,85 +579,136 @@ class TripPreferences(BaseModel):
             raise ValueError("budget min must be <= max")
         return v
 
-@app.post("/api/generate-itinerary")
-def generate_itinerary(prefs: TripPreferences):
+@app.on_event("startup")
+def recover_itinerary_jobs():
+    try:
+        if os.getenv("ITINERARY_PREWARM", "1") != "0":
+            get_job_queue().warm()
+        get_job_queue().recover()
+    except Exception as e:
+        print(f"Itinerary job recovery failed: {e}")
+
+@app.on_event("shutdown")
+def shutdown_itinerary_workers():
+    get_job_queue().shutdown()
+
+@app.on_event("startup")
+def start_travel_time_warming():
+    try:
+        start_travel_time_warmer()
+    except Exception as e:
+        print(f"Travel time warmer failed to start: {e}")
+
+@app.on_event("shutdown")
+def stop_travel_time_warming():
+    stop_travel_time_warmer()
+
+ITINERARY_CACHE_HEADER = "X-Itinerary-Cache"
+
+def submit_itinerary_job(prefs: TripPreferences, request: Request):
     """
-    Generate itinerary using CrewAI based on preferences.
+    Queue a job (or answer it from the itinerary cache); returns (job_id, cache status).
+    A "Cache-Control: no-cache" request header skips the cache lookup.
     """
+    use_cache = "no-cache" not in (request.headers.get("cache-control") or "").lower()
     try:
-        # Instantiate Agents & Tasks
-        agents = TravelAgents()
-        tasks = TravelTasks()
+        return get_job_queue().submit(prefs.model_dump(), use_cache=use_cache)
+    except OverflowError as e:
+        raise HTTPException(status_code=503, detail=str(e))
 
-        researcher = agents.destination_researcher()
-        planner = agents.itinerary_planner()
+@app.post("/api/itinerary-jobs", status_code=202)
+def create_itinerary_job(prefs: TripPreferences, request: Request, response: Response):
+    """
+    Queue an itinerary generation job and return its id immediately.
+    Poll GET /api/itinerary-jobs/{job_id} for progress and the result.
+    """
+    job_id, cache_status = submit_itinerary_job(prefs, request)
+    response.headers[ITINERARY_CACHE_HEADER] = cache_status
+    status = "succeeded" if cache_status == "HIT" else "queued"
+    return {"job_id": job_id, "status": status, "cache": cache_status}
 
-        # Context inputs for Tasks
-        # Convert selected locations to string for prompt
-        loc_str = ", ".join([l.name for l in prefs.selected_locations])
-        
-        inputs = {
-            'city': prefs.city,
-            'days': prefs.days,
-            'start_date': prefs.start_date or "",
-            'end_date': prefs.end_date or "",
-            'budget': f"{prefs.budget[0]}-{prefs.budget[1]} CNY",
-            'interests': ", ".join(prefs.interests),
-            'transport': prefs.transport or "",
-            'dining_prefs': ", ".join(prefs.dining_prefs),
-            'accommodation_prefs': ", ".join(prefs.accommodation_prefs),
-            'selected_locations': loc_str
-        }
+@app.get("/api/itinerary-jobs/{job_id}")
+def get_itinerary_job(job_id: str):
+    """
+    Job status (queued / running / succeeded / failed), per-task progress, and the itinerary JSON once done.
+    """
+    job = get_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+def _job_event_stream(job_id: str, after: int = 0, cache_status: Optional[str] = None):
+    """Server-Sent Events body for a job: progress, tripTitle / budgetRange / day pieces, then result or error."""
+    async def body():
+        yield f"event: job\ndata: {json.dumps({'job_id': job_id})}\n\n"
+        async for item in get_job_queue().events(job_id, after):
+            if item is None:
+                yield ": keep-alive\n\n"
+                continue
+            seq, event, data = item
+            yield f"id: {seq}\nevent: {event}\ndata: {data}\n\n"
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    if cache_status:
+        headers[ITINERARY_CACHE_HEADER] = cache_status
+    return StreamingResponse(body(), media_type="text/event-stream", headers=headers)
+
+@app.get("/api/itinerary-jobs/{job_id}/events")
+def itinerary_job_events(job_id: str, request: Request):
+    """
+    Stream a job's events as SSE. "day" events carry {"index", "day"} as soon as the planner
+    closes days[i]; reconnecting clients resume after the Last-Event-ID header.
+    """
+    if get_job_queue().get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    try:
+        after = int(request.headers.get("last-event-id") or 0)
+    except ValueError:
+        after = 0
+    return _job_event_stream(job_id, after)
 
-        # Note: We might skip research_task if we already have selected locations?
-        # But 'planning_task' expects context from 'research_task' in original design.
-        # Let's keep it but maybe simplify research prompt if needed, 
-        # or just let researcher find details about the SELECTED locations.
-        
-        # Original research task was: "Search 10 attractions..."
-        # We should modify research task to: "Get details for these SPECIFIC selected locations"
-        # For now, let's reuse existing structure but inject our selected locations into the prompt if possible.
-        # Actually, let's just pass inputs to kickoff.
-
-        research_task = tasks.research_task(researcher)
-        planning_task = tasks.planning_task(planner, [research_task])
-
-        crew = Crew(
-            agents=[researcher, planner],
-            tasks=[research_task, planning_task],
-            process=Process.sequential,
-            verbose=True
-        )
-
-        result = crew.kickoff(inputs=inputs)
-        
-        # Result is usually a string (TaskOutput).
-        # We instructed Agent to output JSON.
-        # Try to parse it.
-        
-        try:
-            # Clean potential markdown fences
-            raw_output = str(result)
-            if "```json" in raw_output:
-                raw_output = raw_output.split("```json")[1].split("```")[0]
-            elif "```" in raw_output:
-                raw_output = raw_output.split("```")[1].split("```")[0]
-            
-            json_output = json.loads(raw_output.strip())
-            if isinstance(json_output, dict):
-                json_output.setdefault(
-                    "budgetRange",
-                    {"min": prefs.budget[0], "max": prefs.budget[1], "currency": "¥"},
-                )
-            return json_output
-        except Exception as e:
-            print(f"JSON Parse Error: {e}")
-            # Fallback or error
-            raise HTTPException(status_code=500, detail="AI failed to generate valid JSON itinerary.")
+@app.post("/api/generate-itinerary/stream")
+def generate_itinerary_stream(prefs: TripPreferences, request: Request):
+    """
+    Streaming variant of /api/generate-itinerary: queues the job and returns its event stream.
+    """
+    job_id, cache_status = submit_itinerary_job(prefs, request)
+    return _job_event_stream(job_id, cache_status=cache_status)
 
-    except Exception as e:
-        print(f"Crew Execution Error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+@app.post("/api/generate-itinerary")
+async def generate_itinerary(prefs: TripPreferences, request: Request, response: Response):
+    """
+    Generate itinerary using CrewAI based on preferences.
+    Runs as a job on the crew worker pool; the request waits for it without holding a server thread.
+    Near-identical preferences are answered from the itinerary cache (see X-Itinerary-Cache).
+    Where the time went (stages, LLM, tools) is reported in the Server-Timing header.
+    """
+    job_id, cache_status = submit_itinerary_job(prefs, request)
+    response.headers[ITINERARY_CACHE_HEADER] = cache_status
+    job = await get_job_queue().wait(job_id)
+    if job is None or job["status"] != "succeeded":
+        raise HTTPException(status_code=500, detail=(job or {}).get("error") or "Itinerary job failed")
+    breakdown = ((job.get("progress") or {}).get("timings") or {}).get("breakdown")
+    if breakdown:
+        response.headers["Server-Timing"] = server_timing(breakdown)
+    return job["result"]
+
+@app.get("/api/metrics/itinerary")
+def itinerary_metrics():
+    """
+    Crew worker pool occupancy, job counts by status and cumulative job metrics
+    (itinerary parse outcomes, JSON fixes and per-day repair requests).
+    """
+    return {"jobs": get_job_queue().stats()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """
+    Crew instrumentation histograms (stage, LLM call, token and tool call) in the Prometheus text format.
+    """
+    store = get_metrics_store()
+    body = store.render_prometheus() if store is not None else ""
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
     import uvicorn
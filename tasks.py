@@ -1,14 +1,38 @@
 from crewai import Task
 from textwrap import dedent
 
+# Output format for prompts that produce a single element of the planning_task "days" array.
+DAY_OUTPUT_FORMAT = dedent("""
+    **输出格式:**
+    只返回这一天的 JSON 对象（不能包含 Markdown、代码块或其他文字），结构与完整行程中 days 的元素相同:
+    {
+        "dayHeader": "Day 1",
+        "daySubHeader": "Theme of the day",
+        "dateShort": "OCT 12",
+        "mapPins": [
+            { "seq": 1, "id": 1, "name": "Location Name", "lat": 39.9, "lng": 116.4, "active": false, "isExtra": false,
+              "stopNumber": "Stop #1", "title": "Location Name", "duration": "2h", "description": "Short description...",
+              "aiStrategy": "AI tip...", "estimatedCost": 50, "costDescription": "Ticket: ¥50" }
+        ],
+        "timeline": [
+            { "time": "09:00 AM", "title": "Activity Title", "description": "Description...", "isExtra": false,
+              "tags": [{ "label": "Sightseeing", "color": "blue" }], "estimatedCost": 50, "type": "activity" },
+            { "time": "11:00 AM", "title": "Travel to Next Location", "description": "Subway Line 1...", "isExtra": false,
+              "tags": [{ "label": "Travel", "color": "gray" }], "estimatedCost": 20, "type": "travel",
+              "travelDetails": { "mode": "transit", "duration": "30 min", "distance": "5.2 km", "originId": 1, "destinationId": 2 } }
+        ]
+    }
+""")
+
+
 class TravelTasks:
     def research_task(self, agent):
         return Task(
             description=dedent("""
                 基于用户已选择的景点清单，为每个景点补全必要细节，用于行程规划。
 
-                **已选景点:**
-                {selected_locations}
+                **待调研景点（预处理阶段未能解析）:**
+                {research_locations}
 
                 **要求:**
                 1. 使用已选景点的基础上，如果有多余空闲时间，可以新增景点。
@@ -22,7 +46,7 @@ class TravelTasks:
     def planning_task(self, agent, context_tasks):
         return Task(
             description=dedent("""
-                基于调研结果与用户偏好，生成 {days} 天游玩行程，考虑用户已选择的景点与多余空闲时间。
+                基于已解析景点数据、调研结果与用户偏好，生成 {days} 天游玩行程，考虑用户已选择的景点与多余空闲时间。
                 
                 **用户偏好:**
                 - Budget: {budget}
@@ -34,8 +58,11 @@ class TravelTasks:
                 - Start Date: {start_date}
                 - End Date: {end_date}
 
+                **已解析景点数据（坐标、类型、开放时间与建议停留时长，可直接使用）:**
+                {location_details}
+
                 **指引:**
-                1. 使用 `route_optimizer` 工具对景点顺序进行优化，减少移动距离。
+                1. 使用 `multi_day_router` 工具一次性完成分天与排序：hotel 为住宿区域（未知时用城市中心），stops 按“名称|停留小时|开放时间|经度,纬度”传入全部景点（取自上方已解析数据），days 为 {days}，mode 为主要交通方式。按其返回的每日顺序与到达/离开时间编写行程，无需自行分天；未能排入的景点再酌情安排。
                 2. 行程需符合日期与天数限制，避免走回头路。
                 3. 若 Dining Preferences 或 Accommodation Preferences 包含限制或关键词，必须按限制输出对应餐食与住宿建议。
                 4. 若未提供相关限制或为空，则提供交通便利的餐饮聚集区与住宿聚集区建议，并说明适宜位置与通达性。
@@ -52,7 +79,7 @@ class TravelTasks:
                     - 在输出中明确每一步的预计花费。
                 12. **交通规划**:
                     - 必须使用 `{transport}` 作为主要交通方式（若为空或未指定，默认使用 'transit'）。
-                    - 使用 `distance_calculator` 工具计算相邻活动/景点间的交通时间、距离与费用。
+                    - 排定每天的顺序后，只调用一次 `travel_legs_calculator` 工具（每天一行，如 "Day 1: 酒店 -> 景点A -> 景点B"）获取全部相邻活动/景点间的交通时间、距离、费用与线路，不要逐段调用 `distance_calculator`；start_date 传 {start_date}，离开某景点的时间可写成 "景点@HH:MM"（早晚高峰耗时不同）。
                     - 在 timeline 中显式添加交通事件（"type": "travel"），位于两个活动之间。
                     - 交通事件的 `description` 应包含具体的路线信息（如“地铁2号线 -> 5路公交”）。
                     - 确保行程安排的时间流包含交通耗时。
@@ -127,3 +154,65 @@ class TravelTasks:
             agent=agent,
             context=context_tasks
         )
+
+    def day_planning_task(self, agent):
+        """One day of a trip whose locations were already grouped into days (see day_clustering.py)."""
+        return Task(
+            description=dedent("""
+                为 {city} 的 {days} 天行程生成第 {day_number} 天（{day_date}）的详细安排。景点已按地理位置与游玩时长预先分组，本日只安排下列景点，其他景点由其他天负责。
+
+                **用户偏好:**
+                - Budget: {budget}（整个行程共 {days} 天的预算）
+                - Interests: {interests}
+                - Transportation: {transport}
+                - Dining Preferences: {dining_prefs}
+                - Accommodation Preferences: {accommodation_prefs}
+
+                **本日景点（坐标、类型、开放时间与建议停留时长，可直接使用）:**
+                {day_locations}
+
+                **指引:**
+                1. 使用 `multi_day_router` 工具（days 为 1）排定本日景点顺序与到达/离开时间：stops 按“名称|停留小时|开放时间|经度,纬度”传入本日景点，hotel 为住宿区域（未知时用本日第一个景点）。
+                2. 调用一次 `travel_legs_calculator` 工具（如 "Day {day_number}: 酒店 -> 景点A -> 景点B"）获取本日全部相邻景点间的交通时间、距离、费用与线路（不要逐段调用 `distance_calculator`；日期为 YYYY-MM-DD 时 start_date 传 {day_date}，离开景点的时间可写成 "景点@HH:MM"），在 timeline 中添加交通事件（"type": "travel"），主要交通方式为 `{transport}`（为空时默认 'transit'）。
+                3. 结合餐饮偏好安排午餐与晚餐；若有住宿偏好，给出交通便利的住宿建议。
+                4. 本日景点必须全部出现在 mapPins 中，标注 isExtra 为 false；空闲时间可新增景点或活动，标注 isExtra 为 true。
+                5. mapPins 按游玩顺序排列，`seq` 从 {first_seq} 开始连续递增。
+                6. 根据预算估算每项活动与交通的费用（考虑季节与周末上浮）。
+            """) + DAY_OUTPUT_FORMAT,
+            expected_output="A strictly valid JSON object for one day of the itinerary.",
+            agent=agent
+        )
+
+    def day_repair_prompt(self, inputs, day_index, other_days, first_seq=1):
+        """
+        Prompt that re-requests one day of an itinerary whose JSON came back missing or invalid,
+        instead of re-running the whole planning crew. other_days summarizes the valid days so
+        the replacement does not repeat their locations.
+        """
+        return dedent("""
+            以下行程中第 {day_number} 天（共 {days} 天）的 JSON 缺失或无效，请只重新生成这一天。
+
+            **用户偏好:**
+            - City: {city}
+            - Budget: {budget}
+            - Interests: {interests}
+            - Transportation: {transport}
+            - Dining Preferences: {dining_prefs}
+            - Selected Locations: {selected_locations}
+            - Start Date: {start_date}
+
+            **已解析景点数据:**
+            {location_details}
+
+            **其他天已安排的景点（不要重复）:**
+            {other_days}
+
+            **要求:**
+            1. 已选景点中未出现在其他天的，应安排在这一天。
+            2. mapPins 的 `seq` 从 {first_seq} 开始连续递增。
+        """).format(
+            day_number=day_index + 1,
+            other_days=other_days or "无",
+            first_seq=first_seq,
+            **inputs,
+        ) + DAY_OUTPUT_FORMAT
@@ -0,0 +1,19 @@
+import time
+
+from tools.rate_limiter import RateLimiter
+
+
+def test_low_qps_serves_every_priority(tmp_path):
+    limiter = RateLimiter(path=str(tmp_path / "limiter.sqlite3"), qps=1.0)
+    assert limiter.burst == 1.0
+    assert all(reserve == 0.0 for reserve in limiter.reserves.values())
+    for name in ("batch", "agent", "interactive"):
+        deadline = time.time() + 3.0
+        while limiter._try_acquire(name):
+            assert time.time() < deadline, f"{name} never got a token at 1 QPS"
+            time.sleep(0.05)
+
+
+def test_reserves_clamped_below_burst(tmp_path):
+    limiter = RateLimiter(path=str(tmp_path / "limiter.sqlite3"), qps=2.0, reserves={"interactive": 0.0, "agent": 1.0, "batch": 5.0})
+    assert limiter.reserves == {"interactive": 0.0, "agent": 1.0, "batch": 1.0}
@@ -0,0 +1,30 @@
+from tools import map_tools
+from tools.route_planner import parse_coord, parse_stops
+
+
+def test_names_with_commas_are_not_coordinates():
+    stops = parse_stops("Hilton, Xi'an|1|08:00-17:00|Hilton, Xi'an; 大雁塔|2||108.964, 34.219")
+    assert stops[0]["coord"] is None
+    assert stops[1]["coord"] == "108.964,34.219"
+    assert parse_coord("Hilton, Xi'an") is None
+
+
+def test_multi_day_route_geocodes_hotel_with_comma(monkeypatch):
+    requested = []
+
+    class Geocoder:
+        def geocode_many(self, names, city=None):
+            requested.extend(names)
+            return {name: "108.94,34.26" for name in names}
+
+    monkeypatch.setattr(map_tools, "get_geocoder", lambda: Geocoder())
+    monkeypatch.setattr(
+        map_tools.MapTools, "_travel_matrix",
+        staticmethod(lambda coords, mode, city=None, when=None: (
+            {"distance": [[0] * len(coords) for _ in coords], "duration": [[600] * len(coords) for _ in coords]}, 0,
+        )),
+    )
+    tool = map_tools.MapTools.plan_multi_day_route
+    result = getattr(tool, "func", tool)("Hilton, Xi'an", "大雁塔|2||108.964,34.219", 1, mode="driving")
+    assert "Hilton, Xi'an" in requested
+    assert '"name": "大雁塔"' in result
@@ -0,0 +1,281 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+# Positive TTLs per AMap endpoint. Endpoints not listed here are never cached.
+ENDPOINT_TTLS = {
+    "/v3/geocode/geo": 30 * DAY,          # addresses practically never move
+    "/v3/assistant/inputtips": 7 * DAY,
+    "/v3/place/text": 1 * DAY,            # POI lists / ratings / photos change daily
+    "/v3/place/detail": 1 * DAY,
+    "/v3/distance": 7 * DAY,
+    "/v3/direction/driving": 6 * HOUR,
+    "/v3/direction/walking": 7 * DAY,
+    "/v3/direction/transit/integrated": 6 * HOUR,
+    "/v4/direction/bicycling": 7 * DAY,
+}
+
+# Empty-but-successful answers ("no such place") are cached for a shorter time.
+NEGATIVE_TTL = 6 * HOUR
+
+# Result lists whose emptiness marks a response as negative.
+RESULT_FIELDS = ("geocodes", "pois", "tips", "results", "route", "data")
+
+# Query params that do not change the answer and must not leak into cache keys.
+IGNORED_PARAMS = {"key", "sig", "output"}
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def cache_key(endpoint, params):
+    """Stable key for an AMap request: endpoint + sorted, trimmed params without the API key."""
+    normalized = sorted(
+        (str(k), str(v).strip())
+        for k, v in (params or {}).items()
+        if k not in IGNORED_PARAMS and v is not None
+    )
+    raw = json.dumps([endpoint, normalized], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def is_cacheable(data):
+    """Only successful AMap answers are cached; quota/auth errors must be retried."""
+    if not isinstance(data, dict):
+        return False
+    return data.get("status") == "1" or data.get("errcode") == 0
+
+
+def is_negative(data):
+    """A successful answer that carries no results."""
+    if str(data.get("count", "")) == "0":
+        return True
+    for field in RESULT_FIELDS:
+        if field in data:
+            value = data[field]
+            if value in (None, "", [], {}):
+                return True
+            if field == "route" and isinstance(value, dict):
+                return not (value.get("paths") or value.get("transits"))
+            if field == "data" and isinstance(value, dict):
+                return not value.get("paths")
+            return False
+    return False
+
+
+class AmapCache:
+    """
+    Two-tier AMap response cache: an in-process LRU in front of a SQLite file shared by all workers.
+    Entries expire per endpoint TTL; empty answers are stored as negative entries with NEGATIVE_TTL.
+    """
+
+    def __init__(self, path=None, lru_size=None, ttls=None, negative_ttl=None):
+        self.path = path or os.getenv(
+            "AMAP_CACHE_PATH", os.path.join("/tmp", "travelai_cache", "amap_cache.sqlite3")
+        )
+        self.lru_size = lru_size or _env_int("AMAP_CACHE_LRU_SIZE", 4096)
+        self.ttls = ttls or ENDPOINT_TTLS
+        self.negative_ttl = negative_ttl if negative_ttl is not None else _env_int("AMAP_CACHE_NEGATIVE_TTL", NEGATIVE_TTL)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._counters = {}
+        self._writes = 0
+        self._init_db()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._conn()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS amap_cache (
+                key TEXT PRIMARY KEY,
+                endpoint TEXT NOT NULL,
+                value TEXT NOT NULL,
+                negative INTEGER NOT NULL DEFAULT 0,
+                expires_at REAL NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_amap_cache_expires ON amap_cache (expires_at)")
+        conn.commit()
+
+    def _count(self, endpoint, name):
+        with self._lock:
+            counters = self._counters.setdefault(endpoint, {
+                "lru_hits": 0, "disk_hits": 0, "misses": 0, "negative_hits": 0, "stores": 0, "negative_stores": 0,
+            })
+            counters[name] += 1
+
+    def enabled_for(self, endpoint):
+        return endpoint in self.ttls
+
+    def get(self, endpoint, params):
+        """Return the cached JSON answer or None."""
+        if not self.enabled_for(endpoint):
+            return None
+        key = cache_key(endpoint, params)
+        now = time.time()
+
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None:
+                expires_at, negative, value = entry
+                if expires_at > now:
+                    self._lru.move_to_end(key)
+                else:
+                    del self._lru[key]
+                    entry = None
+        if entry is not None:
+            self._count(endpoint, "lru_hits")
+            if negative:
+                self._count(endpoint, "negative_hits")
+            return value
+
+        try:
+            row = self._conn().execute(
+                "SELECT value, negative, expires_at FROM amap_cache WHERE key = ? AND expires_at > ?",
+                (key, now),
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"AMap cache read failed: {e}")
+            row = None
+        if row is None:
+            self._count(endpoint, "misses")
+            return None
+
+        value = json.loads(row[0])
+        self._remember(key, row[2], bool(row[1]), value)
+        self._count(endpoint, "disk_hits")
+        if row[1]:
+            self._count(endpoint, "negative_hits")
+        return value
+
+    def set(self, endpoint, params, data):
+        """Store a successful AMap answer; errors and uncached endpoints are ignored."""
+        if not self.enabled_for(endpoint) or not is_cacheable(data):
+            return
+        negative = is_negative(data)
+        ttl = self.negative_ttl if negative else self.ttls[endpoint]
+        now = time.time()
+        expires_at = now + ttl
+        key = cache_key(endpoint, params)
+        self._remember(key, expires_at, negative, data)
+        try:
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO amap_cache (key, endpoint, value, negative, expires_at, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, endpoint, json.dumps(data, ensure_ascii=False), int(negative), expires_at, now),
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"AMap cache write failed: {e}")
+        self._count(endpoint, "negative_stores" if negative else "stores")
+        self._maybe_prune()
+
+    def recent(self, endpoint, limit=1000):
+        """Most recent live (non-negative) answers stored for an endpoint, newest first."""
+        try:
+            rows = self._conn().execute(
+                "SELECT value FROM amap_cache WHERE endpoint = ? AND negative = 0 AND expires_at > ? "
+                "ORDER BY created_at DESC LIMIT ?",
+                (endpoint, time.time(), limit),
+            ).fetchall()
+        except sqlite3.Error as e:
+            print(f"AMap cache read failed: {e}")
+            return []
+        return [json.loads(row[0]) for row in rows]
+
+    def _remember(self, key, expires_at, negative, value):
+        with self._lock:
+            self._lru[key] = (expires_at, negative, value)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def _maybe_prune(self):
+        with self._lock:
+            self._writes += 1
+            due = self._writes % 500 == 0
+        if due:
+            self.prune()
+
+    def prune(self):
+        """Drop expired rows from the shared SQLite tier."""
+        try:
+            conn = self._conn()
+            conn.execute("DELETE FROM amap_cache WHERE expires_at <= ?", (time.time(),))
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"AMap cache prune failed: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+        conn = self._conn()
+        conn.execute("DELETE FROM amap_cache")
+        conn.commit()
+
+    def stats(self):
+        with self._lock:
+            endpoints = {endpoint: dict(counters) for endpoint, counters in self._counters.items()}
+            lru_entries = len(self._lru)
+        totals = {"lru_hits": 0, "disk_hits": 0, "misses": 0, "negative_hits": 0, "stores": 0, "negative_stores": 0}
+        for counters in endpoints.values():
+            for name, value in counters.items():
+                totals[name] += value
+        lookups = totals["lru_hits"] + totals["disk_hits"] + totals["misses"]
+        totals["hit_ratio"] = round((totals["lru_hits"] + totals["disk_hits"]) / lookups, 4) if lookups else 0.0
+        try:
+            disk_entries = self._conn().execute("SELECT COUNT(*) FROM amap_cache").fetchone()[0]
+        except sqlite3.Error:
+            disk_entries = None
+        return {
+            "path": self.path,
+            "lru_entries": lru_entries,
+            "lru_size": self.lru_size,
+            "disk_entries": disk_entries,
+            "totals": totals,
+            "endpoints": endpoints,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+_cache_pid = None
+
+
+def get_cache():
+    """Process-wide AmapCache (re-opened after fork), or None when disabled with AMAP_CACHE=0."""
+    global _cache, _cache_pid
+    if os.getenv("AMAP_CACHE", "1") == "0":
+        return None
+    pid = os.getpid()
+    if _cache is None or _cache_pid != pid:
+        with _cache_lock:
+            if _cache is None or _cache_pid != pid:
+                _cache = AmapCache()
+                _cache_pid = pid
+    return _cache
@@ -0,0 +1,396 @@
+import os
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import asyncio
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from tools.amap_cache import cache_key, get_cache
+from tools.rate_limiter import RETRYABLE_INFOCODES, current_priority, get_rate_limiter
+from tools.single_flight import SingleFlight
+
+try:
+    import httpx
+except ImportError:  # async path is optional; callers fall back to the sync client
+    httpx = None
+
+# (connect, read) timeouts in seconds, keyed by AMap endpoint path.
+# Interactive endpoints get tight budgets; routing/matrix calls are allowed longer reads.
+ENDPOINT_TIMEOUTS = {
+    "/v3/assistant/inputtips": (2.0, 3.0),
+    "/v3/geocode/geo": (2.0, 4.0),
+    "/v3/place/text": (2.0, 6.0),
+    "/v3/place/detail": (2.0, 6.0),
+    "/v3/staticmap": (2.0, 8.0),
+    "/v3/distance": (3.0, 8.0),
+    "/v3/direction/driving": (3.0, 10.0),
+    "/v3/direction/walking": (3.0, 10.0),
+    "/v3/direction/transit/integrated": (3.0, 12.0),
+    "/v4/direction/bicycling": (3.0, 10.0),
+}
+DEFAULT_TIMEOUT = (3.0, 10.0)
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Shared by the sync and async clients: identical in-flight JSON requests hit AMap once.
+_flights = SingleFlight()
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def endpoint_of(url):
+    """Return the path part of an AMap URL, e.g. '/v3/geocode/geo'."""
+    return urlparse(url).path.rstrip("/") or "/"
+
+
+def backoff_delay(attempt, base, cap):
+    """Full-jitter exponential backoff: uniform in [0, min(cap, base * 2^attempt)]."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class _ClientStats:
+    """Thread-safe per-endpoint counters shared by the sync and async clients."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._endpoints = {}
+
+    def _record(self, endpoint, key, value=1):
+        with self._lock:
+            counters = self._endpoints.setdefault(endpoint, {
+                "requests": 0, "retries": 0, "errors": 0, "timeouts": 0, "total_latency": 0.0,
+            })
+            counters[key] += value
+
+    def _enter(self):
+        with self._lock:
+            self._in_flight += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+
+    def _exit(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def _snapshot(self):
+        with self._lock:
+            endpoints = {}
+            for endpoint, counters in self._endpoints.items():
+                entry = dict(counters)
+                entry["avg_latency_ms"] = round(1000 * counters["total_latency"] / counters["requests"], 2) if counters["requests"] else 0.0
+                entry["total_latency"] = round(counters["total_latency"], 3)
+                endpoints[endpoint] = entry
+            return {
+                "in_flight": self._in_flight,
+                "peak_in_flight": self._peak_in_flight,
+                "endpoints": endpoints,
+            }
+
+
+class AmapClient(_ClientStats):
+    """
+    Shared keep-alive HTTP client for AMap REST calls.
+    One instance per process; connections to restapi.amap.com are pooled and reused.
+    """
+
+    def __init__(self, pool_connections=None, pool_maxsize=None, max_retries=None,
+                 backoff_base=None, backoff_cap=None):
+        super().__init__()
+        self.pool_connections = pool_connections or _env_int("AMAP_POOL_CONNECTIONS", 4)
+        self.pool_maxsize = pool_maxsize or _env_int("AMAP_POOL_MAXSIZE", 32)
+        self.max_retries = max_retries if max_retries is not None else _env_int("AMAP_MAX_RETRIES", 2)
+        self.backoff_base = backoff_base if backoff_base is not None else _env_float("AMAP_BACKOFF_BASE", 0.2)
+        self.backoff_cap = backoff_cap if backoff_cap is not None else _env_float("AMAP_BACKOFF_CAP", 2.0)
+
+        self._adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            max_retries=0,  # retries are handled here so they can be jittered and counted
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", self._adapter)
+        self.session.mount("http://", self._adapter)
+
+    def get(self, url, params=None, timeout=None, priority=None):
+        """
+        GET an AMap URL with pooled connections, per-endpoint timeouts and bounded retries.
+        Every attempt first takes a token from the shared rate limiter under `priority`.
+        Returns the final requests.Response; raises only when every attempt failed at transport level.
+        """
+        endpoint = endpoint_of(url)
+        timeout = timeout or ENDPOINT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT)
+        limiter = get_rate_limiter()
+        attempt = 0
+        self._enter()
+        try:
+            while True:
+                if limiter is not None:
+                    limiter.acquire(priority)
+                started = time.monotonic()
+                self._record(endpoint, "requests")
+                try:
+                    response = self.session.get(url, params=params, timeout=timeout)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    self._record(endpoint, "total_latency", time.monotonic() - started)
+                    self._record(endpoint, "timeouts" if isinstance(e, requests.Timeout) else "errors")
+                    if attempt >= self.max_retries:
+                        raise
+                else:
+                    self._record(endpoint, "total_latency", time.monotonic() - started)
+                    if response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                        return response
+                    self._record(endpoint, "errors")
+                    response.close()
+                self._record(endpoint, "retries")
+                time.sleep(backoff_delay(attempt, self.backoff_base, self.backoff_cap))
+                attempt += 1
+        finally:
+            self._exit()
+
+    def get_json(self, url, params=None, timeout=None, use_cache=True, priority=None):
+        """
+        GET and decode JSON, served from / stored into the AMap response cache.
+        Concurrent misses for the same request are collapsed into one upstream call.
+        Rate-limit infocodes slow the shared limiter down and QPS rejections are retried.
+        """
+        endpoint = endpoint_of(url)
+        priority = current_priority(priority)
+        cache = get_cache() if use_cache else None
+        if cache is not None:
+            cached = cache.get(endpoint, params)
+            if cached is not None:
+                return cached
+
+        def fetch():
+            limiter = get_rate_limiter()
+            attempt = 0
+            while True:
+                data = self.get(url, params=params, timeout=timeout, priority=priority).json()
+                throttled = limiter is not None and limiter.report(data)
+                if throttled and str(data.get("infocode")) in RETRYABLE_INFOCODES and attempt < self.max_retries:
+                    attempt += 1
+                    continue
+                if cache is not None:
+                    cache.set(endpoint, params, data)
+                return data
+
+        return _flights.do(cache_key(endpoint, params), fetch, label=endpoint)
+
+    def pool_stats(self):
+        """Connection pool occupancy per host, as seen by urllib3."""
+        pools = []
+        manager = self._adapter.poolmanager
+        try:
+            keys = list(manager.pools.keys())
+        except Exception:
+            keys = []
+        for key in keys:
+            try:
+                pool = manager.pools[key]
+            except KeyError:
+                continue
+            idle = sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool else 0
+            pools.append({
+                "host": pool.host,
+                "port": pool.port,
+                "connections_created": pool.num_connections,
+                "requests_served": pool.num_requests,
+                "idle_connections": idle,
+                "maxsize": pool.pool.maxsize if pool.pool else self.pool_maxsize,
+            })
+        return pools
+
+    def stats(self):
+        snapshot = self._snapshot()
+        snapshot["config"] = {
+            "pool_connections": self.pool_connections,
+            "pool_maxsize": self.pool_maxsize,
+            "max_retries": self.max_retries,
+            "backoff_base": self.backoff_base,
+            "backoff_cap": self.backoff_cap,
+        }
+        snapshot["pools"] = self.pool_stats()
+        return snapshot
+
+
+class AsyncAmapClient(_ClientStats):
+    """
+    Async counterpart of AmapClient built on httpx, for endpoints that run AMap lookups concurrently.
+    Same timeouts and retry policy; one instance per event loop.
+    """
+
+    def __init__(self, max_connections=None, max_keepalive=None, max_retries=None,
+                 backoff_base=None, backoff_cap=None):
+        if httpx is None:
+            raise RuntimeError("httpx is not installed; async AMap client unavailable")
+        super().__init__()
+        self.max_connections = max_connections or _env_int("AMAP_POOL_MAXSIZE", 32)
+        self.max_keepalive = max_keepalive or _env_int("AMAP_POOL_KEEPALIVE", 16)
+        self.max_retries = max_retries if max_retries is not None else _env_int("AMAP_MAX_RETRIES", 2)
+        self.backoff_base = backoff_base if backoff_base is not None else _env_float("AMAP_BACKOFF_BASE", 0.2)
+        self.backoff_cap = backoff_cap if backoff_cap is not None else _env_float("AMAP_BACKOFF_CAP", 2.0)
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.max_connections,
+                                max_keepalive_connections=self.max_keepalive),
+        )
+
+    @staticmethod
+    def _timeout(endpoint, timeout):
+        connect, read = timeout or ENDPOINT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT)
+        return httpx.Timeout(connect=connect, read=read, write=read, pool=connect)
+
+    async def get(self, url, params=None, timeout=None, priority=None):
+        """Async GET with the same timeout/retry/rate-limit semantics as AmapClient.get."""
+        endpoint = endpoint_of(url)
+        timeout = self._timeout(endpoint, timeout)
+        limiter = get_rate_limiter()
+        attempt = 0
+        self._enter()
+        try:
+            while True:
+                if limiter is not None:
+                    await limiter.acquire_async(priority)
+                started = time.monotonic()
+                self._record(endpoint, "requests")
+                try:
+                    response = await self.client.get(url, params=params, timeout=timeout)
+                except (httpx.TransportError, httpx.TimeoutException) as e:
+                    self._record(endpoint, "total_latency", time.monotonic() - started)
+                    self._record(endpoint, "timeouts" if isinstance(e, httpx.TimeoutException) else "errors")
+                    if attempt >= self.max_retries:
+                        raise
+                else:
+                    self._record(endpoint, "total_latency", time.monotonic() - started)
+                    if response.status_code not in RETRY_STATUS_CODES or attempt >= self.max_retries:
+                        return response
+                    self._record(endpoint, "errors")
+                    await response.aclose()
+                self._record(endpoint, "retries")
+                await asyncio.sleep(backoff_delay(attempt, self.backoff_base, self.backoff_cap))
+                attempt += 1
+        finally:
+            self._exit()
+
+    async def get_json(self, url, params=None, timeout=None, use_cache=True, priority=None):
+        endpoint = endpoint_of(url)
+        priority = current_priority(priority)
+        cache = get_cache() if use_cache else None
+        if cache is not None:
+            # SQLite reads and writes (up to the busy timeout) stay off the event loop
+            cached = await asyncio.to_thread(cache.get, endpoint, params)
+            if cached is not None:
+                return cached
+
+        async def fetch():
+            limiter = get_rate_limiter()
+            attempt = 0
+            while True:
+                response = await self.get(url, params=params, timeout=timeout, priority=priority)
+                data = response.json()
+                throttled = limiter is not None and await asyncio.to_thread(limiter.report, data)
+                if throttled and str(data.get("infocode")) in RETRYABLE_INFOCODES and attempt < self.max_retries:
+                    attempt += 1
+                    continue
+                if cache is not None:
+                    await asyncio.to_thread(cache.set, endpoint, params, data)
+                return data
+
+        return await _flights.do_async(cache_key(endpoint, params), fetch, label=endpoint)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    def stats(self):
+        snapshot = self._snapshot()
+        snapshot["config"] = {
+            "max_connections": self.max_connections,
+            "max_keepalive": self.max_keepalive,
+            "max_retries": self.max_retries,
+        }
+        return snapshot
+
+
+_client = None
+_client_lock = threading.Lock()
+_client_pid = None
+
+
+def get_client():
+    """Return the per-process shared AmapClient (re-created after fork)."""
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                _client = AmapClient()
+                _client_pid = pid
+    return _client
+
+
+def amap_get(url, params=None, timeout=None, priority=None):
+    return get_client().get(url, params=params, timeout=timeout, priority=priority)
+
+
+def amap_get_json(url, params=None, timeout=None, use_cache=True, priority=None):
+    return get_client().get_json(url, params=params, timeout=timeout, use_cache=use_cache, priority=priority)
+
+
+_async_client = None
+_async_loop = None
+
+
+def get_async_client():
+    """Return the AsyncAmapClient bound to the running event loop."""
+    global _async_client, _async_loop
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_loop is not loop:
+        _async_client = AsyncAmapClient()
+        _async_loop = loop
+    return _async_client
+
+
+async def amap_get_async(url, params=None, timeout=None, priority=None):
+    return await get_async_client().get(url, params=params, timeout=timeout, priority=priority)
+
+
+async def amap_get_json_async(url, params=None, timeout=None, use_cache=True, priority=None):
+    return await get_async_client().get_json(url, params=params, timeout=timeout, use_cache=use_cache, priority=priority)
+
+
+async def close_async_client():
+    global _async_client, _async_loop
+    if _async_client is not None:
+        await _async_client.aclose()
+    _async_client = None
+    _async_loop = None
+
+
+def amap_client_stats():
+    stats = get_client().stats()
+    if _async_client is not None:
+        stats["async"] = _async_client.stats()
+    cache = get_cache()
+    if cache is not None:
+        stats["cache"] = cache.stats()
+    stats["single_flight"] = _flights.stats()
+    limiter = get_rate_limiter()
+    if limiter is not None:
+        stats["rate_limiter"] = limiter.stats()
+    return stats
@@ -0,0 +1,203 @@
+import os
+import threading
+import time
+import numpy as np
+from tools.amap_cache import get_cache
+from tools.distance_matrix import get_distance_matrix_service, normalize_coord
+from tools.travel_times import get_travel_time_store
+
+EARTH_RADIUS_M = 6371000.0
+
+# Per mode: road distance / great-circle distance, average speed (km/h) along the road, fixed
+# overhead (s) per leg. Used until enough cached AMap answers exist to calibrate the mode.
+DEFAULT_PROFILES = {
+    "driving": {"factor": 1.35, "speed_kmh": 25.0, "overhead_s": 0.0},
+    "walking": {"factor": 1.25, "speed_kmh": 4.5, "overhead_s": 0.0},
+    "bicycling": {"factor": 1.3, "speed_kmh": 12.0, "overhead_s": 0.0},
+    # walking to / from stations and waiting
+    "transit": {"factor": 1.4, "speed_kmh": 20.0, "overhead_s": 480.0},
+    "straight": {"factor": 1.0, "speed_kmh": 25.0, "overhead_s": 0.0},
+}
+
+# Cached direction answers usable as calibration samples, per mode.
+DIRECTION_ENDPOINTS = {
+    "driving": "/v3/direction/driving",
+    "walking": "/v3/direction/walking",
+    "bicycling": "/v4/direction/bicycling",
+    "transit": "/v3/direction/transit/integrated",
+}
+
+# Legs shorter than this are dominated by geocoding noise and skipped when calibrating.
+MIN_SAMPLE_METERS = 300
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def coordinate_arrays(coords):
+    """("lon,lat", ...) -> (lng, lat) float arrays in degrees."""
+    values = np.array([[float(x) for x in str(c).split(",")] for c in coords], dtype=float).reshape(-1, 2)
+    return values[:, 0], values[:, 1]
+
+
+def haversine_matrix(lng, lat):
+    """N x N great-circle distances (m) between all points, in one vectorized pass."""
+    lng, lat = np.radians(lng), np.radians(lat)
+    dlat = lat[:, None] - lat[None, :]
+    dlng = lng[:, None] - lng[None, :]
+    h = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+def haversine_pairs(origins, destinations):
+    """Element-wise great-circle distances (m) for two equally long lists of "lon,lat" points."""
+    lng1, lat1 = (np.radians(a) for a in coordinate_arrays(origins))
+    lng2, lat2 = (np.radians(a) for a in coordinate_arrays(destinations))
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+def _direction_sample(data):
+    """(origin, destination, distance, duration) from a cached direction answer, or None."""
+    route = data.get("route") or data.get("data")
+    if not isinstance(route, dict):
+        return None
+    legs = route.get("transits") or route.get("paths")
+    try:
+        leg = legs[0]
+        return (
+            normalize_coord(route["origin"]), normalize_coord(route["destination"]),
+            float(leg["distance"]), float(leg["duration"]),
+        )
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+
+
+class DistanceEstimator:
+    """
+    Offline distance / duration estimates: great-circle distance corrected by per-mode road
+    factors and speeds. Each mode is calibrated from AMap answers already stored locally
+    (/v3/distance pairs, the travel time store and cached direction results) once enough
+    samples exist, and recalibrated periodically; until then DEFAULT_PROFILES apply.
+    """
+
+    def __init__(self, min_samples=None, refresh=None, sample_limit=None):
+        self.min_samples = min_samples or _env_int("ESTIMATOR_MIN_SAMPLES", 20)
+        self.refresh = refresh if refresh is not None else _env_int("ESTIMATOR_CALIBRATION_TTL", 3600)
+        self.sample_limit = sample_limit or _env_int("ESTIMATOR_SAMPLE_LIMIT", 2000)
+        self._lock = threading.Lock()
+        self._profiles = {}
+        self._counters = {"estimates": 0, "cells": 0, "calibrations": 0}
+
+    def _samples(self, mode):
+        rows = []
+        if mode in ("driving", "walking"):
+            rows.extend(get_distance_matrix_service().samples(mode, self.sample_limit))
+        store = get_travel_time_store()
+        if store is not None and mode in DIRECTION_ENDPOINTS:
+            rows.extend(store.samples(mode, self.sample_limit))
+        cache = get_cache()
+        if cache is not None and mode in DIRECTION_ENDPOINTS:
+            for data in cache.recent(DIRECTION_ENDPOINTS[mode], self.sample_limit):
+                sample = _direction_sample(data)
+                if sample:
+                    rows.append(sample)
+        return rows
+
+    def calibrate(self, mode):
+        """Fit the mode's profile to cached samples (medians, so odd routes do not skew it)."""
+        profile = dict(DEFAULT_PROFILES[mode], samples=0, calibrated=False, calibrated_at=time.time())
+        rows = self._samples(mode) if mode != "straight" else []
+        if rows:
+            origins, destinations, distance, duration = zip(*rows)
+            straight = haversine_pairs(origins, destinations)
+            distance = np.array(distance, dtype=float)
+            duration = np.array(duration, dtype=float)
+            usable = (straight >= MIN_SAMPLE_METERS) & (distance > 0) & (duration > profile["overhead_s"])
+            profile["samples"] = int(usable.sum())
+            if profile["samples"] >= self.min_samples:
+                road = distance[usable]
+                profile["factor"] = round(float(np.median(road / straight[usable])), 3)
+                speed = road / (duration[usable] - profile["overhead_s"]) * 3.6
+                profile["speed_kmh"] = round(float(np.median(speed)), 2)
+                profile["calibrated"] = True
+        with self._lock:
+            self._profiles[mode] = profile
+            self._counters["calibrations"] += 1
+        return profile
+
+    def profile(self, mode):
+        if mode not in DEFAULT_PROFILES:
+            raise ValueError(f"Unsupported distance mode '{mode}'")
+        with self._lock:
+            profile = self._profiles.get(mode)
+        if profile is None or time.time() - profile["calibrated_at"] > self.refresh:
+            profile = self.calibrate(mode)
+        return profile
+
+    def estimate(self, coords, mode="driving"):
+        """{"distance": N x N array (m), "duration": N x N array (s)} for "lon,lat" points."""
+        profile = self.profile(mode)
+        distance = haversine_matrix(*coordinate_arrays(coords)) * profile["factor"]
+        duration = distance / (profile["speed_kmh"] / 3.6) + profile["overhead_s"]
+        np.fill_diagonal(duration, 0.0)
+        with self._lock:
+            self._counters["estimates"] += 1
+            self._counters["cells"] += len(coords) * (len(coords) - 1)
+        return {"distance": distance, "duration": duration}
+
+    def stats(self):
+        with self._lock:
+            profiles = {
+                mode: {k: v for k, v in profile.items() if k != "calibrated_at"}
+                for mode, profile in self._profiles.items()
+            }
+            return dict(self._counters, profiles=profiles)
+
+
+def candidate_cells(distance, neighbours, tour=None):
+    """
+    Matrix cells worth an exact answer: each point's `neighbours` nearest points (both
+    directions) plus the legs of a tour pre-solved on the estimates. Optimal city tours are
+    almost entirely made of such short legs; the remaining cells can stay estimated.
+    """
+    n = len(distance)
+    k = min(neighbours, n - 1)
+    order = np.argsort(distance + np.diag(np.full(n, np.inf)), axis=1)[:, :k]
+    cells = set()
+    for i in range(n):
+        for j in order[i].tolist():
+            cells.add((i, j))
+            cells.add((j, i))
+    for i, j in zip(tour or [], (tour or [])[1:]):
+        if i != j:
+            cells.add((i, j))
+    return cells
+
+
+def fill_missing(matrix, estimate):
+    """Fill the cells DistanceMatrixService.build left as None with estimates; returns their count."""
+    for i, j in matrix["missing"]:
+        matrix["distance"][i][j] = int(round(estimate["distance"][i, j]))
+        matrix["duration"][i][j] = int(round(estimate["duration"][i, j]))
+    return len(matrix["missing"])
+
+
+_estimator = None
+_estimator_lock = threading.Lock()
+_estimator_pid = None
+
+
+def get_distance_estimator():
+    global _estimator, _estimator_pid
+    pid = os.getpid()
+    if _estimator is None or _estimator_pid != pid:
+        with _estimator_lock:
+            if _estimator is None or _estimator_pid != pid:
+                _estimator = DistanceEstimator()
+                _estimator_pid = pid
+    return _estimator
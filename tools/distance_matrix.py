@@ -0,0 +1,216 @@
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tools.amap_client import amap_get_json
+
+DISTANCE_URL = "https://restapi.amap.com/v3/distance"
+
+DAY = 24 * 3600
+
+# /v3/distance "type" per travel mode (0 is straight-line distance).
+MODE_TYPES = {"straight": "0", "driving": "1", "walking": "3"}
+
+# /v3/distance accepts up to 100 origins for a single destination.
+MAX_ORIGINS = 100
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def normalize_coord(coord):
+    """"lon,lat" rounded to 6 decimals (~0.1 m), so equal points share cache entries."""
+    lng, lat = (float(x) for x in str(coord).split(","))
+    return f"{lng:.6f},{lat:.6f}"
+
+
+class DistanceMatrixService:
+    """
+    N x N road distance / duration matrices from AMap's /v3/distance endpoint.
+
+    Each (origin, destination, mode) pair is cached in a SQLite file shared by all workers, so
+    only the cells missing from the cache are requested: one request per destination column
+    with just the origins that column still needs, columns fetched concurrently. Requests go
+    through the shared AMap client, so they are rate limited with the caller's priority.
+    """
+
+    def __init__(self, path=None, ttl=None, concurrency=None):
+        self.path = path or os.getenv(
+            "DISTANCE_CACHE_PATH", os.path.join("/tmp", "travelai_cache", "distance_pairs.sqlite3")
+        )
+        self.ttl = ttl if ttl is not None else _env_int("DISTANCE_CACHE_TTL", 7 * DAY)
+        self.concurrency = concurrency or _env_int("DISTANCE_CONCURRENCY", 4)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._counters = {"cells": 0, "cached": 0, "fetched": 0, "failed": 0, "requests": 0}
+        self._init_db()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS pairs (origin TEXT, destination TEXT, mode TEXT, distance INTEGER, duration INTEGER, "
+            "expires_at REAL, PRIMARY KEY (origin, destination, mode))"
+        )
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    def cached_pairs(self, points, mode):
+        """{(origin, destination): (distance m, duration s)} for the cached pairs among points."""
+        try:
+            rows = self._conn().execute(
+                f"SELECT origin, destination, distance, duration FROM pairs WHERE mode = ? "
+                f"AND origin IN ({','.join('?' * len(points))}) AND destination IN ({','.join('?' * len(points))}) "
+                "AND expires_at > ?",
+                [mode, *points, *points, time.time()],
+            ).fetchall()
+        except sqlite3.Error as e:
+            print(f"Distance cache read failed: {e}")
+            return {}
+        return {(o, d): (distance, duration) for o, d, distance, duration in rows}
+
+    def samples(self, mode, limit=2000):
+        """Recent cached (origin, destination, distance m, duration s) rows for a mode."""
+        try:
+            return self._conn().execute(
+                "SELECT origin, destination, distance, duration FROM pairs WHERE mode = ? AND expires_at > ? "
+                "ORDER BY expires_at DESC LIMIT ?",
+                (mode, time.time(), limit),
+            ).fetchall()
+        except sqlite3.Error as e:
+            print(f"Distance cache read failed: {e}")
+            return []
+
+    def store_pairs(self, pairs, mode):
+        expires_at = time.time() + self.ttl
+        try:
+            self._conn().executemany(
+                "INSERT OR REPLACE INTO pairs (origin, destination, mode, distance, duration, expires_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(o, d, mode, distance, duration, expires_at) for (o, d), (distance, duration) in pairs.items()],
+            )
+        except sqlite3.Error as e:
+            print(f"Distance cache write failed: {e}")
+
+    def _fetch_column(self, api_key, origins, destination, mode, priority):
+        """{(origin, destination): (distance, duration)} for one destination; {} on failure."""
+        pairs = {}
+        for start in range(0, len(origins), MAX_ORIGINS):
+            chunk = origins[start:start + MAX_ORIGINS]
+            params = {"key": api_key, "origins": "|".join(chunk), "destination": destination, "type": MODE_TYPES[mode]}
+            self._count("requests")
+            try:
+                # Pairs are cached here; whole-column responses would only duplicate them
+                data = amap_get_json(DISTANCE_URL, params, use_cache=False, priority=priority)
+            except Exception as e:
+                print(f"Error fetching distance column {destination}: {e}")
+                return pairs
+            if data.get("status") != "1" or "results" not in data:
+                print(f"Error fetching distance column {destination}: {data.get('info')}")
+                return pairs
+            for position, result in enumerate(data["results"]):
+                try:
+                    # origin_id is the 1-based position in "origins"
+                    index = int(result.get("origin_id") or position + 1) - 1
+                    pairs[(chunk[index], destination)] = (int(result["distance"]), int(result.get("duration") or 0))
+                except (KeyError, ValueError, IndexError):
+                    continue
+        return pairs
+
+    def build(self, coords, mode="driving", priority="agent", cells=None):
+        """
+        Matrices for a list of "lon,lat" points: {"distance": [[m]], "duration": [[s]], "missing": [(i, j)]}.
+        Cells AMap could not answer are None and listed in "missing". With `cells` (a set of
+        (i, j) indexes) only those cells are requested; other cells are filled from the cache
+        when possible and reported missing otherwise.
+        """
+        if mode not in MODE_TYPES:
+            raise ValueError(f"Unsupported distance mode '{mode}'")
+        points = [normalize_coord(c) for c in coords]
+        unique = list(dict.fromkeys(points))
+        n = len(points)
+        pairs = self.cached_pairs(unique, mode) if len(unique) > 1 else {}
+
+        if cells is None:
+            wanted = {(o, d) for o in unique for d in unique if o != d}
+        else:
+            wanted = {(points[i], points[j]) for i, j in cells if points[i] != points[j]}
+        # Destination -> origins still needed for that column
+        needed = {}
+        for origin, destination in wanted:
+            if (origin, destination) not in pairs:
+                needed.setdefault(destination, []).append(origin)
+        missing_cells = sum(len(o) for o in needed.values())
+        self._count("cells", len(wanted))
+        self._count("cached", len(wanted) - missing_cells)
+
+        api_key = os.getenv("AMAP_KEY")
+        if needed and api_key:
+            with ThreadPoolExecutor(max_workers=min(self.concurrency, len(needed))) as pool:
+                columns = list(pool.map(
+                    lambda item: self._fetch_column(api_key, item[1], item[0], mode, priority), needed.items()
+                ))
+            fetched = {}
+            for column in columns:
+                fetched.update(column)
+            self.store_pairs(fetched, mode)
+            pairs.update(fetched)
+            self._count("fetched", len(fetched))
+            self._count("failed", missing_cells - len(fetched))
+
+        distance = [[0] * n for _ in range(n)]
+        duration = [[0] * n for _ in range(n)]
+        missing = []
+        for i, origin in enumerate(points):
+            for j, destination in enumerate(points):
+                if origin == destination:
+                    continue
+                pair = pairs.get((origin, destination))
+                if pair is None:
+                    distance[i][j] = duration[i][j] = None
+                    missing.append((i, j))
+                else:
+                    distance[i][j], duration[i][j] = pair
+        return {"distance": distance, "duration": duration, "missing": missing}
+
+    def stats(self):
+        try:
+            entries = self._conn().execute("SELECT COUNT(*) FROM pairs WHERE expires_at > ?", (time.time(),)).fetchone()[0]
+        except sqlite3.Error:
+            entries = None
+        with self._lock:
+            return dict(self._counters, entries=entries)
+
+
+_service = None
+_service_lock = threading.Lock()
+_service_pid = None
+
+
+def get_distance_matrix_service():
+    global _service, _service_pid
+    pid = os.getpid()
+    if _service is None or _service_pid != pid:
+        with _service_lock:
+            if _service is None or _service_pid != pid:
+                _service = DistanceMatrixService()
+                _service_pid = pid
+    return _service
+
+
+def build_distance_matrix(coords, mode="driving", priority="agent", cells=None):
+    """Shared entry point for agent tools and server code; see DistanceMatrixService.build."""
+    return get_distance_matrix_service().build(coords, mode=mode, priority=priority, cells=cells)
@@ -0,0 +1,224 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from tools.amap_client import amap_get_json
+
+GEOCODE_URL = "https://restapi.amap.com/v3/geocode/geo"
+
+DAY = 24 * 3600
+
+# AMap batch geocoding accepts at most 10 "|"-separated addresses per request.
+MAX_BATCH_SIZE = 10
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def normalize_name(name):
+    # "|" separates addresses in batch mode
+    return " ".join(str(name or "").replace("|", " ").split())
+
+
+# Match levels AMap falls back to when a name is not in the requested city: the area's centroid.
+AREA_LEVELS = {"国家", "省", "市", "区县"}
+
+
+def _location(geocode, scoped=False):
+    if not isinstance(geocode, dict) or (scoped and geocode.get("level") in AREA_LEVELS):
+        return None
+    location = geocode.get("location")
+    # AMap uses [] for missing string fields
+    return location if isinstance(location, str) and "," in location else None
+
+
+class Geocoder:
+    """
+    Name -> "lon,lat" resolution for the map tools: a persistent cache scoped by city (SQLite
+    file shared by all workers, plus a bounded in-process LRU memo) in front of AMap batch geocoding.
+    Misses are grouped into batch requests of up to MAX_BATCH_SIZE names, fanned out
+    concurrently; names AMap cannot place are remembered as negative entries for a shorter time.
+    """
+
+    def __init__(self, path=None, ttl=None, negative_ttl=None, batch_size=None, concurrency=None, memo_size=None):
+        self.path = path or os.getenv(
+            "GEOCODE_CACHE_PATH", os.path.join("/tmp", "travelai_cache", "geocode_cache.sqlite3")
+        )
+        self.ttl = ttl if ttl is not None else _env_int("GEOCODE_TTL", 90 * DAY)
+        self.negative_ttl = negative_ttl if negative_ttl is not None else _env_int("GEOCODE_NEGATIVE_TTL", DAY)
+        self.batch_size = min(MAX_BATCH_SIZE, batch_size or _env_int("GEOCODE_BATCH_SIZE", MAX_BATCH_SIZE))
+        self.concurrency = concurrency or _env_int("GEOCODE_CONCURRENCY", 4)
+        self.memo_size = memo_size or _env_int("GEOCODE_MEMO_SIZE", 4096)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # (city, name) -> (location, expires_at), least recently used first
+        self._memo = OrderedDict()
+        self._counters = {"memo_hits": 0, "disk_hits": 0, "misses": 0, "requests": 0, "resolved": 0, "not_found": 0}
+        self._init_db()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS geocodes (city TEXT, name TEXT, location TEXT, expires_at REAL, created_at REAL, "
+            "PRIMARY KEY (city, name))"
+        )
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    def _remember(self, city, name, location, expires_at):
+        # Caller holds self._lock
+        self._memo[(city, name)] = (location, expires_at)
+        self._memo.move_to_end((city, name))
+        while len(self._memo) > self.memo_size:
+            self._memo.popitem(last=False)
+
+    def _lookup(self, city, names):
+        """Cached entries for names: {name: location or None (negative)}; absent names are misses."""
+        now = time.time()
+        found = {}
+        with self._lock:
+            for name in names:
+                entry = self._memo.get((city, name))
+                if entry is not None and entry[1] > now:
+                    found[name] = entry[0]
+                    self._memo.move_to_end((city, name))
+        self._count("memo_hits", len(found))
+        rest = [name for name in names if name not in found]
+        if rest:
+            try:
+                rows = self._conn().execute(
+                    f"SELECT name, location, expires_at FROM geocodes WHERE city = ? AND name IN ({','.join('?' * len(rest))}) "
+                    "AND expires_at > ?",
+                    [city, *rest, now],
+                ).fetchall()
+            except sqlite3.Error as e:
+                print(f"Geocode cache read failed: {e}")
+                rows = []
+            with self._lock:
+                for name, location, expires_at in rows:
+                    found[name] = location
+                    self._remember(city, name, location, expires_at)
+            self._count("disk_hits", len(rows))
+        return found
+
+    def _store(self, city, results):
+        now = time.time()
+        rows = []
+        with self._lock:
+            for name, location in results.items():
+                expires_at = now + (self.ttl if location else self.negative_ttl)
+                self._remember(city, name, location, expires_at)
+                rows.append((city, name, location, expires_at, now))
+        try:
+            self._conn().executemany(
+                "INSERT OR REPLACE INTO geocodes (city, name, location, expires_at, created_at) VALUES (?, ?, ?, ?, ?)", rows
+            )
+        except sqlite3.Error as e:
+            print(f"Geocode cache write failed: {e}")
+
+    def _fetch_batch(self, api_key, city, names):
+        """One AMap batch request; {name: location or None}, or {} when the request itself failed."""
+        params = {"key": api_key, "address": "|".join(names), "batch": "true" if len(names) > 1 else "false"}
+        if city:
+            params["city"] = city
+        self._count("requests")
+        try:
+            # Results are cached per name here; caching whole batch responses would only duplicate them
+            data = amap_get_json(GEOCODE_URL, params, use_cache=False, priority="agent")
+        except Exception as e:
+            print(f"Error geocoding {', '.join(names)}: {e}")
+            return {}
+        if data.get("status") != "1":
+            print(f"Error geocoding {', '.join(names)}: {data.get('info')}")
+            return {}
+        geocodes = data.get("geocodes") or []
+        # A city-scoped area-level match is a miss there; the nationwide lookup gets to place the name
+        scoped = bool(city)
+        if len(names) == 1:
+            return {names[0]: _location(geocodes[0], scoped) if geocodes else None}
+        if len(geocodes) != len(names):
+            # Results cannot be matched back to names; leave them uncached
+            return {}
+        return {name: _location(geocode, scoped) for name, geocode in zip(names, geocodes)}
+
+    def geocode_many(self, names, city=None):
+        """
+        {name: "lon,lat" or None} for every given name (resolved in as few AMap requests as possible).
+        Names the city-scoped lookup cannot place are looked up nationwide, so a stop outside
+        `city` (the map tools default it) is still found.
+        """
+        city = normalize_name(city)
+        keys = {name: normalize_name(name) for name in names}
+        unique = [name for name in dict.fromkeys(keys.values()) if name]
+        found = self._resolve(city, unique)
+        if city:
+            outside = [name for name in unique if not found.get(name)]
+            if outside:
+                found.update({name: location for name, location in self._resolve("", outside).items() if location})
+        return {name: found.get(key) for name, key in keys.items()}
+
+    def _resolve(self, city, unique):
+        """{name: location or None} for normalized names within one city scope ("" = nationwide)."""
+        found = self._lookup(city, unique)
+        missing = [name for name in unique if name not in found]
+        self._count("misses", len(missing))
+
+        api_key = os.getenv("AMAP_KEY")
+        if missing and api_key:
+            batches = [missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size)]
+            if len(batches) == 1:
+                fetched = [self._fetch_batch(api_key, city, batches[0])]
+            else:
+                with ThreadPoolExecutor(max_workers=min(self.concurrency, len(batches))) as pool:
+                    fetched = list(pool.map(lambda batch: self._fetch_batch(api_key, city, batch), batches))
+            for results in fetched:
+                if results:
+                    self._store(city, results)
+                    found.update(results)
+                    resolved = sum(1 for location in results.values() if location)
+                    self._count("resolved", resolved)
+                    self._count("not_found", len(results) - resolved)
+        return found
+
+    def geocode(self, name, city=None):
+        return self.geocode_many([name], city).get(name)
+
+    def stats(self):
+        try:
+            entries = self._conn().execute("SELECT COUNT(*) FROM geocodes WHERE expires_at > ?", (time.time(),)).fetchone()[0]
+        except sqlite3.Error:
+            entries = None
+        with self._lock:
+            return dict(self._counters, entries=entries, memo_entries=len(self._memo))
+
+
+_geocoder = None
+_geocoder_lock = threading.Lock()
+_geocoder_pid = None
+
+
+def get_geocoder():
+    global _geocoder, _geocoder_pid
+    pid = os.getpid()
+    if _geocoder is None or _geocoder_pid != pid:
+        with _geocoder_lock:
+            if _geocoder is None or _geocoder_pid != pid:
+                _geocoder = Geocoder()
+                _geocoder_pid = pid
+    return _geocoder
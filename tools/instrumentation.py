@@ -0,0 +1,368 @@
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from tools.llm_events import LLMListener, flush_llm_events
+
+SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+STAGE_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1200)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+# Exported histograms: name -> (help text, bucket upper bounds)
+HISTOGRAMS = {
+    "travelai_crew_stage_seconds": ("Wall time of an itinerary stage (preplanning, research, clustering, planning, parse).", STAGE_BUCKETS),
+    "travelai_llm_call_seconds": ("Wall time of one LLM completion.", SECONDS_BUCKETS),
+    "travelai_llm_prompt_tokens": ("Prompt tokens of one LLM completion.", TOKEN_BUCKETS),
+    "travelai_llm_completion_tokens": ("Completion tokens of one LLM completion.", TOKEN_BUCKETS),
+    "travelai_tool_call_seconds": ("Wall time of one agent tool call.", SECONDS_BUCKETS),
+}
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2)
+
+
+def _token_usage(usage):
+    """(prompt, completion) tokens of a CrewAI LLMCallCompletedEvent's usage dict."""
+    usage = usage or {}
+    return usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0
+
+
+def _empty_totals():
+    return {"calls": 0, "ms": 0.0, "max_ms": 0.0}
+
+
+def _add(totals, ms):
+    totals["calls"] += 1
+    totals["ms"] = round(totals["ms"] + ms, 2)
+    totals["max_ms"] = max(totals["max_ms"], ms)
+
+
+class CrewInstrumentation:
+    """
+    Per-run breakdown of where an itinerary's time goes: each stage (task) with its agent,
+    the LLM calls (wall time, prompt/completion tokens) and tool calls made while it ran.
+
+    LLM calls are seen through llm_listener (CrewAI's LLM call events, set as a listener on
+    the run's LLM); events arrive on the event bus's threads, so stage changes first wait
+    for the ones already emitted, and call times come from the events' timestamps. Tool
+    calls through the instrumented_tool decorator on MapTools, which reports to the
+    instrumentation activated in this process. Samples are flushed to the shared
+    MetricsStore for the Prometheus histograms when the run ends.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.stage_name = None
+        self.agent = None
+        self._stage_started = None
+        self._pending = []
+        self._llm_calls = {}
+        self.stages = {}
+        self.tools = {}
+        self.samples = []
+        self.llm_listener = _LLMTimingListener(self)
+
+    def _stage(self, name=None):
+        name = name or self.stage_name or "other"
+        return self.stages.setdefault(name, {
+            "agent": None, "wall_ms": 0.0,
+            "llm_calls": 0, "llm_ms": 0.0, "prompt_tokens": 0, "completion_tokens": 0,
+            "tool_calls": 0, "tool_ms": 0.0, "tool_errors": 0,
+        })
+
+    def begin(self, name, agent=None):
+        self.end()
+        with self._lock:
+            self.stage_name = name
+            self.agent = agent
+            self._stage(name)["agent"] = agent
+            self._stage_started = time.perf_counter()
+
+    def end(self):
+        # LLM calls of the stage that is ending are attributed to it
+        flush_llm_events()
+        with self._lock:
+            if self.stage_name is None:
+                return
+            elapsed = time.perf_counter() - self._stage_started
+            stage = self._stage()
+            stage["wall_ms"] = round(stage["wall_ms"] + _ms(elapsed), 2)
+            self.samples.append(("travelai_crew_stage_seconds", {"stage": self.stage_name}, elapsed))
+            self.stage_name = self.agent = None
+
+    @contextmanager
+    def stage(self, name, agent=None):
+        self.begin(name, agent)
+        try:
+            yield
+        finally:
+            self.end()
+
+    def crew_stages(self, stages, task_callback=None):
+        """
+        CrewAI task_callback for a crew running (task, agent) stages in order: each finished
+        task moves on to the next stage, then calls task_callback. The caller begins the
+        first stage when the crew is kicked off.
+        """
+        self._pending = list(stages[1:])
+
+        def on_task(task_output):
+            if self._pending:
+                self.begin(*self._pending.pop(0))
+            else:
+                self.end()
+            if task_callback:
+                task_callback(task_output)
+        return on_task
+
+    def llm_started(self, call_id, at):
+        self._llm_event(call_id, started=at)
+
+    def llm_finished(self, call_id, at, prompt_tokens=0, completion_tokens=0):
+        self._llm_event(call_id, finished=at, tokens=(prompt_tokens, completion_tokens))
+
+    def _llm_event(self, call_id, **fields):
+        with self._lock:
+            # The bus may deliver a call's completion before its start
+            call = self._llm_calls.setdefault(call_id, {})
+            call.update(fields)
+            if "started" not in call or "finished" not in call:
+                return
+            del self._llm_calls[call_id]
+            elapsed = max(0.0, (call["finished"] - call["started"]).total_seconds())
+            prompt_tokens, completion_tokens = call["tokens"]
+            labels = {"stage": self.stage_name or "other", "agent": self.agent or "unknown"}
+            stage = self._stage()
+            stage["llm_calls"] += 1
+            stage["llm_ms"] = round(stage["llm_ms"] + _ms(elapsed), 2)
+            stage["prompt_tokens"] += prompt_tokens
+            stage["completion_tokens"] += completion_tokens
+            self.samples.append(("travelai_llm_call_seconds", labels, elapsed))
+            if prompt_tokens or completion_tokens:
+                self.samples.append(("travelai_llm_prompt_tokens", labels, prompt_tokens))
+                self.samples.append(("travelai_llm_completion_tokens", labels, completion_tokens))
+
+    def record_tool(self, name, elapsed, error=False):
+        with self._lock:
+            ms = _ms(elapsed)
+            stage = self._stage()
+            stage["tool_calls"] += 1
+            stage["tool_ms"] = round(stage["tool_ms"] + ms, 2)
+            stage["tool_errors"] += int(error)
+            totals = self.tools.setdefault(name, dict(_empty_totals(), errors=0))
+            _add(totals, ms)
+            totals["errors"] += int(error)
+            self.samples.append((
+                "travelai_tool_call_seconds",
+                {"tool": name, "stage": self.stage_name or "other", "outcome": "error" if error else "ok"},
+                elapsed,
+            ))
+
+    def summary(self):
+        """Timing breakdown for the job's progress: per stage, per tool and overall LLM totals."""
+        flush_llm_events()
+        with self._lock:
+            stages = {name: dict(stage) for name, stage in self.stages.items()}
+            for stage in stages.values():
+                # Time in the stage spent neither waiting on the LLM nor in tools (agent framework, parsing...)
+                stage["other_ms"] = round(max(0.0, stage["wall_ms"] - stage["llm_ms"] - stage["tool_ms"]), 2)
+            return {
+                "total_ms": _ms(time.perf_counter() - self.started),
+                "stages": stages,
+                "tools": {name: dict(totals) for name, totals in self.tools.items()},
+                "llm": {
+                    "calls": sum(s["llm_calls"] for s in stages.values()),
+                    "ms": round(sum(s["llm_ms"] for s in stages.values()), 2),
+                    "prompt_tokens": sum(s["prompt_tokens"] for s in stages.values()),
+                    "completion_tokens": sum(s["completion_tokens"] for s in stages.values()),
+                },
+            }
+
+    def flush(self):
+        """Write this run's samples into the shared histograms."""
+        with self._lock:
+            samples, self.samples = self.samples, []
+        store = get_metrics_store()
+        if store is None or not samples:
+            return
+        try:
+            store.observe_many(samples)
+        except sqlite3.Error as e:
+            print(f"Crew metrics write failed: {e}")
+
+
+class _LLMTimingListener(LLMListener):
+    """LLM listener feeding call wall time and token usage into a CrewInstrumentation."""
+
+    def __init__(self, instrumentation):
+        self.instrumentation = instrumentation
+
+    def on_call_started(self, event):
+        self.instrumentation.llm_started(event.call_id, event.timestamp)
+
+    def on_call_completed(self, event):
+        self.instrumentation.llm_finished(event.call_id, event.timestamp, *_token_usage(event.usage))
+
+    def on_call_failed(self, event):
+        self.instrumentation.llm_finished(event.call_id, event.timestamp)
+
+
+def server_timing(breakdown):
+    """Server-Timing header value for a summary() breakdown (stages, then LLM and tool totals)."""
+    entries = [f"{name};dur={stage['wall_ms']}" for name, stage in breakdown.get("stages", {}).items()]
+    entries.append(f"llm;dur={breakdown['llm']['ms']}")
+    entries.append(f"tools;dur={round(sum(t['ms'] for t in breakdown.get('tools', {}).values()), 2)}")
+    return ", ".join(entries)
+
+
+# Crew runs are one per worker process, so the active instrumentation is process-wide:
+# tool calls made from CrewAI's executor threads still find it.
+_active = None
+
+
+@contextmanager
+def activate(instrumentation):
+    global _active
+    previous, _active = _active, instrumentation
+    try:
+        yield instrumentation
+    finally:
+        instrumentation.end()
+        _active = previous
+
+
+def instrumented_tool(name):
+    """Decorator (under @tool) reporting a tool function's wall time to the active instrumentation."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            instrumentation = _active
+            if instrumentation is None:
+                return fn(*args, **kwargs)
+            started = time.perf_counter()
+            error = True
+            try:
+                result = fn(*args, **kwargs)
+                # MapTools report failures as "Error: ..." strings rather than raising
+                error = isinstance(result, str) and result.startswith("Error")
+                return result
+            finally:
+                instrumentation.record_tool(name, time.perf_counter() - started, error)
+        return wrapper
+    return decorate
+
+
+class MetricsStore:
+    """
+    Cumulative histograms in SQLite, shared by the crew worker processes (which observe)
+    and the server (which renders them in the Prometheus text format).
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv(
+            "CREW_METRICS_PATH", os.path.join("/tmp", "travelai_cache", "crew_metrics.sqlite3")
+        )
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._local = threading.local()
+        self._init_db()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS histograms (metric TEXT, labels TEXT, buckets TEXT, sum REAL, count INTEGER, "
+            "PRIMARY KEY (metric, labels))"
+        )
+
+    def observe_many(self, samples):
+        """Add (metric, labels dict, value) samples in one transaction."""
+        grouped = {}
+        for metric, labels, value in samples:
+            bounds = HISTOGRAMS[metric][1]
+            key = (metric, json.dumps(labels, sort_keys=True, ensure_ascii=False))
+            entry = grouped.setdefault(key, {"buckets": [0] * len(bounds), "sum": 0.0, "count": 0})
+            for i, bound in enumerate(bounds):
+                if value <= bound:
+                    entry["buckets"][i] += 1
+                    break
+            entry["sum"] += value
+            entry["count"] += 1
+
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for (metric, labels), entry in grouped.items():
+                row = conn.execute(
+                    "SELECT buckets, sum, count FROM histograms WHERE metric = ? AND labels = ?", (metric, labels)
+                ).fetchone()
+                if row is not None:
+                    entry["buckets"] = [a + b for a, b in zip(json.loads(row[0]), entry["buckets"])]
+                    entry["sum"] += row[1]
+                    entry["count"] += row[2]
+                conn.execute(
+                    "INSERT OR REPLACE INTO histograms (metric, labels, buckets, sum, count) VALUES (?, ?, ?, ?, ?)",
+                    (metric, labels, json.dumps(entry["buckets"]), entry["sum"], entry["count"]),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def render_prometheus(self):
+        """All histograms in the Prometheus text exposition format (version 0.0.4)."""
+        rows = self._conn().execute(
+            "SELECT metric, labels, buckets, sum, count FROM histograms ORDER BY metric, labels"
+        ).fetchall()
+        by_metric = {}
+        for metric, labels, buckets, total, count in rows:
+            by_metric.setdefault(metric, []).append((json.loads(labels), json.loads(buckets), total, count))
+
+        lines = []
+        for metric, (help_text, bounds) in HISTOGRAMS.items():
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} histogram")
+            for labels, buckets, total, count in by_metric.get(metric, []):
+                label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items()))
+                prefix = label_text + "," if label_text else ""
+                cumulative = 0
+                for bound, n in zip(bounds, buckets):
+                    cumulative += n
+                    lines.append(f'{metric}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{{prefix}le="+Inf"}} {count}')
+                lines.append(f"{metric}_sum{{{label_text}}} {total}")
+                lines.append(f"{metric}_count{{{label_text}}} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+_store = None
+_store_lock = threading.Lock()
+_store_pid = None
+
+
+def get_metrics_store():
+    """Process-wide metrics store, or None if CREW_METRICS=0."""
+    global _store, _store_pid
+    if os.getenv("CREW_METRICS", "1") == "0":
+        return None
+    pid = os.getpid()
+    if _store is None or _store_pid != pid:
+        with _store_lock:
+            if _store is None or _store_pid != pid:
+                _store = MetricsStore()
+                _store_pid = pid
+    return _store
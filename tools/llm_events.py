@@ -0,0 +1,51 @@
+from crewai.events.event_bus import crewai_event_bus
+from crewai.events.types.llm_events import (
+    LLMCallCompletedEvent,
+    LLMCallFailedEvent,
+    LLMCallStartedEvent,
+    LLMStreamChunkEvent,
+)
+
+
+class LLMListener:
+    """
+    Observer of the LLM calls one run makes, fed from CrewAI's event bus. Listeners are set on
+    the run's own LLM instance (agents.with_listeners), so concurrent runs in a process only
+    see their own calls. Override the hooks you need; each gets the CrewAI event.
+
+    Stream chunks are delivered synchronously and in order; the other events come from the
+    bus's handler threads, so use the event's timestamp rather than the time they arrive.
+    """
+
+    def on_call_started(self, event):
+        pass
+
+    def on_call_completed(self, event):
+        pass
+
+    def on_call_failed(self, event):
+        pass
+
+    def on_stream_chunk(self, event):
+        pass
+
+
+def _dispatch(hook):
+    def handler(source, event):
+        for listener in getattr(source, "listeners", None) or ():
+            try:
+                getattr(listener, hook)(event)
+            except Exception as e:
+                print(f"LLM listener {type(listener).__name__}.{hook} failed: {e}")
+    return handler
+
+
+crewai_event_bus.on(LLMCallStartedEvent)(_dispatch("on_call_started"))
+crewai_event_bus.on(LLMCallCompletedEvent)(_dispatch("on_call_completed"))
+crewai_event_bus.on(LLMCallFailedEvent)(_dispatch("on_call_failed"))
+crewai_event_bus.on(LLMStreamChunkEvent)(_dispatch("on_stream_chunk"))
+
+
+def flush_llm_events(timeout=5.0):
+    """Wait until the bus has delivered the events emitted so far (e.g. before reading totals)."""
+    crewai_event_bus.flush(timeout)
@@ -0,0 +1,231 @@
+import bisect
+import csv
+import os
+import re
+
+RULES_FILE = os.path.join(os.path.dirname(__file__), "data", "poi_rules.csv")
+
+RULE_KINDS = {"tag", "entrance", "gate", "gate_type", "bracket_open", "bracket_close"}
+FIELDS = ("name", "type")
+
+# Joins a page of strings for a single scan; never part of a pattern or of AMap names/types.
+SEPARATOR = "\n"
+
+
+def load_rules(path=RULES_FILE):
+    """Read (kind, field, pattern, value) rows from the rules table."""
+    rules = []
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        for row in csv.DictReader(f):
+            kind = row["kind"].strip()
+            field = row["field"].strip()
+            pattern = row["pattern"]
+            if kind not in RULE_KINDS:
+                raise ValueError(f"Unknown rule kind '{kind}' in {path}")
+            if field not in FIELDS:
+                raise ValueError(f"Unknown rule field '{field}' in {path}")
+            if not pattern or SEPARATOR in pattern:
+                raise ValueError(f"Invalid pattern {pattern!r} in {path}")
+            rules.append((kind, field, pattern, (row.get("value") or "").strip()))
+    return rules
+
+
+def _has_partial_overlap(patterns):
+    """True if a proper suffix of one pattern is a proper prefix of another."""
+    for p in patterns:
+        for q in patterns:
+            for k in range(1, min(len(p), len(q))):
+                if p[-k:] == q[:k]:
+                    return True
+    return False
+
+
+class _FieldMatcher:
+    """
+    One compiled multi-pattern scanner per field.
+
+    Without partial overlaps between patterns, a plain leftmost-longest alternation finds
+    every occurrence: anything hidden inside a reported match is recovered from `inner`,
+    the precomputed (offset, pattern) list of patterns contained in it. If some pattern's
+    suffix is another's prefix, the alternation is wrapped in a lookahead instead, which
+    reports a match at every position; shorter patterns sharing that start come from `inner`.
+    """
+
+    def __init__(self, patterns):
+        ordered = sorted(set(patterns), key=lambda p: (-len(p), p))
+        self.overlapping = _has_partial_overlap(ordered)
+        alternation = "|".join(re.escape(p) for p in ordered)
+        if not ordered:
+            self.regex = None
+        elif self.overlapping:
+            self.regex = re.compile("(?=(" + alternation + "))")
+        else:
+            self.regex = re.compile("(" + alternation + ")")
+        self.inner = {}
+        for p in ordered:
+            if self.overlapping:
+                self.inner[p] = tuple((0, q) for q in ordered if p.startswith(q))
+            else:
+                self.inner[p] = tuple(
+                    (k, q) for q in ordered for k in range(len(p) - len(q) + 1) if p.startswith(q, k)
+                )
+
+    def scan_one(self, text):
+        """List of (start, end, pattern) for every pattern occurrence in text."""
+        if self.regex is None:
+            return []
+        found = []
+        for match in self.regex.finditer(text):
+            pos = match.start()
+            for k, pattern in self.inner[match.group(1)]:
+                found.append((pos + k, pos + k + len(pattern), pattern))
+        return found
+
+    def scan(self, texts):
+        """Yield (text index, start, end, pattern) for every occurrence in a batch, in one regex pass."""
+        if self.regex is None or not texts:
+            return
+        starts = []
+        offset = 0
+        for text in texts:
+            starts.append(offset)
+            offset += len(text) + len(SEPARATOR)
+        joined = SEPARATOR.join(texts)
+        for match in self.regex.finditer(joined):
+            pos = match.start()
+            index = bisect.bisect_right(starts, pos) - 1
+            local = pos - starts[index]
+            for k, pattern in self.inner[match.group(1)]:
+                yield index, local + k, local + k + len(pattern), pattern
+
+
+class PoiClassifier:
+    """
+    Data-driven replacement for the per-POI substring checks in build_trip_location.
+
+    Rules are compiled once into one multi-pattern scanner per field. A page of names is
+    scanned in a single regex pass over the joined strings; AMap type strings come from a
+    small fixed category vocabulary, so each distinct type is scanned once and memoized.
+    Tags are kept as bitmasks until the final result is assembled.
+    """
+
+    def __init__(self, rules, type_cache_size=4096):
+        self.tag_order = []
+        self._actions = {field: {} for field in FIELDS}
+        for kind, field, pattern, value in rules:
+            if kind == "tag" and value not in self.tag_order:
+                self.tag_order.append(value)
+        tag_bits = {tag: 1 << i for i, tag in enumerate(self.tag_order)}
+        for kind, field, pattern, value in rules:
+            self._actions[field].setdefault(pattern, []).append((kind, tag_bits.get(value, 0)))
+        self._matchers = {field: _FieldMatcher(self._actions[field].keys()) for field in FIELDS}
+        # mask -> tags in table order; index 0 (no tag) maps to ["General"]
+        self._mask_tags = [
+            tuple(tag for tag in self.tag_order if mask & tag_bits[tag]) or ("General",)
+            for mask in range(1 << len(self.tag_order))
+        ]
+        self._type_cache = {}
+        self._type_cache_size = type_cache_size
+
+    @classmethod
+    def from_file(cls, path=RULES_FILE):
+        return cls(load_rules(path))
+
+    def _classify_type(self, poi_type):
+        mask = 0
+        has_gate = False
+        for _, _, pattern in self._matchers["type"].scan_one(poi_type):
+            for kind, bit in self._actions["type"][pattern]:
+                if kind == "tag":
+                    mask |= bit
+                elif kind == "gate_type":
+                    has_gate = True
+        info = (mask, has_gate)
+        if len(self._type_cache) >= self._type_cache_size:
+            self._type_cache.clear()
+        self._type_cache[poi_type] = info
+        return info
+
+    def _classify_name(self, name, matches):
+        mask = 0
+        entrance = ends_with_gate = False
+        gates = []
+        first_open = None
+        last_close = -1
+        for start, end, pattern in matches:
+            for kind, bit in self._actions["name"][pattern]:
+                if kind == "tag":
+                    mask |= bit
+                elif kind == "entrance":
+                    entrance = True
+                elif kind == "gate":
+                    gates.append((start, end))
+                    if end == len(name):
+                        ends_with_gate = True
+                elif kind == "bracket_open":
+                    if first_open is None or start < first_open:
+                        first_open = start
+                elif kind == "bracket_close":
+                    last_close = max(last_close, start)
+        # Same as re.search(r"[（(].*(gate).*[)）]"): an opening bracket before a gate marker
+        # and a closing bracket after it.
+        bracket_gate = first_open is not None and any(
+            start > first_open and end <= last_close for start, end in gates
+        )
+        return mask, entrance, ends_with_gate, bracket_gate
+
+    def classify_batch(self, pois):
+        """
+        Classify a list of AMap POI dicts.
+        Returns {"results": [per-POI dict], "tag_counts": {tag: n}} where each result holds
+        tags (["General"] when nothing matched) and the entrance flags
+        is_entrance_name / ends_with_gate / bracket_gate / type_has_gate.
+        """
+        names = [(poi.get("name") or "").strip() for poi in pois]
+
+        name_hits = {}
+        for index, start, end, pattern in self._matchers["name"].scan(names):
+            hits = name_hits.get(index)
+            if hits is None:
+                name_hits[index] = hits = []
+            hits.append((start, end, pattern))
+
+        type_cache = self._type_cache
+        mask_tags = self._mask_tags
+        mask_counts = {}
+        results = []
+        for index, poi in enumerate(pois):
+            poi_type = poi.get("type") or ""
+            type_info = type_cache.get(poi_type) or self._classify_type(poi_type)
+            mask = type_info[0]
+            hits = name_hits.get(index)
+            if hits is None:
+                entrance = ends_with_gate = bracket_gate = False
+            else:
+                name_mask, entrance, ends_with_gate, bracket_gate = self._classify_name(names[index], hits)
+                mask |= name_mask
+            mask_counts[mask] = mask_counts.get(mask, 0) + 1
+            results.append({
+                "tags": list(mask_tags[mask]),
+                "is_entrance_name": entrance,
+                "ends_with_gate": ends_with_gate,
+                "bracket_gate": bracket_gate,
+                "type_has_gate": type_info[1],
+            })
+
+        tag_counts = {tag: 0 for tag in self.tag_order}
+        for mask, count in mask_counts.items():
+            if mask:
+                for tag in mask_tags[mask]:
+                    tag_counts[tag] += count
+        return {"results": results, "tag_counts": tag_counts}
+
+
+_classifier = None
+
+
+def get_classifier():
+    global _classifier
+    if _classifier is None:
+        _classifier = PoiClassifier.from_file(os.getenv("POI_RULES_FILE", RULES_FILE))
+    return _classifier
@@ -0,0 +1,284 @@
+import asyncio
+import contextlib
+import contextvars
+import os
+import random
+import sqlite3
+import threading
+import time
+
+# Lower number = served first.
+PRIORITIES = {"interactive": 0, "agent": 1, "batch": 2}
+DEFAULT_PRIORITY = "interactive"
+
+# AMap infocodes that mean "slow down": daily quota and the various QPS limits.
+RATE_LIMIT_INFOCODES = {"10003", "10004", "10014", "10019", "10020", "10021", "10044"}
+# Of those, the ones worth retrying within a request (QPS, not daily quota).
+RETRYABLE_INFOCODES = {"10004", "10014", "10019", "10020", "10021"}
+
+# Upper bounds (seconds) of the queue-wait histogram buckets.
+WAIT_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Waiter registrations older than this are ignored (crashed processes must not starve others).
+WAITER_STALE_SECONDS = 5.0
+
+_current_priority = contextvars.ContextVar("amap_priority", default=None)
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+@contextlib.contextmanager
+def amap_priority(name):
+    """Run the enclosed AMap calls under a priority class (interactive / agent / batch)."""
+    if name not in PRIORITIES:
+        raise ValueError(f"Unknown AMap priority '{name}'")
+    token = _current_priority.set(name)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+def current_priority(explicit=None):
+    return explicit or _current_priority.get() or os.getenv("AMAP_PRIORITY") or DEFAULT_PRIORITY
+
+
+class RateLimiter:
+    """
+    Token bucket shared by every process on the host through a SQLite file.
+
+    Priority classes are enforced two ways: a class may not take a token while a higher
+    class is waiting, and lower classes must leave a reserve of tokens in the bucket so
+    interactive bursts are served immediately. When AMap answers with a rate-limit infocode
+    the shared rate is halved; it recovers linearly back to the configured QPS.
+    """
+
+    def __init__(self, path=None, qps=None, burst=None, reserves=None, min_qps=None, recovery=None):
+        self.path = path or os.getenv(
+            "AMAP_LIMITER_PATH", os.path.join("/tmp", "travelai_cache", "amap_limiter.sqlite3")
+        )
+        self.qps = qps or _env_float("AMAP_QPS", 10.0)
+        # Below one token the bucket could never serve a request
+        self.burst = max(1.0, burst or _env_float("AMAP_BURST", self.qps))
+        self.min_qps = min_qps or _env_float("AMAP_MIN_QPS", 1.0)
+        # QPS regained per second after a throttle event.
+        self.recovery = recovery or _env_float("AMAP_QPS_RECOVERY", self.qps / 60.0)
+        reserves = reserves or {
+            "interactive": 0.0,
+            "agent": _env_float("AMAP_AGENT_RESERVE", 1.0),
+            "batch": _env_float("AMAP_BATCH_RESERVE", max(2.0, self.burst / 3)),
+        }
+        # A class takes a token only when the bucket (capped at burst) holds 1 + its reserve,
+        # so a larger reserve would starve the class at low QPS.
+        self.reserves = {name: min(max(reserve, 0.0), self.burst - 1.0) for name, reserve in reserves.items()}
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._metrics = {
+            name: {"acquired": 0, "total_wait": 0.0, "max_wait": 0.0, "buckets": [0] * (len(WAIT_BUCKETS) + 1)}
+            for name in PRIORITIES
+        }
+        self.throttle_events = 0
+        self._init_db()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS bucket (id INTEGER PRIMARY KEY CHECK (id = 1), tokens REAL, updated_at REAL, rate REAL, rate_updated_at REAL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS waiters (pid INTEGER, priority INTEGER, count INTEGER, seen_at REAL, PRIMARY KEY (pid, priority))"
+        )
+        now = time.time()
+        conn.execute(
+            "INSERT OR IGNORE INTO bucket (id, tokens, updated_at, rate, rate_updated_at) VALUES (1, ?, ?, ?, ?)",
+            (self.burst, now, self.qps, now),
+        )
+
+    def _effective_rate(self, rate, rate_updated_at, now):
+        return min(self.qps, rate + max(0.0, now - rate_updated_at) * self.recovery)
+
+    def _register(self, level, delta):
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO waiters (pid, priority, count, seen_at) VALUES (?, ?, MAX(?, 0), ?) "
+            "ON CONFLICT(pid, priority) DO UPDATE SET count = MAX(count + ?, 0), seen_at = excluded.seen_at",
+            (os.getpid(), level, delta, time.time(), delta),
+        )
+
+    def _try_acquire(self, name):
+        """One attempt at taking a token; returns 0 on success or the suggested wait in seconds."""
+        level = PRIORITIES[name]
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            tokens, updated_at, rate, rate_updated_at = conn.execute(
+                "SELECT tokens, updated_at, rate, rate_updated_at FROM bucket WHERE id = 1"
+            ).fetchone()
+            rate = self._effective_rate(rate, rate_updated_at, now)
+            tokens = min(self.burst, tokens + max(0.0, now - updated_at) * rate)
+            higher_waiting = conn.execute(
+                "SELECT COALESCE(SUM(count), 0) FROM waiters WHERE priority < ? AND count > 0 AND seen_at > ?",
+                (level, now - WAITER_STALE_SECONDS),
+            ).fetchone()[0]
+            needed = 1.0 + self.reserves.get(name, 0.0)
+            if tokens >= needed and not higher_waiting:
+                conn.execute("UPDATE bucket SET tokens = ?, updated_at = ? WHERE id = 1", (tokens - 1.0, now))
+                conn.execute("COMMIT")
+                return 0.0
+            conn.execute("UPDATE bucket SET tokens = ?, updated_at = ? WHERE id = 1", (tokens, now))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        wait = max(needed - tokens, 0.0) / max(rate, 1e-6)
+        if higher_waiting:
+            wait = max(wait, 1.0 / max(rate, 1e-6))
+        # Jitter so processes polling the same bucket do not move in lockstep.
+        return min(max(wait, 0.005), 0.5) * random.uniform(0.8, 1.2)
+
+    def _observe(self, name, waited):
+        with self._lock:
+            metrics = self._metrics[name]
+            metrics["acquired"] += 1
+            metrics["total_wait"] += waited
+            metrics["max_wait"] = max(metrics["max_wait"], waited)
+            for i, bound in enumerate(WAIT_BUCKETS):
+                if waited <= bound:
+                    metrics["buckets"][i] += 1
+                    break
+            else:
+                metrics["buckets"][-1] += 1
+
+    def acquire(self, priority=None):
+        """Block until a token is available for the priority class; returns seconds waited."""
+        name = current_priority(priority)
+        started = time.monotonic()
+        wait = self._try_acquire(name)
+        if wait:
+            level = PRIORITIES[name]
+            self._register(level, 1)
+            try:
+                while wait:
+                    time.sleep(wait)
+                    self._register(level, 0)  # heartbeat
+                    wait = self._try_acquire(name)
+            finally:
+                self._register(level, -1)
+        waited = time.monotonic() - started
+        self._observe(name, waited)
+        return waited
+
+    async def acquire_async(self, priority=None):
+        """acquire() for the event loop: the SQLite transactions (which may wait on the file lock) run in a thread."""
+        name = current_priority(priority)
+        started = time.monotonic()
+        wait = await asyncio.to_thread(self._try_acquire, name)
+        if wait:
+            level = PRIORITIES[name]
+            await asyncio.to_thread(self._register, level, 1)
+            try:
+                while wait:
+                    await asyncio.sleep(wait)
+                    await asyncio.to_thread(self._register, level, 0)
+                    wait = await asyncio.to_thread(self._try_acquire, name)
+            finally:
+                await asyncio.to_thread(self._register, level, -1)
+        waited = time.monotonic() - started
+        self._observe(name, waited)
+        return waited
+
+    def report(self, data):
+        """
+        Feed an AMap JSON answer back into the limiter.
+        Returns True when it carried a rate-limit infocode (the shared rate is then halved).
+        """
+        if not isinstance(data, dict) or data.get("status") != "0":
+            return False
+        infocode = str(data.get("infocode", ""))
+        if infocode not in RATE_LIMIT_INFOCODES:
+            return False
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rate, rate_updated_at = conn.execute("SELECT rate, rate_updated_at FROM bucket WHERE id = 1").fetchone()
+            rate = max(self.min_qps, self._effective_rate(rate, rate_updated_at, now) / 2)
+            conn.execute(
+                "UPDATE bucket SET rate = ?, rate_updated_at = ?, tokens = 0, updated_at = ? WHERE id = 1",
+                (rate, now, now),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        with self._lock:
+            self.throttle_events += 1
+        print(f"AMap rate limit hit (infocode {infocode}); shared QPS lowered to {rate:.2f}")
+        return True
+
+    def stats(self):
+        now = time.time()
+        try:
+            tokens, updated_at, rate, rate_updated_at = self._conn().execute(
+                "SELECT tokens, updated_at, rate, rate_updated_at FROM bucket WHERE id = 1"
+            ).fetchone()
+            rate = self._effective_rate(rate, rate_updated_at, now)
+            tokens = min(self.burst, tokens + max(0.0, now - updated_at) * rate)
+            waiting = dict(self._conn().execute(
+                "SELECT priority, COALESCE(SUM(count), 0) FROM waiters WHERE seen_at > ? GROUP BY priority",
+                (now - WAITER_STALE_SECONDS,),
+            ).fetchall())
+        except sqlite3.Error:
+            tokens, rate, waiting = None, None, {}
+        with self._lock:
+            classes = {}
+            for name, metrics in self._metrics.items():
+                entry = dict(metrics)
+                entry["buckets"] = dict(zip([str(b) for b in WAIT_BUCKETS] + ["+Inf"], metrics["buckets"]))
+                entry["avg_wait_ms"] = round(1000 * metrics["total_wait"] / metrics["acquired"], 2) if metrics["acquired"] else 0.0
+                entry["waiting"] = waiting.get(PRIORITIES[name], 0)
+                classes[name] = entry
+            throttle_events = self.throttle_events
+        return {
+            "configured_qps": self.qps,
+            "current_qps": round(rate, 3) if rate is not None else None,
+            "burst": self.burst,
+            "tokens": round(tokens, 3) if tokens is not None else None,
+            "throttle_events": throttle_events,
+            "classes": classes,
+        }
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+_limiter_pid = None
+
+
+def get_rate_limiter():
+    """Process-wide limiter handle (the bucket itself lives in SQLite), or None if AMAP_RATE_LIMIT=0."""
+    global _limiter, _limiter_pid
+    if os.getenv("AMAP_RATE_LIMIT", "1") == "0":
+        return None
+    pid = os.getpid()
+    if _limiter is None or _limiter_pid != pid:
+        with _limiter_lock:
+            if _limiter is None or _limiter_pid != pid:
+                _limiter = RateLimiter()
+                _limiter_pid = pid
+    return _limiter
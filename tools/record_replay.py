@@ -0,0 +1,268 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import httpx
+from crewai_tools import SerperDevTool
+
+# off:    no recording, every call goes to the network
+# record: every call goes to the network and its response is stored
+# replay: responses only come from recordings; a missing one is an error (no network at all)
+# cache:  recorded responses are served, misses go to the network and are recorded
+RECORD_MODES = ("off", "record", "replay", "cache")
+
+
+class ReplayMissError(RuntimeError):
+    """Replay mode was asked for a request that has no recording."""
+
+
+def request_key(kind, request):
+    raw = json.dumps([kind, request], ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class Recorder:
+    """
+    Content-addressed store of external call results: {root}/{kind}/{key[:2]}/{key}.json,
+    where key is the sha256 of the canonical request. Files hold the request next to the
+    response, so a recordings directory can be reviewed and committed for CI runs.
+    """
+
+    def __init__(self, mode=None, root=None):
+        self.mode = mode or os.getenv("RECORD_MODE", "off")
+        if self.mode not in RECORD_MODES:
+            raise ValueError(f"Unknown RECORD_MODE '{self.mode}'")
+        self.root = root or os.getenv("RECORD_DIR", os.path.join("/tmp", "travelai_cache", "recordings"))
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    def _path(self, kind, key):
+        return os.path.join(self.root, kind, key[:2], f"{key}.json")
+
+    def _count(self, kind, name):
+        with self._lock:
+            counters = self._counters.setdefault(kind, {"hits": 0, "misses": 0, "recorded": 0})
+            counters[name] += 1
+
+    def load(self, kind, key):
+        """Recorded response for key, or None (recording mode always misses)."""
+        if self.mode in ("off", "record"):
+            return None
+        try:
+            with open(self._path(kind, key), "r", encoding="utf-8") as f:
+                response = json.load(f)["response"]
+        except (OSError, ValueError, KeyError):
+            self._count(kind, "misses")
+            if self.mode == "replay":
+                raise ReplayMissError(f"No {kind} recording for request {key[:12]} in {self.root}")
+            return None
+        self._count(kind, "hits")
+        return response
+
+    def save(self, kind, key, request, response):
+        if self.mode not in ("record", "cache"):
+            return
+        path = self._path(kind, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps({"kind": kind, "request": request, "response": response}, ensure_ascii=False, indent=1, default=str)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        self._count(kind, "recorded")
+
+    def call(self, kind, request, fn):
+        """Serve fn()'s result from the recordings when the mode allows, recording fresh results."""
+        if not self.enabled:
+            return fn()
+        key = request_key(kind, request)
+        response = self.load(kind, key)
+        if response is not None:
+            return response
+        response = fn()
+        self.save(kind, key, request, response)
+        return response
+
+    def clear(self, kind):
+        shutil.rmtree(os.path.join(self.root, kind), ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            counters = {kind: dict(c) for kind, c in self._counters.items()}
+        return {"mode": self.mode, "root": self.root, "kinds": counters}
+
+
+class _TeeStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """
+    Passes an upstream response body through chunk by chunk and hands the whole body to
+    on_complete once it was read to the end. The OpenAI client stops reading a stream at its
+    "data: [DONE]" event and closes it, so a body ending with that event counts as complete.
+    Bodies abandoned halfway are not recorded.
+    """
+
+    def __init__(self, upstream, on_complete):
+        self.upstream = upstream
+        self.on_complete = on_complete
+        self.chunks = []
+        self.completed = False
+
+    def _complete(self):
+        if self.completed:
+            return
+        self.completed = True
+        try:
+            self.on_complete(b"".join(self.chunks))
+        except Exception as e:
+            print(f"Recording Error: {e}")
+
+    def _closed(self):
+        if b"".join(self.chunks).rstrip().endswith(b"data: [DONE]"):
+            self._complete()
+
+    def __iter__(self):
+        for chunk in self.upstream.stream:
+            self.chunks.append(chunk)
+            yield chunk
+        self._complete()
+
+    async def __aiter__(self):
+        async for chunk in self.upstream.stream:
+            self.chunks.append(chunk)
+            yield chunk
+        self._complete()
+
+    def close(self):
+        self.upstream.close()
+        self._closed()
+
+    async def aclose(self):
+        await self.upstream.aclose()
+        self._closed()
+
+
+class RecordingTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """
+    httpx transport under the crews' OpenAI client, so record/replay sits where CrewAI
+    actually sends its completions: a recorded answer never reaches the network. Keys are the
+    request path and JSON body (model, messages, tools, temperature, stream ...), never the
+    API key. Live responses pass through chunk by chunk (streams keep streaming) while the
+    body is teed into the recording, which is saved once the body was read to the end.
+    Whole bodies are stored, streamed (SSE) ones included, so a replayed run still emits
+    every stream chunk and usage event. Only successful answers are recorded.
+    """
+
+    kind = "llm"
+
+    def __init__(self, recorder, transport=None, async_transport=None):
+        self.recorder = recorder
+        self.transport = transport or httpx.HTTPTransport()
+        self.async_transport = async_transport or httpx.AsyncHTTPTransport()
+
+    def _request(self, request):
+        try:
+            body = json.loads(request.content or b"{}")
+        except ValueError:
+            body = request.content.decode("utf-8", "replace")
+        return {"method": request.method, "path": request.url.path, "body": body}
+
+    def _lookup(self, request):
+        key = request_key(self.kind, self._request(request))
+        try:
+            return key, self.recorder.load(self.kind, key)
+        except ReplayMissError as e:
+            # The OpenAI client reports transport errors as a bare "Connection error"
+            print(f"Replay Error: {e}")
+            raise
+
+    def _store(self, key, request, response, raw):
+        if response.status_code >= 400:
+            return
+        # The tee sees the body as sent (possibly gzip); recordings hold it decoded
+        content = httpx.Response(response.status_code, headers=response.headers, content=raw).read()
+        recorded = {
+            "status": response.status_code,
+            "content_type": response.headers.get("content-type", "application/json"),
+            "body": content.decode("utf-8"),
+        }
+        self.recorder.save(self.kind, key, self._request(request), recorded)
+
+    def _response(self, request, recorded):
+        return httpx.Response(
+            recorded["status"],
+            headers={"content-type": recorded["content_type"]},
+            content=recorded["body"].encode("utf-8"),
+            request=request,
+        )
+
+    def _tee(self, key, request, response):
+        stream = _TeeStream(response, lambda raw: self._store(key, request, response, raw))
+        return httpx.Response(response.status_code, headers=response.headers, stream=stream, request=request)
+
+    def handle_request(self, request):
+        key, recorded = self._lookup(request)
+        if recorded is None:
+            return self._tee(key, request, self.transport.handle_request(request))
+        return self._response(request, recorded)
+
+    async def handle_async_request(self, request):
+        key, recorded = self._lookup(request)
+        if recorded is None:
+            return self._tee(key, request, await self.async_transport.handle_async_request(request))
+        return self._response(request, recorded)
+
+    def close(self):
+        self.transport.close()
+
+    async def aclose(self):
+        await self.async_transport.aclose()
+
+
+class RecordedSerperDevTool(SerperDevTool):
+    """SerperDevTool whose searches go through the Recorder."""
+
+    def _run(self, **kwargs):
+        search = super()._run
+        request = {
+            "args": kwargs,
+            "n_results": getattr(self, "n_results", None),
+            "country": getattr(self, "country", None),
+            "locale": getattr(self, "locale", None),
+        }
+        return get_recorder().call("serper", request, lambda: search(**kwargs))
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_recorder():
+    global _recorder
+    if _recorder is None:
+        with _recorder_lock:
+            if _recorder is None:
+                _recorder = Recorder()
+    return _recorder
+
+
+def get_llm_transport():
+    """Transport for the LLM's HTTP clients, or None when RECORD_MODE is off."""
+    recorder = get_recorder()
+    return RecordingTransport(recorder) if recorder.enabled else None
+
+
+def build_search_tool():
+    """Serper search tool, recorded unless RECORD_MODE is off."""
+    return RecordedSerperDevTool() if get_recorder().enabled else SerperDevTool()
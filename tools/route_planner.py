@@ -0,0 +1,167 @@
+import os
+import re
+from ortools.constraint_solver import routing_enums_pb2
+from ortools.constraint_solver import pywrapcp
+
+DEFAULT_SERVICE_HOURS = 2.0
+
+# Penalty (in minutes of travel) for leaving a stop out; large enough that a stop is only
+# dropped when no day can fit it.
+DROP_PENALTY = 100000
+
+# "08:00-17:30", "周一至周日 08:30~18:00", "9:00至21:00"
+_TIME_RANGE = re.compile(r"(\d{1,2})[:：](\d{2})\s*[-~～至到]\s*(\d{1,2})[:：](\d{2})")
+_CLOCK = re.compile(r"^\s*(\d{1,2})[:：](\d{2})\s*$")
+# "108.964,34.219" (spaces allowed around the comma); names like "Hilton, Xi'an" are not coordinates
+_COORD = re.compile(r"^\s*-?\d+(?:\.\d+)?\s*,\s*-?\d+(?:\.\d+)?\s*$")
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def parse_clock(text):
+    """"09:30" -> minutes after midnight, or None (also for times like "25:00")."""
+    match = _CLOCK.match(str(text or ""))
+    if not match:
+        return None
+    hour, minute = int(match.group(1)), int(match.group(2))
+    if hour > 23 or minute > 59:
+        return None
+    return hour * 60 + minute
+
+
+def parse_coord(text):
+    """"108.964, 34.219" -> "108.964,34.219", or None when the text is not a "lon,lat" pair."""
+    text = str(text or "")
+    return text.replace(" ", "").strip() if _COORD.match(text) else None
+
+
+def format_clock(minutes):
+    minutes = int(round(minutes))
+    return f"{minutes // 60 % 24:02d}:{minutes % 60:02d}"
+
+
+def parse_opening(text):
+    """First "HH:MM-HH:MM" range in an AMap opening-hours string -> (open, close) minutes, or None."""
+    match = _TIME_RANGE.search(str(text or ""))
+    if not match:
+        return None
+    h1, m1, h2, m2 = (int(g) for g in match.groups())
+    opens, closes = h1 * 60 + m1, h2 * 60 + m2
+    if closes <= opens:
+        # Open past midnight
+        closes += 24 * 60
+    return opens, closes
+
+
+def parse_stops(text):
+    """
+    Stops as "名称|停留小时|开放时间|经度,纬度" entries separated by ";" or new lines; every
+    field after the name is optional. Returns [{"name", "hours", "window", "coord"}].
+    """
+    stops = []
+    for entry in re.split(r"[;；\n]", str(text or "")):
+        fields = [f.strip() for f in entry.split("|")]
+        if not fields[0]:
+            continue
+        try:
+            hours = float(fields[1]) if len(fields) > 1 and fields[1] else DEFAULT_SERVICE_HOURS
+        except ValueError:
+            hours = DEFAULT_SERVICE_HOURS
+        coord = parse_coord(fields[3]) if len(fields) > 3 else None
+        stops.append({
+            "name": fields[0],
+            "hours": hours,
+            "window": parse_opening(fields[2]) if len(fields) > 2 else None,
+            "coord": coord,
+        })
+    return stops
+
+
+def solve_days(travel, service, windows, days, day_minutes, time_limit=None):
+    """
+    Multi-day routing as a vehicle routing problem: every day is a vehicle leaving the hotel
+    (node 0) at the start of the day and ending wherever its last stop is (open path, via a
+    free dummy end node). Each day holds at most `day_minutes` of travel, waiting and visits;
+    stops are visited inside their time windows (minutes after the day start, None for any
+    time). Solved by guided local search within `time_limit` seconds.
+
+    travel: minutes between nodes (node 0 is the hotel); service: visit minutes per node.
+    Returns {"days": [[(node, start minute), ...] per day], "dropped": [node, ...]}, or None
+    when the solver finds no solution.
+    """
+    time_limit = time_limit or _env_float("ROUTE_VRP_TIME_LIMIT", 2.0)
+    n = len(travel)
+    end = n
+    day_minutes = int(day_minutes)
+
+    # Stops whose window cannot hold the visit inside the day never enter the model.
+    dropped = []
+    ranges = {}
+    for node in range(1, n):
+        window = windows[node] or (0, day_minutes)
+        lo = max(0, int(window[0]))
+        hi = min(day_minutes, int(window[1])) - int(service[node])
+        if hi < lo:
+            dropped.append(node)
+        else:
+            ranges[node] = (lo, hi)
+
+    manager = pywrapcp.RoutingIndexManager(n + 1, days, [0] * days, [end] * days)
+    routing = pywrapcp.RoutingModel(manager)
+
+    def travel_callback(from_index, to_index):
+        i, j = manager.IndexToNode(from_index), manager.IndexToNode(to_index)
+        if i == end or j == end:
+            return 0
+        return int(travel[i][j])
+
+    def time_callback(from_index, to_index):
+        i = manager.IndexToNode(from_index)
+        if i == end:
+            return 0
+        return int(service[i]) + travel_callback(from_index, to_index)
+
+    routing.SetArcCostEvaluatorOfAllVehicles(routing.RegisterTransitCallback(travel_callback))
+    time_index = routing.RegisterTransitCallback(time_callback)
+    # Slack lets a day wait for an opening time; every day starts at the hotel at minute 0.
+    routing.AddDimension(time_index, day_minutes, day_minutes, True, "Time")
+    time_dimension = routing.GetDimensionOrDie("Time")
+    # Penalize the longest day so visits spread over the trip instead of piling into day 1.
+    time_dimension.SetGlobalSpanCostCoefficient(1)
+
+    for node in range(1, n):
+        index = manager.NodeToIndex(node)
+        routing.AddDisjunction([index], DROP_PENALTY)
+        if node in ranges:
+            time_dimension.CumulVar(index).SetRange(*ranges[node])
+        else:
+            routing.solver().Add(routing.ActiveVar(index) == 0)
+
+    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+    search_parameters.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
+    search_parameters.local_search_metaheuristic = routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
+    search_parameters.time_limit.FromMilliseconds(int(time_limit * 1000))
+
+    solution = routing.SolveWithParameters(search_parameters)
+    if not solution:
+        return None
+
+    schedule = []
+    visited = set()
+    for day in range(days):
+        stops = []
+        index = routing.Start(day)
+        index = solution.Value(routing.NextVar(index))
+        while not routing.IsEnd(index):
+            node = manager.IndexToNode(index)
+            stops.append((node, solution.Min(time_dimension.CumulVar(index))))
+            visited.add(node)
+            index = solution.Value(routing.NextVar(index))
+        schedule.append(stops)
+    dropped = sorted(set(dropped) | {node for node in range(1, n) if node not in visited})
+    return {"days": schedule, "dropped": dropped}
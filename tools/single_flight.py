@@ -0,0 +1,97 @@
+import asyncio
+import threading
+from concurrent.futures import CancelledError, Future
+
+
+class SingleFlight:
+    """
+    Collapse concurrent identical calls into one.
+    The first caller for a key (the leader) runs the work; callers arriving while it is in
+    flight wait on the same concurrent.futures.Future and share its result or exception.
+    Sync (threadpool) and async callers share one table, so a request started on one path
+    also serves waiters on the other.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._counters = {}
+
+    def _join(self, key, label):
+        """Return (future, is_leader) for key, registering a new flight if none is running."""
+        with self._lock:
+            counters = self._counters.setdefault(label, {"leaders": 0, "collapsed": 0})
+            future = self._calls.get(key)
+            if future is not None:
+                counters["collapsed"] += 1
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            counters["leaders"] += 1
+            return future, True
+
+    def _finish(self, key, future):
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    def do(self, key, fn, label="default"):
+        """Run fn() once for all concurrent callers with the same key (blocking)."""
+        while True:
+            future, leader = self._join(key, label)
+            if not leader:
+                try:
+                    return future.result()
+                except CancelledError:
+                    continue  # the leader was cancelled; take over
+            try:
+                result = fn()
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+            else:
+                future.set_result(result)
+                return result
+            finally:
+                self._finish(key, future)
+
+    async def do_async(self, key, coro_fn, label="default"):
+        """Async counterpart of do(); coro_fn is a zero-argument coroutine function."""
+        while True:
+            future, leader = self._join(key, label)
+            if not leader:
+                try:
+                    # shield: cancelling this waiter must not cancel the shared flight
+                    return await asyncio.shield(asyncio.wrap_future(future))
+                except asyncio.CancelledError:
+                    if future.cancelled():
+                        continue  # the leader was cancelled; take over
+                    raise
+            try:
+                result = await coro_fn()
+            except asyncio.CancelledError:
+                # Leader cancellation is not an answer; waiters retry instead of failing.
+                future.cancel()
+                raise
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+            else:
+                future.set_result(result)
+                return result
+            finally:
+                self._finish(key, future)
+
+    def stats(self):
+        with self._lock:
+            labels = {label: dict(counters) for label, counters in self._counters.items()}
+            in_flight = len(self._calls)
+        leaders = sum(c["leaders"] for c in labels.values())
+        collapsed = sum(c["collapsed"] for c in labels.values())
+        return {
+            "in_flight": in_flight,
+            "leaders": leaders,
+            "collapsed": collapsed,
+            "collapse_ratio": round(collapsed / (leaders + collapsed), 4) if leaders + collapsed else 0.0,
+            "by_endpoint": labels,
+        }
@@ -0,0 +1,231 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+
+# Params that identify the rendered image; the API key never takes part in the key.
+STATIC_MAP_PARAMS = ("center", "zoom", "size", "markers", "labels", "paths", "traffic", "scale")
+
+CACHE_CONTROL = "public, max-age=2592000, immutable"
+
+# Eviction frees space down to this share of max_bytes, so a full cache is not walked on every store.
+EVICT_TARGET = 0.9
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def normalize_params(params):
+    """Canonical form of the static map query: known params only, trimmed, in fixed order."""
+    normalized = []
+    for name in STATIC_MAP_PARAMS:
+        value = params.get(name)
+        if value is None or value == "":
+            continue
+        normalized.append((name, str(value).strip()))
+    return normalized
+
+
+def static_map_key(params):
+    raw = json.dumps(normalize_params(params), ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class StaticMapEntry:
+    def __init__(self, path, content, content_type, etag, last_modified):
+        self.path = path
+        # Read while the file exists; another worker's evict() may delete it at any time
+        self.content = content
+        self.content_type = content_type
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def headers(self):
+        return {
+            "ETag": self.etag,
+            "Last-Modified": formatdate(self.last_modified, usegmt=True),
+            "Cache-Control": CACHE_CONTROL,
+        }
+
+    def not_modified(self, if_none_match=None, if_modified_since=None):
+        """Evaluate conditional request headers (If-None-Match wins over If-Modified-Since)."""
+        if if_none_match:
+            tags = [t.strip() for t in if_none_match.split(",")]
+            return "*" in tags or self.etag in tags or f"W/{self.etag}" in tags
+        if if_modified_since:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(self.last_modified) <= int(since)
+        return False
+
+
+class StaticMapCache:
+    """
+    On-disk cache of AMap static map images, addressed by the normalized query params.
+    Files are sharded by key prefix; least recently served files are evicted once the
+    directory grows past max_bytes. Stores keep a running byte total, so the directory is
+    only walked when that total passes max_bytes or every `resync` seconds (other processes
+    write to the same directory).
+    """
+
+    def __init__(self, root=None, max_bytes=None, resync=None):
+        self.root = root or os.getenv(
+            "STATIC_MAP_CACHE_DIR", os.path.join("/tmp", "travelai_cache", "static_maps")
+        )
+        self.max_bytes = max_bytes or _env_int("STATIC_MAP_CACHE_MAX_BYTES", 256 * 1024 * 1024)
+        self.resync = resync if resync is not None else _env_int("STATIC_MAP_CACHE_RESYNC", 300)
+        os.makedirs(self.root, exist_ok=True)
+        self._lock = threading.Lock()
+        # Bytes on disk as of the last walk plus this process's stores since; None until the first walk
+        self._bytes = None
+        self._synced_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def _paths(self, key):
+        shard = os.path.join(self.root, key[:2])
+        return os.path.join(shard, f"{key}.img"), os.path.join(shard, f"{key}.json")
+
+    def lookup(self, params):
+        key = static_map_key(params)
+        image_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(image_path, "rb") as f:
+                stat = os.fstat(f.fileno())
+                content = f.read()
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            # mtime doubles as the LRU clock for eviction
+            os.utime(meta_path, None)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return StaticMapEntry(image_path, content, meta["content_type"], meta["etag"], meta.get("created_at", stat.st_mtime))
+
+    def store(self, params, content, content_type):
+        key = static_map_key(params)
+        image_path, meta_path = self._paths(key)
+        os.makedirs(os.path.dirname(image_path), exist_ok=True)
+        created_at = time.time()
+        etag = '"' + hashlib.sha256(content).hexdigest()[:32] + '"'
+        meta = {"content_type": content_type, "etag": etag, "created_at": created_at, "size": len(content)}
+
+        try:
+            replaced = os.path.getsize(image_path)
+        except OSError:
+            replaced = 0
+
+        # Write-then-rename so concurrent workers never serve a partial file.
+        self._atomic_write(image_path, content)
+        self._atomic_write(meta_path, json.dumps(meta).encode("utf-8"))
+        with self._lock:
+            self.stores += 1
+            if self._bytes is not None:
+                self._bytes += len(content) - replaced
+            due = (
+                self._bytes is None
+                or self._bytes > self.max_bytes
+                or time.monotonic() - self._synced_at >= self.resync
+            )
+        if due:
+            self.evict()
+        return StaticMapEntry(image_path, content, content_type, etag, created_at)
+
+    def _atomic_write(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def _entries(self):
+        entries = []
+        for shard in os.listdir(self.root):
+            shard_dir = os.path.join(self.root, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for name in os.listdir(shard_dir):
+                if not name.endswith(".img"):
+                    continue
+                image_path = os.path.join(shard_dir, name)
+                meta_path = image_path[:-4] + ".json"
+                try:
+                    size = os.path.getsize(image_path)
+                    used = os.path.getmtime(meta_path)
+                except OSError:
+                    continue
+                entries.append((used, size, image_path, meta_path))
+        return entries
+
+    def evict(self):
+        """Once over max_bytes, delete least recently served images down to EVICT_TARGET of it; resets the running total."""
+        synced_at = time.monotonic()
+        entries = self._entries()
+        total = sum(size for _, size, _, _ in entries)
+        if total > self.max_bytes:
+            target = self.max_bytes * EVICT_TARGET
+            entries.sort()
+            for _, size, image_path, meta_path in entries:
+                if total <= target:
+                    break
+                for path in (meta_path, image_path):
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
+                total -= size
+                with self._lock:
+                    self.evictions += 1
+        with self._lock:
+            self._bytes = total
+            self._synced_at = synced_at
+
+    def stats(self):
+        entries = self._entries()
+        with self._lock:
+            return {
+                "root": self.root,
+                "entries": len(entries),
+                "bytes": sum(size for _, size, _, _ in entries),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "evictions": self.evictions,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_static_map_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = StaticMapCache()
+    return _cache
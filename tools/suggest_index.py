@@ -0,0 +1,243 @@
+import bisect
+import csv
+import heapq
+import os
+import threading
+import time
+
+try:
+    from pypinyin import lazy_pinyin
+except ImportError:  # pinyin/initials keys are skipped without pypinyin
+    lazy_pinyin = None
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data_pipeline", "data")
+POIS_FILE = os.path.join(DATA_DIR, "cleaned_pois.csv")
+DIVISIONS_FILE = os.path.join(DATA_DIR, "admin_divisions.csv")
+
+# Longer suffixes first so "新疆维吾尔自治区" becomes "新疆", not "新疆维吾尔".
+DIVISION_SUFFIXES = ("特别行政区", "维吾尔自治区", "壮族自治区", "回族自治区", "自治区", "自治州", "省", "市", "区", "县")
+
+# Divisions outrank POIs for the same prefix; the landing page searches for destinations first.
+LEVEL_WEIGHTS = {"province": 4, "city": 5, "district": 3, "poi": 1}
+
+# Sorts after any character that can follow a prefix, so prefix + PREFIX_END bounds its key range.
+PREFIX_END = chr(0x10FFFF)
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def normalize(text):
+    return "".join(str(text).lower().split())
+
+
+def short_division_name(name):
+    for suffix in DIVISION_SUFFIXES:
+        if name.endswith(suffix) and len(name) - len(suffix) >= 2:
+            return name[: -len(suffix)]
+    return name
+
+
+def name_keys(name):
+    """Index keys for a place name: the name itself, full pinyin and pinyin initials."""
+    keys = {normalize(name)}
+    if lazy_pinyin is not None:
+        syllables = [s for s in lazy_pinyin(name, errors="ignore") if s]
+        if syllables:
+            keys.add(normalize("".join(syllables)))
+            keys.add(normalize("".join(s[0] for s in syllables)))
+    keys.discard("")
+    return keys
+
+
+def _read_csv(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def _file_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+class _Snapshot:
+    """Immutable index built from one version of the source files."""
+
+    def __init__(self, entries, pairs):
+        self.entries = entries
+        pairs.sort()
+        self.keys = [k for k, _ in pairs]
+        self.ids = [i for _, i in pairs]
+
+
+def build_snapshot(pois_file=POIS_FILE, divisions_file=DIVISIONS_FILE):
+    entries = []
+    pairs = []
+    seen = set()
+    adcodes = {}
+
+    for row in _read_csv(divisions_file):
+        name = (row.get("name") or "").strip()
+        adcode = (row.get("adcode") or "").strip()
+        level = (row.get("level") or "").strip()
+        if not name:
+            continue
+        province = (row.get("province") or "").strip()
+        city = (row.get("city") or "").strip()
+        adcodes[(province, city, name)] = adcode
+        district = "".join(p for p in (province, city) if p and p != name)
+        entry_id = len(entries)
+        entries.append({
+            "name": name,
+            "district": district,
+            "adcode": adcode,
+            "weight": LEVEL_WEIGHTS.get(level, 2),
+        })
+        for key in name_keys(name) | name_keys(short_division_name(name)):
+            pairs.append((key, entry_id))
+
+    for row in _read_csv(pois_file):
+        name = (row.get("name") or "").strip()
+        if not name or row.get("id") in seen:
+            continue
+        seen.add(row.get("id"))
+        province = (row.get("pname") or "").strip()
+        city = (row.get("cityname") or "").strip()
+        area = (row.get("adname") or "").strip()
+        # Municipalities repeat the province as city ("北京市北京市东城区"); AMap shows it once.
+        district = province + ("" if city == province else city) + area
+        adcode = (
+            adcodes.get((province, city, area))
+            or adcodes.get((province, "", city))
+            or adcodes.get(("", "", province), "")
+        )
+        try:
+            rating = float(row.get("rating") or 0)
+        except ValueError:
+            rating = 0.0
+        entry_id = len(entries)
+        entries.append({
+            "name": name,
+            "district": district,
+            "adcode": adcode,
+            "weight": LEVEL_WEIGHTS["poi"] + rating / 10,
+        })
+        for key in name_keys(name):
+            pairs.append((key, entry_id))
+
+    return _Snapshot(entries, pairs)
+
+
+class SuggestIndex:
+    """
+    In-memory prefix index over admin divisions and pipeline POIs.
+    Lookups are a bisect into a sorted key list; the index reloads itself in the
+    background when the pipeline rewrites its source CSVs.
+    """
+
+    def __init__(self, pois_file=POIS_FILE, divisions_file=DIVISIONS_FILE, reload_interval=None):
+        self.pois_file = pois_file
+        self.divisions_file = divisions_file
+        self.reload_interval = reload_interval if reload_interval is not None else _env_float("SUGGEST_RELOAD_INTERVAL", 30.0)
+        self._lock = threading.Lock()
+        self._reloading = False
+        self._next_check = 0.0
+        self._mtimes = self._source_mtimes()
+        self._snapshot = build_snapshot(pois_file, divisions_file)
+        self.built_at = time.time()
+        self.reloads = 0
+
+    def _source_mtimes(self):
+        return (_file_mtime(self.pois_file), _file_mtime(self.divisions_file))
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        with self._lock:
+            if self._reloading or now < self._next_check:
+                return
+            self._next_check = now + self.reload_interval
+            mtimes = self._source_mtimes()
+            if mtimes == self._mtimes:
+                return
+            self._reloading = True
+        threading.Thread(target=self._reload, args=(mtimes,), daemon=True).start()
+
+    def _reload(self, mtimes):
+        try:
+            snapshot = build_snapshot(self.pois_file, self.divisions_file)
+            # Single reference swap: readers see either the old or the new snapshot.
+            self._snapshot = snapshot
+            self._mtimes = mtimes
+            self.built_at = time.time()
+            self.reloads += 1
+            print(f"Suggestion index reloaded: {len(snapshot.entries)} entries")
+        except Exception as e:
+            print(f"Suggestion index reload failed: {e}")
+        finally:
+            with self._lock:
+                self._reloading = False
+
+    def search(self, query, limit=10):
+        """Return up to `limit` suggestions ({name, district, adcode}) whose keys start with query."""
+        self._maybe_reload()
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        snapshot = self._snapshot
+        keys = snapshot.keys
+        start = bisect.bisect_left(keys, prefix)
+        end = bisect.bisect_left(keys, prefix + PREFIX_END, start)
+        # The key equal to the prefix sorts first in its range
+        exact_end = bisect.bisect_right(keys, prefix, start, end)
+        exact = set(snapshot.ids[start:exact_end])
+        candidates = exact.union(snapshot.ids[exact_end:end])
+
+        # Every key with the prefix is ranked, not just the first few in key order
+        ranked = heapq.nsmallest(
+            limit,
+            candidates,
+            key=lambda entry_id: (
+                entry_id not in exact,
+                -snapshot.entries[entry_id]["weight"],
+                len(snapshot.entries[entry_id]["name"]),
+                entry_id,
+            ),
+        )
+        results = []
+        for entry_id in ranked:
+            entry = snapshot.entries[entry_id]
+            results.append({"name": entry["name"], "district": entry["district"], "adcode": entry["adcode"]})
+        return results
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            "entries": len(snapshot.entries),
+            "keys": len(snapshot.keys),
+            "pinyin": lazy_pinyin is not None,
+            "built_at": self.built_at,
+            "reloads": self.reloads,
+        }
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_suggest_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = SuggestIndex()
+    return _index
@@ -0,0 +1,449 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from tools.amap_client import amap_get_json
+from tools.distance_matrix import normalize_coord
+
+DIRECTION_URLS = {
+    "driving": "https://restapi.amap.com/v3/direction/driving",
+    "walking": "https://restapi.amap.com/v3/direction/walking",
+    "bicycling": "https://restapi.amap.com/v4/direction/bicycling", # v4 for bicycling
+    "transit": "https://restapi.amap.com/v3/direction/transit/integrated",
+}
+
+DAY = 24 * 3600
+
+# Traffic periods durations are kept for: (name, first hour, last hour).
+HOUR_BUCKETS = (
+    ("night", 0, 6),
+    ("morning_peak", 7, 9),
+    ("midday", 10, 16),
+    ("evening_peak", 17, 19),
+    ("evening", 20, 23),
+)
+
+# "2025-10-12 09:00", "09:00", "09:00 AM"
+_DEPARTURE = re.compile(r"^\s*(?:(\d{4}-\d{2}-\d{2})[ T]?)?\s*(?:(\d{1,2})[:：](\d{2}))?\s*([AaPp][Mm])?\s*$")
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def hour_bucket(hour):
+    return next(name for name, first, last in HOUR_BUCKETS if first <= hour <= last)
+
+
+def day_type(when):
+    return "weekend" if when.weekday() >= 5 else "weekday"
+
+
+def parse_departure(text, date=None):
+    """
+    "YYYY-MM-DD HH:MM" / "HH:MM" / "HH:MM AM" -> datetime (date defaults to `date`, then
+    today); None when empty or unparseable.
+    """
+    match = _DEPARTURE.match(str(text or ""))
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    day_text, hour, minute, meridiem = match.groups()
+    try:
+        day = datetime.strptime(day_text or date or "", "%Y-%m-%d")
+    except ValueError:
+        day = datetime.now()
+    hour, minute = int(hour or 9), int(minute or 0)
+    if meridiem and meridiem.lower() == "pm" and hour < 12:
+        hour += 12
+    elif meridiem and meridiem.lower() == "am" and hour == 12:
+        hour = 0
+    if hour > 23 or minute > 59:
+        return None
+    return day.replace(hour=hour, minute=minute, second=0, microsecond=0)
+
+
+def fetch_leg(api_key, origin_coords, dest_coords, mode, city, priority="agent", use_cache=True):
+    """
+    One AMap direction request: {"duration" s, "distance" m, "cost", "route"}, or {"error": ...}
+    ("no_route" or the API info) when AMap has no answer.
+    """
+    url = DIRECTION_URLS[mode]
+    params = {
+        "origin": origin_coords,
+        "destination": dest_coords,
+        "key": api_key,
+    }
+
+    if mode == "driving":
+        params["extensions"] = "base"
+    elif mode == "transit":
+        params["city"] = city
+        params["strategy"] = "0" # 0: Fastest
+
+    data = amap_get_json(url, params, use_cache=use_cache, priority=priority)
+    if not (data.get("status") == "1" or (mode == "bicycling" and data.get("errcode") == 0)):
+        return {"error": data.get("info") or data.get("errmsg") or "unknown"}
+
+    route = data.get("data") if mode == "bicycling" else data.get("route")
+    paths = route.get("paths") if route else None
+    transits = route.get("transits") if mode == "transit" and route else None
+
+    if mode == "transit":
+        if not transits:
+            return {"error": "no_route"}
+        path = transits[0] # Take the first (best) route
+        cost = path.get("cost", 0)
+        if isinstance(cost, str): cost = float(cost) if cost else 0
+        if isinstance(cost, list): cost = 0
+
+        segments = path.get("segments", [])
+        lines = []
+        for seg in segments:
+            bus = seg.get("bus", {}).get("buslines", [])
+            if bus: lines.append(bus[0]["name"])
+        route_desc = " -> ".join(lines) if lines else "Public Transit"
+    else:
+        if not paths:
+            return {"error": "no_route"}
+        path = paths[0]
+        cost = 0
+        if mode == "driving":
+            cost = float(path.get("tolls", 0))
+        route_desc = f"{mode.capitalize()} Route"
+
+    return {
+        "duration": int(path.get("duration", 0)),
+        "distance": int(path.get("distance", 0)),
+        "cost": cost,
+        "route": route_desc,
+    }
+
+
+class TravelTimeStore:
+    """
+    Expected leg durations keyed by (origin, destination, mode, city, weekday / weekend, hour
+    bucket), in a SQLite file shared by all workers. Every live direction answer updates the
+    entry of the period it was measured in (exponentially weighted, so one jam does not stick);
+    entries newer than `ttl` answer lookups without a network call. Leg lookups are counted
+    per pair so the warmer knows which pairs are popular.
+    """
+
+    def __init__(self, path=None, ttl=None, alpha=None):
+        self.path = path or os.getenv(
+            "TRAVEL_TIME_PATH", os.path.join("/tmp", "travelai_cache", "travel_times.sqlite3")
+        )
+        self.ttl = ttl if ttl is not None else _env_int("TRAVEL_TIME_TTL", 14 * DAY)
+        self.alpha = alpha or _env_float("TRAVEL_TIME_ALPHA", 0.3)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "other_period_hits": 0, "misses": 0, "records": 0, "matrix_cells": 0}
+        self._init_db()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS travel_times (origin TEXT, destination TEXT, mode TEXT, city TEXT, day_type TEXT, "
+            "bucket TEXT, duration REAL, distance INTEGER, cost REAL, route TEXT, samples INTEGER, updated_at REAL, "
+            "PRIMARY KEY (origin, destination, mode, city, day_type, bucket))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS pair_lookups (origin TEXT, destination TEXT, mode TEXT, city TEXT, lookups INTEGER, "
+            "last_lookup REAL, PRIMARY KEY (origin, destination, mode, city))"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT, expires_at REAL)")
+
+    def acquire_lease(self, name, owner, ttl):
+        """
+        Take or renew the named lease for `ttl` seconds; True while `owner` holds it. Processes
+        sharing the file use it to elect one of them for work that must not run in each.
+        """
+        now = time.time()
+        cursor = self._conn().execute(
+            "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE leases.owner = excluded.owner OR leases.expires_at < ?",
+            (name, owner, now + ttl, now),
+        )
+        return cursor.rowcount == 1
+
+    def release_lease(self, name, owner):
+        self._conn().execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    @staticmethod
+    def _period(when):
+        return day_type(when), hour_bucket(when.hour)
+
+    def lookup(self, origin, destination, mode, city, when):
+        """
+        The fresh leg for the period of `when` ({"duration", "distance", "cost", "route",
+        "exact": True}); failing that the most recent fresh entry of any other period for the
+        pair ("exact": False), or None.
+        """
+        origin, destination, city = normalize_coord(origin), normalize_coord(destination), city or ""
+        now = time.time()
+        try:
+            conn = self._conn()
+            conn.execute(
+                "INSERT INTO pair_lookups (origin, destination, mode, city, lookups, last_lookup) VALUES (?, ?, ?, ?, 1, ?) "
+                "ON CONFLICT (origin, destination, mode, city) DO UPDATE SET lookups = lookups + 1, last_lookup = excluded.last_lookup",
+                (origin, destination, mode, city, now),
+            )
+            row = conn.execute(
+                "SELECT duration, distance, cost, route, day_type = ? AND bucket = ? AS exact FROM travel_times "
+                "WHERE origin = ? AND destination = ? AND mode = ? AND city = ? AND updated_at > ? "
+                "ORDER BY exact DESC, updated_at DESC LIMIT 1",
+                (*self._period(when), origin, destination, mode, city, now - self.ttl),
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Travel time store read failed: {e}")
+            row = None
+        if row is None:
+            self._count("misses")
+            return None
+        self._count("hits" if row[4] else "other_period_hits")
+        return {"duration": int(round(row[0])), "distance": row[1], "cost": row[2], "route": row[3], "exact": bool(row[4])}
+
+    def durations(self, coords, mode, city, when):
+        """{(i, j): expected seconds} for the fresh entries between "lon,lat" points, in one query."""
+        points = [normalize_coord(c) for c in coords]
+        index = {}
+        for i, point in enumerate(points):
+            index.setdefault(point, []).append(i)
+        unique = list(index)
+        try:
+            rows = self._conn().execute(
+                f"SELECT origin, destination, duration FROM travel_times WHERE mode = ? AND city = ? AND day_type = ? "
+                f"AND bucket = ? AND updated_at > ? AND origin IN ({','.join('?' * len(unique))}) "
+                f"AND destination IN ({','.join('?' * len(unique))})",
+                [mode, city or "", *self._period(when), time.time() - self.ttl, *unique, *unique],
+            ).fetchall()
+        except sqlite3.Error as e:
+            print(f"Travel time store read failed: {e}")
+            return {}
+        found = {(i, j): duration for o, d, duration in rows for i in index[o] for j in index[d] if i != j}
+        self._count("matrix_cells", len(found))
+        return found
+
+    def record(self, origin, destination, mode, city, when, leg):
+        """Fold a live answer into the entry of the period it was measured in."""
+        origin, destination, city = normalize_coord(origin), normalize_coord(destination), city or ""
+        try:
+            self._conn().execute(
+                "INSERT INTO travel_times (origin, destination, mode, city, day_type, bucket, duration, distance, cost, route, "
+                "samples, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1, ?) "
+                "ON CONFLICT (origin, destination, mode, city, day_type, bucket) DO UPDATE SET "
+                "duration = duration + ? * (excluded.duration - duration), distance = excluded.distance, "
+                "cost = excluded.cost, route = excluded.route, samples = samples + 1, updated_at = excluded.updated_at",
+                (origin, destination, mode, city, *self._period(when), leg["duration"], leg["distance"], leg["cost"],
+                 leg["route"], time.time(), self.alpha),
+            )
+        except sqlite3.Error as e:
+            print(f"Travel time store write failed: {e}")
+            return
+        self._count("records")
+
+    def samples(self, mode, limit=2000):
+        """Recent (origin, destination, distance m, duration s) rows for a mode, across periods."""
+        try:
+            return self._conn().execute(
+                "SELECT origin, destination, distance, duration FROM travel_times WHERE mode = ? "
+                "ORDER BY updated_at DESC LIMIT ?",
+                (mode, limit),
+            ).fetchall()
+        except sqlite3.Error as e:
+            print(f"Travel time store read failed: {e}")
+            return []
+
+    def due(self, when, refresh, limit, min_lookups=2):
+        """Most looked-up pairs of the last 30 days whose entry for the period of `when` is older than `refresh`."""
+        now = time.time()
+        try:
+            return self._conn().execute(
+                "SELECT p.origin, p.destination, p.mode, p.city FROM pair_lookups p LEFT JOIN travel_times t "
+                "ON t.origin = p.origin AND t.destination = p.destination AND t.mode = p.mode AND t.city = p.city "
+                "AND t.day_type = ? AND t.bucket = ? "
+                "WHERE p.lookups >= ? AND p.last_lookup > ? AND (t.updated_at IS NULL OR t.updated_at < ?) "
+                "ORDER BY p.lookups DESC LIMIT ?",
+                (*self._period(when), min_lookups, now - 30 * DAY, now - refresh, limit),
+            ).fetchall()
+        except sqlite3.Error as e:
+            print(f"Travel time store read failed: {e}")
+            return []
+
+    def stats(self):
+        try:
+            entries = self._conn().execute(
+                "SELECT COUNT(*) FROM travel_times WHERE updated_at > ?", (time.time() - self.ttl,)
+            ).fetchone()[0]
+        except sqlite3.Error:
+            entries = None
+        with self._lock:
+            return dict(self._counters, entries=entries)
+
+
+def travel_leg(origin_coords, dest_coords, mode, city, departure=None, priority="agent"):
+    """
+    Leg between two "lon,lat" points for a departure time (default: now), from the travel time
+    store when it can answer: its entry for the departure's period, or, for departures outside
+    the current period (which a live request cannot measure), the pair's most recent entry of
+    another period. Otherwise AMap is asked live and the answer recorded for the current
+    period. Raises like amap_get_json on request errors.
+    """
+    store = get_travel_time_store()
+    now = datetime.now()
+    fallback = None
+    if store is not None:
+        when = departure or now
+        leg = store.lookup(origin_coords, dest_coords, mode, city, when)
+        if leg is not None:
+            exact = leg.pop("exact")
+            if exact or store._period(when) != store._period(now):
+                return dict(leg, source="store")
+            # Only another period is known; a live answer fills the current one
+            fallback = leg
+    # With the store on, live answers must be live: a cached response may come from another period.
+    leg = fetch_leg(os.getenv("AMAP_KEY"), origin_coords, dest_coords, mode, city, priority, use_cache=store is None)
+    if leg.get("error") and fallback is not None:
+        return dict(fallback, source="store")
+    if store is not None and not leg.get("error"):
+        store.record(origin_coords, dest_coords, mode, city, now, leg)
+    return dict(leg, source="live")
+
+
+class TravelTimeWarmer:
+    """
+    Background refresh of popular pairs: every `interval` seconds the most looked-up pairs
+    whose entry for the current period is older than `refresh` are re-measured at "batch"
+    priority, so planner lookups for common legs stay local. Every server worker starts a
+    warmer, but only the one holding the store's "warmer" lease runs the refresh, so the
+    warm-up requests are not repeated per worker against the shared rate budget.
+    """
+
+    lease = "warmer"
+
+    def __init__(self, store, interval=None, refresh=None, pairs=None):
+        self.store = store
+        self.interval = interval or _env_int("TRAVEL_TIME_WARM_INTERVAL", 1800)
+        self.refresh = refresh or _env_int("TRAVEL_TIME_REFRESH", 3 * DAY)
+        self.pairs = pairs or _env_int("TRAVEL_TIME_WARM_PAIRS", 50)
+        self._stop = threading.Event()
+        self._thread = None
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.runs = 0
+        self.refreshed = 0
+
+    def run_once(self):
+        api_key = os.getenv("AMAP_KEY")
+        if not api_key:
+            return 0
+        now = datetime.now()
+        refreshed = 0
+        for origin, destination, mode, city in self.store.due(now, self.refresh, self.pairs):
+            if self._stop.is_set():
+                break
+            try:
+                leg = fetch_leg(api_key, origin, destination, mode, city, priority="batch", use_cache=False)
+            except Exception as e:
+                print(f"Travel time warm-up failed for {origin} -> {destination}: {e}")
+                continue
+            if not leg.get("error"):
+                self.store.record(origin, destination, mode, city, now, leg)
+                refreshed += 1
+        self.runs += 1
+        self.refreshed += refreshed
+        return refreshed
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                # Held across cycles by renewing it; it lapses two intervals after its holder stops
+                if self.store.acquire_lease(self.lease, self.owner, 2 * self.interval):
+                    self.run_once()
+            except Exception as e:
+                print(f"Travel time warmer failed: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        try:
+            self.store.release_lease(self.lease, self.owner)
+        except sqlite3.Error as e:
+            print(f"Travel time warmer lease release failed: {e}")
+
+
+_store = None
+_store_lock = threading.Lock()
+_store_pid = None
+_warmer = None
+
+
+def get_travel_time_store():
+    """Process-wide TravelTimeStore, or None when disabled with TRAVEL_TIME_STORE=0."""
+    global _store, _store_pid
+    if os.getenv("TRAVEL_TIME_STORE", "1") == "0":
+        return None
+    pid = os.getpid()
+    if _store is None or _store_pid != pid:
+        with _store_lock:
+            if _store is None or _store_pid != pid:
+                _store = TravelTimeStore()
+                _store_pid = pid
+    return _store
+
+
+def start_travel_time_warmer():
+    """Start the background warmer unless the store or the warmer (TRAVEL_TIME_WARMER=0) is off."""
+    global _warmer
+    store = get_travel_time_store()
+    if store is None or os.getenv("TRAVEL_TIME_WARMER", "1") == "0":
+        return None
+    with _store_lock:
+        if _warmer is None:
+            _warmer = TravelTimeWarmer(store)
+            _warmer.start()
+    return _warmer
+
+
+def stop_travel_time_warmer():
+    if _warmer is not None:
+        _warmer.stop()
+
+
+def travel_time_stats():
+    store = get_travel_time_store()
+    if store is None:
+        return {"enabled": False}
+    stats = dict(store.stats(), enabled=True)
+    if _warmer is not None:
+        stats["warmer"] = {"runs": _warmer.runs, "refreshed": _warmer.refreshed}
+    return stats